@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import random
+from argparse import ArgumentParser
+
+# ==================================================================================
+# 生成测试用的转换列表: N个转换项，M个带tag/class过滤的output_type，并且分散到树状的多层include文件中
+# 同时生成空的数据源文件、协议文件和xresloader.jar，使转换列表可以直接被xresconv-cli加载
+
+GENERATOR_TAG_COUNT = 8
+GENERATOR_CLASS_COUNT = 4
+
+
+def write_text(file_path, content):
+    with open(file_path, "wb") as f:
+        f.write(content.encode("utf-8"))
+
+
+def generate_global(output_count, rng):
+    lines = [
+        "    <global>",
+        "        <work_dir>.</work_dir>",
+        "        <xresloader_path>xresloader.jar</xresloader_path>",
+        "        <proto>protobuf</proto>",
+        "        <proto_file>kind.pb</proto_file>",
+        "        <output_dir>out</output_dir>",
+        "        <data_src_dir>data</data_src_dir>",
+    ]
+    for idx in range(0, output_count):
+        attrs = ""
+        # 第一个输出不过滤，其他的按tag或class过滤
+        if idx % 3 == 1:
+            attrs = ' tag="tag{0} tag{1}"'.format(
+                rng.randrange(GENERATOR_TAG_COUNT), rng.randrange(GENERATOR_TAG_COUNT)
+            )
+        elif idx % 3 == 2:
+            attrs = ' class="class{0}"'.format(rng.randrange(GENERATOR_CLASS_COUNT))
+        lines.append('        <output_type rename="/(?i)\\.bin$/\\.{0}.bin/"{1}>bin</output_type>'.format(idx, attrs))
+    lines.append("    </global>")
+    return lines
+
+
+def generate_items(item_start, item_count, workbook_count, rng):
+    lines = ["    <list>"]
+    for idx in range(item_start, item_start + item_count):
+        lines.append(
+            '        <item name="item{0}" cat="bench" tag="tag{1}" class="class{2}">'.format(
+                idx, rng.randrange(GENERATOR_TAG_COUNT), rng.randrange(GENERATOR_CLASS_COUNT)
+            )
+        )
+        lines.append(
+            '            <scheme name="DataSource">book{0}.xlsx|sheet{1}|3,1</scheme>'.format(idx % workbook_count, idx)
+        )
+        lines.append('            <scheme name="ProtoName">item{0}_cfg</scheme>'.format(idx))
+        lines.append("        </item>")
+    lines.append("    </list>")
+    return lines
+
+
+def generate_list(out_dir, item_count, output_count, include_count, include_fanout, workbook_count, seed=0):
+    """ 返回根转换列表文件的路径 """
+    rng = random.Random(seed)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    data_dir = os.path.join(out_dir, "data")
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    for idx in range(0, workbook_count):
+        write_text(os.path.join(data_dir, "book{0}.xlsx".format(idx)), "")
+    write_text(os.path.join(out_dir, "kind.pb"), "")
+    write_text(os.path.join(out_dir, "xresloader.jar"), "")
+
+    # 转换项平均分到根文件和所有include文件，每个文件最多include include_fanout 个文件
+    file_count = include_count + 1
+    items_per_file = item_count // file_count
+    item_start = 0
+    file_names = ["root.xml"] + ["include{0}.xml".format(x) for x in range(0, include_count)]
+    for file_idx, file_name in enumerate(file_names):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<root>"]
+        for child_idx in range(1, file_count):
+            if (child_idx - 1) // max(1, include_fanout) == file_idx:
+                lines.append("    <include>{0}</include>".format(file_names[child_idx]))
+        if file_idx == 0:
+            lines.extend(generate_global(output_count, rng))
+
+        this_item_count = items_per_file
+        if file_idx == file_count - 1:
+            this_item_count = item_count - item_start
+        lines.extend(generate_items(item_start, this_item_count, workbook_count, rng))
+        item_start = item_start + this_item_count
+        lines.append("</root>")
+        write_text(os.path.join(out_dir, file_name), "\n".join(lines) + "\n")
+
+    return os.path.join(out_dir, file_names[0])
+
+
+def main():
+    parser = ArgumentParser(usage="%(prog)s [options...] <output dir>")
+    parser.add_argument(
+        "-n",
+        "--items",
+        action="store",
+        help="item count(default: 1000)",
+        metavar="<number>",
+        dest="items",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "-m",
+        "--outputs",
+        action="store",
+        help="output_type count(default: 4)",
+        metavar="<number>",
+        dest="outputs",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--includes",
+        action="store",
+        help="include file count(default: 4)",
+        metavar="<number>",
+        dest="includes",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--include-fanout",
+        action="store",
+        help="max include count of one file(default: 2)",
+        metavar="<number>",
+        dest="include_fanout",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--workbooks",
+        action="store",
+        help="data source file count(default: 50)",
+        metavar="<number>",
+        dest="workbooks",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "out_dir",
+        help="output dir",
+        metavar="<output dir>",
+    )
+    options = parser.parse_args()
+
+    root_file = generate_list(
+        options.out_dir, options.items, options.outputs, options.includes, options.include_fanout, options.workbooks
+    )
+    sys.stdout.write(root_file + os.linesep)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
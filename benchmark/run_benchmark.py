@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from generate_list import generate_list  # noqa: E402
+from xresconv_executor import ConvertExecutor, parse_dispatch_depth  # noqa: E402
+from xresconv_plan import ConvertPlan  # noqa: E402
+
+# ==================================================================================
+# xresconv-cli自身开销的基准测试，使用 generate_list.py 生成的转换列表和 stub_xresloader.py 代替真正的xresloader
+# 测量: 转换列表加载耗时、生成命令耗时、每个命令的调度开销、输出转发吞吐量和不同并发数的加速比
+
+
+def write_stub_launcher(out_dir):
+    """ 生成一个可以当作java执行的启动脚本，转发给 stub_xresloader.py """
+    stub_path = os.path.join(BENCHMARK_DIR, "stub_xresloader.py")
+    if "win32" == sys.platform:
+        launcher_path = os.path.join(out_dir, "java.bat")
+        content = '@"{0}" "{1}" %*\r\n'.format(sys.executable, stub_path)
+    else:
+        launcher_path = os.path.join(out_dir, "java")
+        content = '#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(sys.executable, stub_path)
+    with open(launcher_path, "wb") as f:
+        f.write(content.encode("utf-8"))
+    os.chmod(launcher_path, os.stat(launcher_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return launcher_path
+
+
+def best_of(repeat, func):
+    """ 执行 repeat 次，返回 (最短耗时, 最后一次的返回值) """
+    best_time = None
+    ret = None
+    for _ in range(0, repeat):
+        start_time = time.time()
+        ret = func()
+        cost_time = time.time() - start_time
+        if best_time is None or cost_time < best_time:
+            best_time = cost_time
+    return best_time, ret
+
+
+def load_plan(root_file, cache_file=None):
+    plan = ConvertPlan(root_file)
+    plan.load(cache_file)
+    return plan
+
+
+def run_commands(launcher_path, plan, cmd_list, parallelism, stub_env, dispatch_depth):
+    """ 执行时屏蔽所有输出，返回 (耗时, 失败数量) """
+    executor = ConvertExecutor(
+        {"java_path": launcher_path, "parallelism": parallelism, "dispatch_depth": dispatch_depth}
+    )
+    old_env = {}
+    for key in stub_env:
+        old_env[key] = os.environ.get(key)
+        os.environ[key] = str(stub_env[key])
+
+    devnull = open(os.devnull, "w")
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+    sys.stdout = devnull
+    sys.stderr = devnull
+    try:
+        start_time = time.time()
+        result = executor.run(plan, [dict(x) for x in cmd_list])
+        cost_time = time.time() - start_time
+    finally:
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        devnull.close()
+        for key in old_env:
+            if old_env[key] is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = old_env[key]
+        executor.close()
+    return cost_time, result["failed"]
+
+
+def report(results, name, value, unit):
+    results[name] = value
+    if isinstance(value, int):
+        value_text = "{0:>14d}".format(value)
+    else:
+        value_text = "{0:>14.4f}".format(value)
+    sys.stdout.write("  {0:<36} {1} {2}{3}".format(name, value_text, unit, os.linesep))
+    sys.stdout.flush()
+
+
+def main():
+    parser = ArgumentParser(usage="%(prog)s [options...]")
+    parser.add_argument(
+        "-n",
+        "--items",
+        action="store",
+        help="item count(default: 2000)",
+        metavar="<number>",
+        dest="items",
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        "-m",
+        "--outputs",
+        action="store",
+        help="output_type count(default: 6)",
+        metavar="<number>",
+        dest="outputs",
+        type=int,
+        default=6,
+    )
+    parser.add_argument(
+        "--includes",
+        action="store",
+        help="include file count(default: 8)",
+        metavar="<number>",
+        dest="includes",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-p",
+        "--parallelism",
+        action="append",
+        help="parallelism to measure scaling(default: 1 2 4)",
+        metavar="<number>",
+        dest="parallelism",
+        type=int,
+        default=[],
+    )
+    parser.add_argument(
+        "--delay",
+        action="store",
+        help="seconds per command of stub xresloader when measuring scaling(default: 0.002)",
+        metavar="<seconds>",
+        dest="delay",
+        type=float,
+        default=0.002,
+    )
+    parser.add_argument(
+        "--output-bytes",
+        action="store",
+        help="output bytes per command when measuring output forwarding(default: 8192)",
+        metavar="<bytes>",
+        dest="output_bytes",
+        type=int,
+        default=8192,
+    )
+    parser.add_argument(
+        "--dispatch-depth",
+        action="store",
+        help="--dispatch-depth of xresconv-cli used by all measurements(default: 0, only Python dispatch overhead)",
+        metavar="<number|gss>",
+        dest="dispatch_depth",
+        type=parse_dispatch_depth,
+        default=0,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        help="repeat every measurement and use the best(default: 3)",
+        metavar="<number>",
+        dest="repeat",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--work-dir",
+        action="store",
+        help="keep generated files in <dir> instead of a temporary dir",
+        metavar="<dir>",
+        dest="work_dir",
+        default=None,
+    )
+    parser.add_argument(
+        "--json",
+        action="store",
+        help="also write results into <file> as json",
+        metavar="<file>",
+        dest="json_file",
+        default=None,
+    )
+    options = parser.parse_args()
+    parallelism_list = options.parallelism or [1, 2, 4]
+
+    work_dir = options.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="xresconv-bench-")
+    results = {}
+    try:
+        root_file = generate_list(work_dir, options.items, options.outputs, options.includes, 2, 50)
+        launcher_path = write_stub_launcher(work_dir)
+        sys.stdout.write(
+            "items={0} outputs={1} includes={2} dispatch_depth={3} dir={4}{5}".format(
+                options.items, options.outputs, options.includes, options.dispatch_depth, work_dir, os.linesep
+            )
+        )
+
+        # ========================================= 转换计划 =========================================
+        cost_time, plan = best_of(options.repeat, lambda: load_plan(root_file))
+        report(results, "plan_load", cost_time, "s")
+
+        cache_file = os.path.join(work_dir, "root.xml.plan.json")
+        load_plan(root_file, cache_file)
+        cost_time, _ = best_of(options.repeat, lambda: load_plan(root_file, cache_file))
+        report(results, "plan_load_cached", cost_time, "s")
+
+        cost_time, cmd_list = best_of(options.repeat, lambda: plan.build_commands())
+        report(results, "build_commands", cost_time, "s")
+        report(results, "commands", len(cmd_list), "")
+
+        # ========================================= 调度开销 =========================================
+        # 命令不耗时也没有输出，测到的是启动stub和Python侧分发命令的开销
+        # dispatch_depth 不为0时还包含等待JVM读完命令的时间
+        results["dispatch_depth"] = options.dispatch_depth
+        cost_time, _ = best_of(
+            options.repeat,
+            lambda: run_commands(
+                launcher_path, plan, cmd_list, 1, {"XRESCONV_STUB_DELAY": 0}, options.dispatch_depth
+            ),
+        )
+        report(results, "dispatch_per_command", cost_time * 1000000.0 / max(1, len(cmd_list)), "us")
+
+        # ========================================= 输出转发 =========================================
+        cost_time, _ = best_of(
+            options.repeat,
+            lambda: run_commands(
+                launcher_path,
+                plan,
+                cmd_list,
+                1,
+                {"XRESCONV_STUB_OUTPUT_BYTES": options.output_bytes},
+                options.dispatch_depth,
+            ),
+        )
+        report(
+            results,
+            "output_forwarding",
+            float(options.output_bytes) * len(cmd_list) / max(cost_time, 0.000001) / (1024 * 1024),
+            "MB/s",
+        )
+
+        # ========================================= 并发 =========================================
+        base_time = None
+        for parallelism in parallelism_list:
+            cost_time, _ = best_of(
+                options.repeat,
+                lambda: run_commands(
+                    launcher_path,
+                    plan,
+                    cmd_list,
+                    parallelism,
+                    {"XRESCONV_STUB_DELAY": options.delay},
+                    options.dispatch_depth,
+                ),
+            )
+            if base_time is None:
+                base_time = cost_time
+            report(results, "wall_time_p{0}".format(parallelism), cost_time, "s")
+            report(results, "speedup_p{0}".format(parallelism), base_time / max(cost_time, 0.000001), "x")
+    finally:
+        if options.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if options.json_file:
+        with open(options.json_file, "wb") as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True).encode("utf-8"))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
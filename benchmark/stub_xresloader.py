@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+# ==================================================================================
+# 代替 java -jar xresloader.jar --stdin 的测试程序，用于测量xresconv-cli自身的开销
+# 忽略所有命令行参数，从标准输入逐行读取转换命令，返回码是失败的命令数量，和xresloader一致
+# 环境变量:
+#   XRESCONV_STUB_STARTUP       启动耗时(秒)，模拟JVM启动
+#   XRESCONV_STUB_DELAY         每个命令的耗时(秒)
+#   XRESCONV_STUB_OUTPUT_BYTES  每个命令输出到标准输出的字节数
+#   XRESCONV_STUB_FAIL          命令里包含这个字符串时算失败
+
+STUB_LINE_BYTES = 100
+
+
+def env_float(name, default_value):
+    try:
+        return float(os.environ.get(name, default_value))
+    except ValueError:
+        return default_value
+
+
+def main():
+    startup = env_float("XRESCONV_STUB_STARTUP", 0.0)
+    delay = env_float("XRESCONV_STUB_DELAY", 0.0)
+    output_bytes = int(env_float("XRESCONV_STUB_OUTPUT_BYTES", 0))
+    fail_pattern = os.environ.get("XRESCONV_STUB_FAIL", "")
+
+    if startup > 0:
+        time.sleep(startup)
+
+    if sys.version_info.major >= 3:
+        stdin = sys.stdin.buffer
+        stdout = sys.stdout.buffer
+    else:
+        stdin = sys.stdin
+        stdout = sys.stdout
+
+    padding_line = b"." * (STUB_LINE_BYTES - 1) + b"\n"
+    failed_count = 0
+    for line in iter(stdin.readline, b""):
+        line = line.strip()
+        if not line:
+            continue
+        if delay > 0:
+            time.sleep(delay)
+        if fail_pattern and fail_pattern.encode("utf-8") in line:
+            failed_count = failed_count + 1
+            stdout.write(b"[ERROR] convert failed: " + line + b"\n")
+        else:
+            stdout.write(b"[INFO] convert success: " + line + b"\n")
+        left_bytes = output_bytes
+        while left_bytes >= STUB_LINE_BYTES:
+            stdout.write(padding_line)
+            left_bytes = left_bytes - STUB_LINE_BYTES
+        if left_bytes > 0:
+            stdout.write(b"." * (left_bytes - 1) + b"\n")
+        stdout.flush()
+    return failed_count
+
+
+if __name__ == "__main__":
+    exit(main())
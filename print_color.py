@@ -6,14 +6,18 @@ import os
 import ctypes
 import platform
 import re
+import atexit
+import threading
+from collections import deque
 
 console_encoding = sys.getfilesystemencoding()
 
 
 class print_style:
-    version = "1.0.2.0"
+    version = "1.0.3.0"
     engine = None
     theme = None
+    sink = None
 
     FC_BLACK = 0
     FC_BLUE = 1
@@ -149,27 +153,26 @@ class TermColor:
         print_style.FW_BOLD: "1",
     }
 
-    def stdout_with_color(self, options, text):
+    def format_with_color(self, options, text):
         style = []
         for opt in options:
             style.append(TermColor.COLOR_MAP[opt])
 
         if len(style) > 0:
-            sys.stdout.write("\033[" + ";".join(style) + "m" + text +
-                             "\033[0m")
+            # reset before every line break, colors never leak into next line
+            prefix = "\033[" + ";".join(style) + "m"
+            return "".join([
+                prefix + line + "\033[0m" + eol if line else eol
+                for line, eol in cprintf_split_lines(text)
+            ])
         else:
-            sys.stdout.write(text)
+            return text
 
-    def stderr_with_color(self, options, text):
-        style = []
-        for opt in options:
-            style.append(TermColor.COLOR_MAP[opt])
+    def stdout_with_color(self, options, text):
+        sys.stdout.write(self.format_with_color(options, text))
 
-        if len(style) > 0:
-            sys.stderr.write("\033[" + ";".join(style) + "m" + text +
-                             "\033[0m")
-        else:
-            sys.stderr.write(text)
+    def stderr_with_color(self, options, text):
+        sys.stderr.write(self.format_with_color(options, text))
 
 
 class HtmlColor:
@@ -194,48 +197,43 @@ class HtmlColor:
         print_style.FW_BOLD: "font-weight: bold;",
     }
 
-    def stdout_with_color(self, options, text):
+    def __init__(self):
+        self.theme = print_style.theme
+
+    def format_with_color(self, options, text):
         style = []
         for opt in options:
-            if print_style.theme:
-                style.append(
-                    HtmlColor.COLOR_MAP[opt].format(print_style.theme + "-"))
+            if self.theme:
+                style.append(HtmlColor.COLOR_MAP[opt].format(
+                    self.theme + "-"))
             else:
                 style.append(HtmlColor.COLOR_MAP[opt].format(""))
 
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace(
+            '>', '&gt;')
         if len(style) > 0:
-            sys.stdout.write('<span style="' + " ".join(style) +
-                             '">' + text.replace('&', '&amp;').replace(
-                                 '<', '&lt;').replace('>', '&gt;') + "</span>")
+            # one span per line, so every line keeps its own color
+            prefix = '<span style="' + " ".join(style) + '">'
+            return "".join([
+                prefix + line + "</span>" + eol if line else eol
+                for line, eol in cprintf_split_lines(text)
+            ])
         else:
-            sys.stdout.write(
-                text.replace('&',
-                             '&amp;').replace('<',
-                                              '&lt;').replace('>', '&gt;'))
+            return text
 
-    def stderr_with_color(self, options, text):
-        style = []
-        for opt in options:
-            if print_style.theme:
-                style.append(
-                    HtmlColor.COLOR_MAP[opt].format(print_style.theme + "-"))
-            else:
-                style.append(HtmlColor.COLOR_MAP[opt].format(""))
+    def stdout_with_color(self, options, text):
+        sys.stdout.write(self.format_with_color(options, text))
 
-        if len(style) > 0:
-            sys.stderr.write('<span style="' + " ".join(style) +
-                             '">' + text.replace('&', '&amp;').replace(
-                                 '<', '&lt;').replace('>', '&gt;') + "</span>")
-        else:
-            sys.stderr.write(
-                text.replace('&',
-                             '&amp;').replace('<',
-                                              '&lt;').replace('>', '&gt;'))
+    def stderr_with_color(self, options, text):
+        sys.stderr.write(self.format_with_color(options, text))
 
 
 class NoneColor:
     name = "none"
 
+    def format_with_color(self, options, text):
+        return text
+
     def stdout_with_color(self, options, text):
         sys.stdout.write(text)
 
@@ -243,6 +241,134 @@ class NoneColor:
         sys.stderr.write(text)
 
 
+def cprintf_split_lines(text):
+    """
+    split text into [(line content, line break), ...],
+    the last line may have no line break
+    """
+    ret = []
+    for line in text.splitlines(True):
+        content = line.rstrip("\r\n")
+        ret.append((content, line[len(content):]))
+    return ret
+
+
+class ColorLogSink:
+    """
+    Collect colored messages from many threads and write them with one writer.
+    The engine and theme are resolved once, when the sink is created or
+        cprintf_set_mode/cprintf_set_theme is called.
+    flush_interval > 0: messages are queued and written by a writer thread in
+        batches, at most once every flush_interval seconds.
+        Each message is written in whole, so lines never interleave.
+    flush_interval <= 0: messages are written and flushed at once under a lock.
+    """
+
+    def __init__(self, flush_interval=0):
+        self.engine = print_style.engine()
+        self.flush_interval = flush_interval
+        # deque.append and deque.popleft are atomic, writers never wait
+        self.queue = deque()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = threading.Event()
+        self.writer = None
+        if flush_interval > 0:
+            self.writer = threading.Thread(target=self.run_writer,
+                                           name="cprintf sink")
+            self.writer.daemon = True
+            self.writer.start()
+
+    def reset_engine(self):
+        self.write_lock.acquire()
+        try:
+            self.write_entries(self.pop_entries())
+            self.engine = print_style.engine()
+        finally:
+            self.write_lock.release()
+
+    def write(self, stream, options, text):
+        """ options is None: write text as is, without the color engine """
+        if self.writer is None or self.closed.is_set():
+            self.write_lock.acquire()
+            try:
+                self.write_entries([(stream, options, text)])
+            finally:
+                self.write_lock.release()
+            return
+
+        self.queue.append((stream, options, text))
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def flush(self):
+        self.write_lock.acquire()
+        try:
+            self.write_entries(self.pop_entries())
+        finally:
+            self.write_lock.release()
+
+    def close(self):
+        self.closed.set()
+        if self.writer is not None:
+            self.wakeup.set()
+            self.writer.join()
+            self.writer = None
+        self.flush()
+
+    def run_writer(self):
+        while not self.closed.is_set():
+            self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except (EnvironmentError, ValueError):
+                # the output stream is closed, nothing can be written any more
+                pass
+            self.closed.wait(self.flush_interval)
+
+    def pop_entries(self):
+        ret = []
+        while self.queue:
+            ret.append(self.queue.popleft())
+        return ret
+
+    def write_entries(self, entries):
+        # consecutive messages of the same stream are joined and written at once
+        stream = None
+        texts = []
+        for entry_stream, options, text in entries:
+            if entry_stream is not stream:
+                self.write_stream(stream, texts)
+                stream = entry_stream
+                texts = []
+            if options is None:
+                texts.append(text)
+            elif hasattr(self.engine, "format_with_color"):
+                texts.append(self.engine.format_with_color(options, text))
+            else:
+                # windows console sets colors by API, the text can not be joined
+                self.write_stream(stream, texts)
+                texts = []
+                if stream is sys.stderr:
+                    self.engine.stderr_with_color(options, text)
+                else:
+                    self.engine.stdout_with_color(options, text)
+                stream.flush()
+        self.write_stream(stream, texts)
+
+    def write_stream(self, stream, texts):
+        if stream is None or not texts:
+            return
+        try:
+            stream.write("".join(texts))
+        except UnicodeError:
+            # python 2: unicode and encoded str can not be joined
+            for text in texts:
+                stream.write(text)
+        stream.flush()
+
+
 def cprintf_resolve_auto_mode():
     # set by environment variable
     if os.getenv("CPRINTF_MODE"):
@@ -323,6 +449,9 @@ def cprintf_set_mode(mode_name="auto"):
     else:
         print_style.engine = NoneColor
 
+    if print_style.sink is not None:
+        print_style.sink.reset_engine()
+
 
 def cprintf_set_theme(theme_name=None):
     if theme_name is None:
@@ -330,6 +459,32 @@ def cprintf_set_theme(theme_name=None):
             cprintf_set_theme(os.getenv("CPRINTF_THEME"))
     else:
         print_style.theme = theme_name
+        if print_style.sink is not None:
+            print_style.sink.reset_engine()
+
+
+def cprintf_open_sink(flush_interval=0):
+    """
+    replace the sink used by all cprintf_* functions,
+    queued messages of the old sink are written first
+    """
+    old_sink = print_style.sink
+    if old_sink is not None:
+        old_sink.close()
+    print_style.sink = ColorLogSink(flush_interval)
+    return print_style.sink
+
+
+def cprintf_flush():
+    print_style.sink.flush()
+
+
+def cprintf_write(stream, options, text):
+    """
+    write formatted text to stream(sys.stdout, sys.stderr...),
+    options is None: write text as is, without color
+    """
+    print_style.sink.write(stream, options, text)
 
 
 def cprintf_unpack_text(fmt, text):
@@ -348,18 +503,17 @@ def cprintf_unpack_text(fmt, text):
 
 
 def cprintf_stdout(options, fmt, *text):
-    cp = print_style.engine()
-    cp.stdout_with_color(options, cprintf_unpack_text(fmt, text))
-    sys.stdout.flush()
+    print_style.sink.write(sys.stdout, options, cprintf_unpack_text(fmt, text))
 
 
 def cprintf_stderr(options, fmt, *text):
-    cp = print_style.engine()
-    cp.stderr_with_color(options, cprintf_unpack_text(fmt, text))
-    sys.stderr.flush()
+    print_style.sink.write(sys.stderr, options, cprintf_unpack_text(fmt, text))
 
 
 cprintf_set_mode("auto")
+print_style.sink = ColorLogSink()
+# write out the queued messages before exit
+atexit.register(cprintf_flush)
 """ run as a executable """
 if __name__ == "__main__":
     from optparse import OptionParser
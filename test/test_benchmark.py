@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(os.path.dirname(TEST_DIR), "benchmark")
+sys.path.insert(0, BENCHMARK_DIR)
+
+from run_benchmark import generate_list, load_plan, run_commands, write_stub_launcher  # noqa: E402
+from xresconv_executor import ConvertExecutor  # noqa: E402
+
+# ==================================================================================
+# 使用 benchmark/stub_xresloader.py 代替xresloader的冒烟测试，不需要java和真正的xresloader
+
+
+def fail_pattern(cmd_list, index):
+    """ 返回 (stub判定失败的字符串, 会失败的命令列表)，同一个item输出多份时会有多个命令失败 """
+    pattern = cmd_list[index]["args"][-1].strip('"')
+    return pattern, [x for x in cmd_list if pattern in " ".join(x["args"])]
+
+
+class StubConvertTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="xresconv-test-")
+        self.root_file = generate_list(self.work_dir, 20, 2, 2, 2, 5)
+        self.launcher_path = write_stub_launcher(self.work_dir)
+        self.plan = load_plan(self.root_file)
+        self.cmd_list = self.plan.build_commands()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_dispatch_depth(self):
+        for dispatch_depth in [0, 1, "gss"]:
+            for parallelism in [1, 3]:
+                _, failed = run_commands(self.launcher_path, self.plan, self.cmd_list, parallelism, {}, dispatch_depth)
+                self.assertEqual(0, failed, "dispatch_depth={0} parallelism={1}".format(dispatch_depth, parallelism))
+
+    def test_failed_count(self):
+        pattern, failed_cmds = fail_pattern(self.cmd_list, 3)
+        stub_env = {"XRESCONV_STUB_FAIL": pattern, "XRESCONV_STUB_OUTPUT_BYTES": 4096}
+        for dispatch_depth in [0, 1, "gss"]:
+            _, failed = run_commands(self.launcher_path, self.plan, self.cmd_list, 2, stub_env, dispatch_depth)
+            self.assertEqual(len(failed_cmds), failed, "dispatch_depth={0}".format(dispatch_depth))
+
+    def test_failed_list(self):
+        # 一个JVM执行多个命令时只能拿到失败数量，--failed-list 要拆成单个命令重新执行才能定位到失败的命令
+        failed_list = os.path.join(self.work_dir, "failed.json")
+        executor = ConvertExecutor({"java_path": self.launcher_path, "parallelism": 1})
+        pattern, failed_cmds = fail_pattern(self.cmd_list, 5)
+        old_env = os.environ.get("XRESCONV_STUB_FAIL")
+        os.environ["XRESCONV_STUB_FAIL"] = pattern
+        devnull = open(os.devnull, "w")
+        old_stdout = sys.stdout
+        old_stderr = sys.stderr
+        sys.stdout = devnull
+        sys.stderr = devnull
+        try:
+            result = executor.run(self.plan, [dict(x) for x in self.cmd_list], failed_list=failed_list)
+        finally:
+            sys.stdout = old_stdout
+            sys.stderr = old_stderr
+            devnull.close()
+            if old_env is None:
+                del os.environ["XRESCONV_STUB_FAIL"]
+            else:
+                os.environ["XRESCONV_STUB_FAIL"] = old_env
+            executor.close()
+
+        self.assertEqual(len(failed_cmds), result["failed"])
+        with open(failed_list, "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        self.assertEqual(len(self.cmd_list), data["commands"])
+        self.assertEqual(len(failed_cmds), data["failed"])
+        self.assertEqual([x["key"] for x in failed_cmds], [x["key"] for x in data["failures"]])
+        self.assertEqual([True] * len(failed_cmds), [x["attributed"] for x in data["failures"]])
+
+
+class RunBenchmarkTest(unittest.TestCase):
+    def test_run_benchmark(self):
+        work_dir = tempfile.mkdtemp(prefix="xresconv-test-")
+        try:
+            json_file = os.path.join(work_dir, "result.json")
+            args = [sys.executable, os.path.join(BENCHMARK_DIR, "run_benchmark.py"), "-n", "40", "-m", "2"]
+            args.extend(["--includes", "2", "-p", "1", "-p", "2", "-r", "1", "--delay", "0"])
+            args.extend(["--output-bytes", "200", "--json", json_file])
+            devnull = open(os.devnull, "w")
+            try:
+                exit_code = subprocess.call(args, stdout=devnull, stderr=devnull)
+            finally:
+                devnull.close()
+            self.assertEqual(0, exit_code)
+
+            with open(json_file, "rb") as f:
+                results = json.loads(f.read().decode("utf-8"))
+            for key in ["plan_load", "plan_load_cached", "build_commands", "dispatch_per_command"]:
+                self.assertTrue(results[key] >= 0, key)
+            self.assertTrue(results["commands"] >= 40)
+            self.assertTrue(results["wall_time_p1"] > 0)
+            self.assertTrue(results["speedup_p2"] > 0)
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xresconv_incremental import IncrementalCache, hash_file_content  # noqa: E402
+
+
+def write_file(file_path, content, mtime):
+    with open(file_path, "wb") as f:
+        f.write(content)
+    os.utime(file_path, (mtime, mtime))
+
+
+class IncrementalCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.work_dir, "cache.json")
+        self.data_file = os.path.join(self.work_dir, "data.xlsx")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def reload_after_same_size_edit(self, mtime):
+        """ 写缓存后用相同大小的内容覆盖文件，并恢复原来的修改时间 """
+        write_file(self.data_file, b"version-1", mtime)
+        cache = IncrementalCache(self.cache_file)
+        old_hash = cache.file_hash(self.data_file)
+        cache.save()
+
+        write_file(self.data_file, b"version-2", mtime)
+        cache = IncrementalCache(self.cache_file)
+        self.assertTrue(cache.load())
+        return old_hash, cache.file_hash(self.data_file)
+
+    def test_trust_old_mtime(self):
+        # mtime早于写缓存的时间时只比较 mtime+size，这是增量转换省掉哈希的前提
+        old_hash, new_hash = self.reload_after_same_size_edit(time.time() - 100)
+        self.assertEqual(old_hash, new_hash)
+
+    def test_racy_mtime(self):
+        # mtime不早于写缓存的时间时，同一时间片内的修改检测不出来，必须重新计算哈希
+        old_hash, new_hash = self.reload_after_same_size_edit(time.time() + 100)
+        self.assertNotEqual(old_hash, new_hash)
+        self.assertEqual(hash_file_content(self.data_file), new_hash)
+
+    def test_missing_file(self):
+        cache = IncrementalCache(self.cache_file)
+        self.assertFalse(cache.load())
+        self.assertEqual("missing", cache.file_hash(self.data_file))
+
+    def test_checked_files(self):
+        write_file(self.data_file, b"version-1", time.time() + 100)
+        cache = IncrementalCache(self.cache_file)
+        old_hash = cache.file_hash(self.data_file)
+        write_file(self.data_file, b"version-2", time.time() + 100)
+        # 同一轮转换内只检查一次，watch模式每一轮开始时重置
+        self.assertEqual(old_hash, cache.file_hash(self.data_file))
+        cache.reset_checked_files()
+        self.assertNotEqual(old_hash, cache.file_hash(self.data_file))
+
+    def test_commands(self):
+        write_file(self.data_file, b"version-1", time.time() - 100)
+        cache = IncrementalCache(self.cache_file)
+        fingerprint = cache.fingerprint(["-m", "a"], ["data.xlsx"], ["v1"], self.work_dir)
+        self.assertFalse(cache.is_unchanged("a", fingerprint))
+        cache.mark_done("a", fingerprint)
+        cache.save()
+
+        cache = IncrementalCache(self.cache_file)
+        cache.load()
+        self.assertTrue(cache.is_unchanged("a", cache.fingerprint(["-m", "a"], ["data.xlsx"], ["v1"], self.work_dir)))
+        self.assertFalse(cache.is_unchanged("a", cache.fingerprint(["-m", "a"], ["data.xlsx"], ["v2"], self.work_dir)))
+        cache.mark_failed("a")
+        self.assertFalse(cache.is_unchanged("a", fingerprint))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xresconv_loader import load_include_graph, normalize_list_path  # noqa: E402
+from xresconv_plan import ConvertPlan  # noqa: E402
+
+LIST_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<root>
+<global>{globals}</global>
+{includes}
+<list>{items}</list>
+</root>
+"""
+
+
+def write_list(file_path, items, includes=None, globals_text="", mtime=None):
+    item_text = "".join(
+        ['<item name="{0}"><scheme name="DataSource">{0}.xlsx|s1|3,1</scheme></item>'.format(x) for x in items]
+    )
+    include_text = "".join(["<include>{0}</include>".format(x) for x in includes or []])
+    with open(file_path, "wb") as f:
+        f.write(LIST_TEMPLATE.format(globals=globals_text, includes=include_text, items=item_text).encode("utf-8"))
+    if mtime is not None:
+        os.utime(file_path, (mtime, mtime))
+
+
+class IncludeGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def path(self, file_name):
+        return normalize_list_path(os.path.join(self.work_dir, file_name))
+
+    def test_include_order(self):
+        write_list(self.path("root.xml"), ["r1"], ["a.xml", "b.xml"])
+        write_list(self.path("a.xml"), ["a1"], ["c.xml"])
+        write_list(self.path("b.xml"), ["b1"], ["c.xml"])
+        write_list(self.path("c.xml"), ["c1"])
+        files, _, items, cycles = load_include_graph(self.path("root.xml"))
+        # 被include的文件先于include它的文件，重复include的文件只加载一次
+        self.assertEqual([self.path(x) for x in ["c.xml", "a.xml", "b.xml", "root.xml"]], files)
+        self.assertEqual(["c1", "a1", "b1", "r1"], [x["node"].attrib["name"] for x in items])
+        self.assertEqual([], cycles)
+
+    def test_include_cycle(self):
+        write_list(self.path("a.xml"), ["a1"], ["b.xml"])
+        write_list(self.path("b.xml"), ["b1"], ["a.xml"])
+        files, _, items, cycles = load_include_graph(self.path("a.xml"))
+        self.assertEqual([self.path("b.xml"), self.path("a.xml")], files)
+        self.assertEqual(["b1", "a1"], [x["node"].attrib["name"] for x in items])
+        self.assertEqual([[self.path("a.xml"), self.path("b.xml"), self.path("a.xml")]], cycles)
+
+
+class PlanCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.root_file = os.path.join(self.work_dir, "root.xml")
+        self.sub_file = os.path.join(self.work_dir, "sub.xml")
+        self.cache_file = os.path.join(self.work_dir, "plan.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def load_plan(self):
+        plan = ConvertPlan(self.root_file)
+        return plan, plan.load(self.cache_file)
+
+    def test_cache_hit(self):
+        write_list(self.root_file, ["r1"], ["sub.xml"], "<unknown_tag>1</unknown_tag>")
+        write_list(self.sub_file, ["s1"], ["root.xml"])
+        plan, cache_hit = self.load_plan()
+        self.assertFalse(cache_hit)
+
+        cached_plan, cache_hit = self.load_plan()
+        self.assertTrue(cache_hit)
+        self.assertEqual([x["name"] for x in plan.items], [x["name"] for x in cached_plan.items])
+        self.assertEqual(plan.xml_files, cached_plan.xml_files)
+        # 循环include和告警要跟着缓存恢复，不然命中缓存时不会再提示
+        self.assertEqual(1, len(cached_plan.include_cycles))
+        self.assertEqual(plan.include_cycles, cached_plan.include_cycles)
+        self.assertEqual(["unknown global configure unknown_tag"], cached_plan.warnings)
+
+    def test_include_changed(self):
+        write_list(self.root_file, ["r1"], ["sub.xml"])
+        write_list(self.sub_file, ["s1"], mtime=time.time() - 100)
+        self.load_plan()
+
+        write_list(self.sub_file, ["s1", "s2"], mtime=time.time() - 100)
+        plan, cache_hit = self.load_plan()
+        self.assertFalse(cache_hit)
+        self.assertEqual(["s1", "s2", "r1"], [x["name"] for x in plan.items])
+
+    def test_racy_mtime(self):
+        # 修改时间不早于写缓存的时间，相同大小的修改也要能检测出来
+        racy_time = time.time() + 100
+        write_list(self.root_file, ["r1"], ["sub.xml"])
+        write_list(self.sub_file, ["s1"], mtime=racy_time)
+        self.load_plan()
+
+        write_list(self.sub_file, ["s2"], mtime=racy_time)
+        plan, cache_hit = self.load_plan()
+        self.assertFalse(cache_hit)
+        self.assertEqual(["s2", "r1"], [x["name"] for x in plan.items])
+
+    def test_rule_schemes_key(self):
+        write_list(self.root_file, ["r1"])
+        self.load_plan()
+        plan = ConvertPlan(self.root_file, rule_schemes=["rule.xml"])
+        self.assertFalse(plan.load(self.cache_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
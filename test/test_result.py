@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xresconv_result import (  # noqa: E402
+    failed_job_count,
+    failure_records,
+    is_batch_attributed,
+    split_failed_batch,
+)
+
+
+def make_cmd(name):
+    return {"key": name, "type": "bin", "args": ["-m", name], "item": {"name": name, "file": None}}
+
+
+class SplitFailedBatchTest(unittest.TestCase):
+    def test_keep_order_and_balance(self):
+        cmds = list(range(10))
+        chunks = split_failed_batch(cmds, 4)
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(cmds, [x for chunk in chunks for x in chunk])
+        sizes = [len(x) for x in chunks]
+        self.assertTrue(max(sizes) - min(sizes) <= 1)
+
+    def test_one_command_per_chunk(self):
+        # 拆分份数不少于命令数时每个命令一个JVM，用于 --failed-list 定位失败的命令
+        self.assertEqual([[1], [2], [3]], split_failed_batch([1, 2, 3], 3))
+        self.assertEqual([[1], [2], [3]], split_failed_batch([1, 2, 3], 100))
+
+    def test_at_least_one_chunk(self):
+        self.assertEqual([[1, 2, 3]], split_failed_batch([1, 2, 3], 0))
+
+
+class BatchResultTest(unittest.TestCase):
+    def test_attributed(self):
+        cmds = [make_cmd("a"), make_cmd("b")]
+        self.assertTrue(is_batch_attributed({"cmds": cmds, "failed": 0}))
+        self.assertTrue(is_batch_attributed({"cmds": cmds, "failed": 2}))
+        self.assertFalse(is_batch_attributed({"cmds": cmds, "failed": 1}))
+
+    def test_failed_job_count(self):
+        batches = [
+            {"cmds": [make_cmd("a"), make_cmd("b")], "failed": 1},
+            {"cmds": [make_cmd("c")], "failed": 0},
+            # 返回码大于命令数时(比如被信号结束)最多算整批失败
+            {"cmds": [make_cmd("d")], "failed": 143},
+        ]
+        self.assertEqual(2, failed_job_count(batches))
+
+    def test_failure_records(self):
+        batches = [
+            {"cmds": [make_cmd("a"), make_cmd("b")], "failed": 1},
+            {"cmds": [make_cmd("c")], "failed": 1},
+        ]
+        records = failure_records(batches)
+        self.assertEqual(["a", "b", "c"], [x["key"] for x in records])
+        self.assertEqual([False, False, True], [x["attributed"] for x in records])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xresconv_scheduler import (  # noqa: E402
+    assign_by_cost,
+    estimate_command_costs,
+    group_commands,
+    split_duration_by_cost,
+    split_large_groups,
+    split_session_durations,
+)
+
+
+def make_cmd(key, item, cost=None):
+    ret = {"key": key, "item": item}
+    if cost is not None:
+        ret["cost"] = cost
+    return ret
+
+
+class EstimateCostTest(unittest.TestCase):
+    def test_history_and_size(self):
+        item_a = {"name": "a", "size": 100}
+        item_b = {"name": "b", "size": 300}
+        item_c = {"name": "c", "size": 0}
+        cmds = [make_cmd("a", item_a), make_cmd("b", item_b), make_cmd("c", item_c)]
+        estimate_command_costs(cmds, {"a": 2.0}, lambda item: item["size"])
+        # 有记录的直接用上次的耗时，没有记录的按 耗时/字节 换算，大小未知的用平均耗时
+        self.assertAlmostEqual(2.0, cmds[0]["cost"])
+        self.assertAlmostEqual(6.0, cmds[1]["cost"])
+        self.assertAlmostEqual(2.0, cmds[2]["cost"])
+
+    def test_no_history(self):
+        cmds = [make_cmd("a", {"size": 10}), make_cmd("b", {"size": 30})]
+        estimate_command_costs(cmds, {}, lambda item: item["size"])
+        self.assertEqual([10.0, 30.0], [x["cost"] for x in cmds])
+
+
+class AssignByCostTest(unittest.TestCase):
+    def test_lpt(self):
+        groups = [{"key": str(x), "cost": float(x), "cmds": []} for x in [1, 3, 7, 4, 5]]
+        queues = assign_by_cost(groups, 2)
+        loads = sorted([sum([x["cost"] for x in queue]) for queue in queues])
+        self.assertEqual([10.0, 10.0], loads)
+        # 每个worker先执行耗时最长的组
+        for queue in queues:
+            costs = [x["cost"] for x in queue]
+            self.assertEqual(sorted(costs, reverse=True), costs)
+        self.assertEqual(7.0, queues[0][0]["cost"])
+
+    def test_more_workers_than_groups(self):
+        groups = [{"key": "a", "cost": 1.0, "cmds": []}]
+        queues = assign_by_cost(groups, 3)
+        self.assertEqual(3, len(queues))
+        self.assertEqual(1, sum([len(x) for x in queues]))
+
+    def test_group_and_split(self):
+        cmds = [make_cmd(str(x), None, 2.5) for x in range(0, 4)]
+        groups = group_commands(cmds, lambda cmd: "workbook")
+        self.assertEqual(1, len(groups))
+        self.assertAlmostEqual(10.0, groups[0]["cost"])
+        pieces = split_large_groups(groups, 5.0)
+        self.assertEqual([2, 2], [len(x["cmds"]) for x in pieces])
+        self.assertEqual(cmds, [x for piece in pieces for x in piece["cmds"]])
+
+
+class SplitDurationTest(unittest.TestCase):
+    def test_split_by_cost(self):
+        cmds = [{"cost": 1.0}, {"cost": 3.0}]
+        self.assertEqual([1.0, 3.0], split_duration_by_cost(cmds, 4.0))
+        self.assertEqual([2.0, 2.0], split_duration_by_cost([{}, {}], 4.0))
+
+    def test_drain_times(self):
+        cmds = [{"cost": 1.0}, {"cost": 1.0}, {"cost": 3.0}, {"cost": 1.0}]
+        # 第二批有两个命令，只有它们是按预估耗时分摊的
+        ret = split_session_durations(cmds, [1, 2, 1], [10.0, 11.0, 13.0], 14.0, 5.0)
+        self.assertEqual([(1.0, False), (0.5, True), (1.5, True), (1.0, False)], ret)
+
+    def test_without_drain_times(self):
+        self.assertEqual([(5.0, False)], split_session_durations([{"cost": 1.0}], [], [], 14.0, 5.0))
+        ret = split_session_durations([{"cost": 1.0}, {"cost": 4.0}], [2], [], 14.0, 5.0)
+        self.assertEqual([(1.0, True), (4.0, True)], ret)
+
+
+if __name__ == "__main__":
+    unittest.main()
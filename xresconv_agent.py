@@ -0,0 +1,790 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import hashlib
+import binascii
+import struct
+import threading
+from argparse import ArgumentParser
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from xresconv_daemon import (
+    FRAME_ERROR,
+    FRAME_EXIT,
+    FRAME_HEADER,
+    FRAME_STDERR,
+    FRAME_STDOUT,
+    OUTPUT_LINE_LIMIT,
+    DaemonProcess,
+    DrainReporter,
+    JvmPool,
+    JvmProfile,
+    recv_exact,
+    recv_line,
+    send_frame,
+)
+from xresconv_resource import (
+    MEMORY_RESERVED_MB,
+    MemoryBudget,
+    available_memory_mb,
+    cpu_pinning_java_options,
+    insert_java_option,
+    plan_cpu_pinning,
+    plan_jvm_memory,
+)
+
+# ==================================================================================
+# 分布式转换: 协调端(xresconv_cli.py --listen)生成转换命令并监听TCP端口，其他机器上的agent连接后拉取命令执行
+# agent所在机器需要有相同的数据目录，每个agent按 --slots 建立多个连接，每个连接同一时间执行一个xresloader JVM
+# 协调端把一个连接当成一个worker: 发送 FRAME_BEGIN 启动JVM，FRAME_STDIN 写入转换命令，FRAME_END 关闭标准输入
+# agent把JVM的输出和返回码按 xresconv_daemon 的帧格式发回，所以协调端可以把一个会话当作 subprocess.Popen 使用
+# xresloader只通过返回码报告失败数量，agent和本地JVM一样只能发回整个会话的返回码，失败的命令要靠 --retry 二分定位
+# 握手时双方用token对对方的随机数做HMAC证明自己知道token，token不会在网络上传输。握手之后的数据没有加密，不可信的网络需要使用VPN或SSH隧道
+# agent只接受 AGENT_JAVA_OPTION_PREFIXES 、 AGENT_JAVA_OPTION_FLAGS 里的java参数，工作目录和jar文件必须在 --root 下
+
+AGENT_PROTOCOL_VERSION = 2
+AGENT_HANDSHAKE_TIMEOUT = 10
+AGENT_DEFAULT_PORT = 17380
+
+FRAME_BEGIN = b"b"
+FRAME_STDIN = b"i"
+FRAME_END = b"n"
+# 取消转换时结束JVM，连接保持可用，之后仍然发送 FRAME_END 等待返回码
+FRAME_KILL = b"k"
+# 握手时协调端发给agent的随机数和证明
+FRAME_CHALLENGE = b"c"
+
+AGENT_NONCE_BYTES = 16
+AGENT_JAVA_OPTION_PREFIXES = [
+    "-Xmx",
+    "-Xms",
+    "-Xss",
+    "-Xmn",
+    "-Dfile.encoding=",
+    "-Duser.language=",
+    "-Duser.country=",
+    "-Duser.timezone=",
+    "-XX:ActiveProcessorCount=",
+    "-XX:ParallelGCThreads=",
+    "-XX:ConcGCThreads=",
+    "-XX:CICompilerCount=",
+    "-XX:MaxRAMPercentage=",
+    "-XX:InitialRAMPercentage=",
+    "-XX:MaxMetaspaceSize=",
+    "-XX:ReservedCodeCacheSize=",
+    "-XX:TieredStopAtLevel=",
+]
+AGENT_JAVA_OPTION_FLAGS = [
+    "-server",
+    "-XX:+UseSerialGC",
+    "-XX:+UseParallelGC",
+    "-XX:+UseG1GC",
+    "-XX:+TieredCompilation",
+    "-XX:-TieredCompilation",
+]
+
+
+def parse_address(address, default_host=""):
+    """ host:port 或 port """
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+    else:
+        host, port = default_host, address
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    return host, int(port)
+
+
+def new_nonce():
+    return binascii.hexlify(os.urandom(AGENT_NONCE_BYTES)).decode("utf-8")
+
+
+def auth_proof(token, role, first_nonce, second_nonce):
+    """ role 区分协调端和agent的证明，不能把对方的证明原样发回 """
+    message = "{0}:{1}:{2}".format(role, first_nonce, second_nonce)
+    return hmac.new((token or "").encode("utf-8"), message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def proof_equal(expected, proof):
+    if not isinstance(proof, type(u"")) and not isinstance(proof, str):
+        return False
+    expected = expected.encode("utf-8")
+    proof = proof.encode("utf-8")
+    if hasattr(hmac, "compare_digest"):
+        return hmac.compare_digest(expected, proof)
+    return expected == proof
+
+
+def is_sub_path(path, root):
+    path = os.path.normcase(os.path.realpath(path))
+    root = os.path.normcase(os.path.realpath(root))
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def is_loopback_host(host):
+    if not host:
+        return False
+    try:
+        return socket.gethostbyname(host).startswith("127.")
+    except EnvironmentError:
+        return False
+
+
+# ========================================= 协调端 =========================================
+class AgentInput:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent_bytes = 0
+
+    def write(self, data):
+        send_frame(self.connection.sock, self.connection.send_lock, FRAME_STDIN, data)
+        self.sent_bytes = self.sent_bytes + len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            send_frame(self.connection.sock, self.connection.send_lock, FRAME_END, b"")
+        except EnvironmentError:
+            pass
+
+
+class AgentProcess(DaemonProcess):
+    """ agent上的一个JVM会话，连接断开时返回码是-1，这个会话里的命令都算失败 """
+
+    def __init__(self, connection):
+        self.connection = connection
+        DaemonProcess.__init__(self, connection.sock, AgentInput(connection), True)
+
+    def wait(self):
+        self.done.wait()
+        if self.returncode is None:
+            if self.connection_lost:
+                self.connection.broken = True
+            self.returncode = -1
+        return self.returncode
+
+    def terminate(self):
+        self.mark_terminated()
+        try:
+            send_frame(self.connection.sock, self.connection.send_lock, FRAME_KILL, b"")
+        except EnvironmentError:
+            pass
+
+
+class AgentConnection:
+    def __init__(self, sock, name, address):
+        self.sock = sock
+        self.name = name
+        self.address = address
+        self.send_lock = threading.Lock()
+        self.broken = False
+
+    def open_process(self, cwd, java_options, xresloader_path):
+        """ java_options 不包含java可执行文件，agent使用自己的java """
+        request = {"cwd": cwd, "java_options": java_options, "jar": xresloader_path}
+        send_frame(self.sock, self.send_lock, FRAME_BEGIN, json.dumps(request).encode("utf-8"))
+        return AgentProcess(self)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except EnvironmentError:
+            pass
+
+
+class AgentServer:
+    """ 接受agent的连接
+        begin(serve_func) 到 end() 之间，每个空闲的连接(包括期间新建立的)都会在新线程里执行 serve_func(connection)
+    """
+
+    def __init__(self, address, token=None):
+        # 只给端口时只监听本机，监听其他地址时任何能连上的机器都能拉取命令，必须使用token
+        host, port = parse_address(address, "127.0.0.1")
+        if not token and not is_loopback_host(host):
+            raise ValueError("--agent-token is required when not listening on a loopback address")
+        self.token = token
+        self.lock = threading.Condition()
+        self.idle_agents = []
+        self.agent_count = 0
+        self.serve_func = None
+        self.serving_threads = []
+        self.running = True
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(64)
+        self.server.settimeout(1.0)
+        self.accept_thd = threading.Thread(target=self._accept_loop)
+        self.accept_thd.daemon = True
+        self.accept_thd.start()
+
+    @property
+    def address(self):
+        return self.server.getsockname()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, address = self.server.accept()
+            except socket.timeout:
+                continue
+            except EnvironmentError:
+                break
+            handshake_thd = threading.Thread(target=self._handshake, args=[conn, address])
+            handshake_thd.daemon = True
+            handshake_thd.start()
+
+    def _handshake(self, conn, address):
+        send_lock = threading.Lock()
+        try:
+            conn.settimeout(AGENT_HANDSHAKE_TIMEOUT)
+            header = recv_line(conn)
+            if header is None:
+                conn.close()
+                return
+            hello = json.loads(header.decode("utf-8"))
+            if hello.get("version") != AGENT_PROTOCOL_VERSION:
+                send_frame(conn, send_lock, FRAME_ERROR, b"protocol version mismatch")
+                conn.close()
+                return
+            agent_nonce = hello.get("nonce")
+            if not isinstance(agent_nonce, type(u"")) or len(agent_nonce) < AGENT_NONCE_BYTES:
+                send_frame(conn, send_lock, FRAME_ERROR, b"invalid nonce")
+                conn.close()
+                return
+            # 先证明协调端知道token，再验证agent的证明
+            nonce = new_nonce()
+            challenge = {"nonce": nonce, "proof": auth_proof(self.token, "coordinator", agent_nonce, nonce)}
+            send_frame(conn, send_lock, FRAME_CHALLENGE, json.dumps(challenge).encode("utf-8"))
+            header = recv_line(conn)
+            if header is None:
+                conn.close()
+                return
+            answer = json.loads(header.decode("utf-8"))
+            if not proof_equal(auth_proof(self.token, "agent", nonce, agent_nonce), answer.get("proof")):
+                send_frame(conn, send_lock, FRAME_ERROR, b"invalid token")
+                conn.close()
+                return
+            send_frame(conn, send_lock, FRAME_EXIT, struct.pack("!i", 0))
+            conn.settimeout(None)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (ValueError, AttributeError, EnvironmentError):
+            conn.close()
+            return
+
+        agent = AgentConnection(conn, hello.get("name") or address[0], address)
+        self.lock.acquire()
+        try:
+            self.agent_count = self.agent_count + 1
+            self._dispatch(agent)
+            self.lock.notify_all()
+        finally:
+            self.lock.release()
+
+    # 需要持有 self.lock
+    def _dispatch(self, agent):
+        if self.serve_func is None:
+            self.idle_agents.append(agent)
+            return
+        serve_thd = threading.Thread(target=self._serve_agent, args=[agent, self.serve_func])
+        serve_thd.start()
+        self.serving_threads.append(serve_thd)
+
+    def _serve_agent(self, agent, serve_func):
+        try:
+            serve_func(agent)
+        finally:
+            self.lock.acquire()
+            try:
+                if agent.broken:
+                    self.agent_count = self.agent_count - 1
+                    agent.close()
+                else:
+                    self.idle_agents.append(agent)
+            finally:
+                self.lock.release()
+
+    def wait_agents(self, count, timeout):
+        """ 等待至少 count 个agent连接，返回当前连接数 """
+        wait_until = time.time() + timeout
+        self.lock.acquire()
+        try:
+            while self.agent_count < count and time.time() < wait_until:
+                self.lock.wait(min(1.0, max(0.0, wait_until - time.time())))
+            return self.agent_count
+        finally:
+            self.lock.release()
+
+    def begin(self, serve_func):
+        self.lock.acquire()
+        try:
+            self.serve_func = serve_func
+            idle_agents = self.idle_agents
+            self.idle_agents = []
+            for agent in idle_agents:
+                self._dispatch(agent)
+        finally:
+            self.lock.release()
+
+    def end(self):
+        self.lock.acquire()
+        try:
+            self.serve_func = None
+            serving_threads = self.serving_threads
+            self.serving_threads = []
+        finally:
+            self.lock.release()
+        for thd in serving_threads:
+            thd.join()
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        self.lock.acquire()
+        try:
+            for agent in self.idle_agents:
+                agent.close()
+            self.idle_agents = []
+        finally:
+            self.lock.release()
+
+
+# ========================================= agent =========================================
+class AgentSlot:
+    """ agent到协调端的一个连接，按顺序执行协调端发来的JVM会话 """
+
+    def __init__(self, sock, settings, pool, slot_idx=0):
+        self.sock = sock
+        self.settings = settings
+        self.pool = pool
+        self.slot_idx = slot_idx
+        self.send_lock = threading.Lock()
+
+    def forward_output(self, pipe, frame_type, output_stat):
+        for output_line in iter(lambda: pipe.readline(OUTPUT_LINE_LIMIT), b""):
+            # 连接断开后也要继续读完输出，否则JVM会阻塞在写管道上
+            if not output_stat["alive"]:
+                continue
+            try:
+                send_frame(self.sock, self.send_lock, frame_type, output_line)
+            except EnvironmentError:
+                output_stat["alive"] = False
+
+    def check_request(self, request):
+        """ 检查协调端发来的会话，返回 (工作目录, java参数)，不允许的参数抛出 ValueError """
+        root = self.settings["root"]
+        cwd = self.settings["base_dir"] or request["cwd"]
+        if not is_sub_path(cwd, root):
+            raise ValueError("work dir {0} is not under {1}".format(cwd, root))
+        jar = request["jar"]
+        if not jar.lower().endswith(".jar") or not is_sub_path(os.path.join(cwd, jar), root):
+            raise ValueError("xresloader {0} is not a jar under {1}".format(jar, root))
+
+        java_options = request["java_options"]
+        if java_options[-3:] != ["-jar", jar, "--stdin"]:
+            raise ValueError("java options must end with -jar {0} --stdin".format(jar))
+        prefixes = AGENT_JAVA_OPTION_PREFIXES + self.settings["allow_java_options"]
+        for java_option in java_options[0:-3]:
+            if java_option in AGENT_JAVA_OPTION_FLAGS:
+                continue
+            if [x for x in prefixes if java_option.startswith(x)]:
+                continue
+            raise ValueError("java option {0} is not allowed, use --allow-java-option to allow it".format(java_option))
+        return cwd, [self.settings["java_path"]] + java_options
+
+    def begin_session(self, request):
+        cwd, java_options = self.check_request(request)
+        # 按本机内存设置堆大小，超出内存预算时排队等待本机其他JVM退出
+        memory_size_mb = 0
+        pool_size = self.settings["slots"]
+        if self.settings["memory_budget"] is not None:
+            memory_plan = plan_jvm_memory(java_options, self.settings["slots"], self.settings["memory_mb"])
+            if memory_plan["heap_option"]:
+                java_options = insert_java_option(java_options, memory_plan["heap_option"])
+            memory_size_mb = memory_plan["footprint_mb"]
+            # 预先启动的JVM不受内存预算控制
+            pool_size = 0
+            self.settings["memory_budget"].acquire(memory_size_mb)
+
+        # 每个slot绑定自己的CPU，预先启动的JVM也按slot区分
+        cpu_set = None
+        cpu_plan = self.settings["cpu_plan"]
+        if cpu_plan is not None and cpu_plan["cpu_sets"]:
+            java_options = cpu_pinning_java_options(java_options, cpu_plan["active_processors"])
+            cpu_set = cpu_plan["cpu_sets"][self.slot_idx % len(cpu_plan["cpu_sets"])]
+            pool_size = min(pool_size, 1)
+
+        profile = JvmProfile({"cwd": cwd, "java_options": java_options, "jar": request["jar"], "cpu_set": cpu_set})
+        try:
+            pexec = self.pool.acquire(profile, pool_size)
+        except EnvironmentError:
+            if memory_size_mb > 0:
+                self.settings["memory_budget"].release(memory_size_mb)
+            raise
+        # 在转发输出之前发送，协调端收到的第一条消息是 FRAME_DRAINED 时才会等待JVM读完命令再分发
+        drain_reporter = DrainReporter(
+            pexec.stdin, lambda frame_type, data: send_frame(self.sock, self.send_lock, frame_type, data)
+        )
+        output_stat = {"alive": True}
+        output_threads = [
+            threading.Thread(target=self.forward_output, args=[pexec.stdout, FRAME_STDOUT, output_stat]),
+            threading.Thread(target=self.forward_output, args=[pexec.stderr, FRAME_STDERR, output_stat]),
+        ]
+        for thd in output_threads:
+            thd.start()
+        session = {
+            "pexec": pexec,
+            "threads": output_threads,
+            "stdin_alive": True,
+            "memory_size_mb": memory_size_mb,
+            "drain_reporter": drain_reporter,
+            "input": queue.Queue(),
+        }
+        session["writer"] = threading.Thread(target=self.write_input, args=[session])
+        session["writer"].start()
+        return session
+
+    def write_input(self, session):
+        """ 在单独的线程里写入JVM的标准输入，None表示输入结束，之后等待JVM退出并发回返回码
+            写入阻塞时接收消息的线程仍然可以处理 FRAME_KILL
+        """
+        while True:
+            data = session["input"].get()
+            if data is None:
+                break
+            # JVM提前退出时丢弃剩下的输入，返回码里会包含失败数量
+            if not session["stdin_alive"]:
+                continue
+            try:
+                session["pexec"].stdin.write(data)
+                session["pexec"].stdin.flush()
+                session["drain_reporter"].add_written(len(data))
+            except EnvironmentError:
+                session["stdin_alive"] = False
+        exit_code = self.close_session(session)
+        try:
+            send_frame(self.sock, self.send_lock, FRAME_EXIT, struct.pack("!i", exit_code))
+        except EnvironmentError:
+            pass
+
+    def close_session(self, session):
+        """ 关闭标准输入并等待JVM退出，返回JVM的返回码 """
+        pexec = session["pexec"]
+        session["drain_reporter"].close()
+        try:
+            pexec.stdin.close()
+        except EnvironmentError:
+            pass
+        for thd in session["threads"]:
+            thd.join()
+        exit_code = pexec.wait()
+        if session["memory_size_mb"] > 0:
+            self.settings["memory_budget"].release(session["memory_size_mb"])
+        return exit_code
+
+    def serve(self):
+        session = None
+        last_session = None
+        session_error = None
+        while True:
+            header = recv_exact(self.sock, FRAME_HEADER.size)
+            if header is None:
+                break
+            frame_type, frame_len = FRAME_HEADER.unpack(header)
+            payload = recv_exact(self.sock, frame_len)
+            if payload is None:
+                break
+
+            if FRAME_BEGIN == frame_type:
+                try:
+                    session = self.begin_session(json.loads(payload.decode("utf-8")))
+                    last_session = session
+                    session_error = None
+                except (ValueError, KeyError, TypeError, EnvironmentError) as ex:
+                    session = None
+                    session_error = str(ex)
+                    sys.stderr.write("[ERROR] slot {0}: refused session: {1}{2}".format(self.slot_idx, ex, os.linesep))
+            elif FRAME_STDIN == frame_type:
+                if session is not None:
+                    session["input"].put(payload)
+            elif FRAME_KILL == frame_type:
+                # FRAME_END 之后JVM可能还在运行，结束最近的一个会话
+                if last_session is not None and last_session["pexec"].poll() is None:
+                    last_session["stdin_alive"] = False
+                    try:
+                        last_session["pexec"].terminate()
+                    except EnvironmentError:
+                        pass
+            elif FRAME_END == frame_type:
+                if session is not None:
+                    session["input"].put(None)
+                else:
+                    send_frame(self.sock, self.send_lock, FRAME_ERROR, (session_error or "no session").encode("utf-8"))
+                session = None
+
+        # 连接断开后结果无法发回，协调端会把这些命令交给其他worker，直接结束JVM
+        if session is not None:
+            session["input"].put(None)
+        if last_session is not None:
+            last_session["stdin_alive"] = False
+            try:
+                if last_session["pexec"].poll() is None:
+                    last_session["pexec"].terminate()
+            except EnvironmentError:
+                pass
+            last_session["writer"].join()
+
+
+def connect_coordinator(address, settings, slot_idx):
+    """ 连接协调端并握手，失败时抛出 EnvironmentError """
+    host, port = parse_address(address, "127.0.0.1")
+    sock = socket.create_connection((host, port), AGENT_HANDSHAKE_TIMEOUT)
+    try:
+        nonce = new_nonce()
+        hello = {
+            "version": AGENT_PROTOCOL_VERSION,
+            "name": "{0}/{1}".format(settings["name"], slot_idx),
+            "nonce": nonce,
+        }
+        sock.sendall(json.dumps(hello).encode("utf-8") + b"\n")
+        frame_type, payload = recv_handshake_frame(sock)
+        if FRAME_CHALLENGE != frame_type:
+            raise EnvironmentError("coordinator refused: {0}".format(payload.decode("utf-8", "replace")))
+        try:
+            challenge = json.loads(payload.decode("utf-8"))
+            coordinator_nonce = challenge["nonce"]
+            coordinator_proof = challenge["proof"]
+        except (ValueError, KeyError, TypeError):
+            raise EnvironmentError("invalid challenge from coordinator")
+        # 协调端不知道token时不执行它发来的任何命令
+        if not proof_equal(auth_proof(settings["token"], "coordinator", nonce, coordinator_nonce), coordinator_proof):
+            raise EnvironmentError("coordinator failed to prove the token")
+        answer = {"proof": auth_proof(settings["token"], "agent", coordinator_nonce, nonce)}
+        sock.sendall(json.dumps(answer).encode("utf-8") + b"\n")
+        frame_type, payload = recv_handshake_frame(sock)
+        if FRAME_EXIT != frame_type:
+            raise EnvironmentError("coordinator refused: {0}".format(payload.decode("utf-8", "replace")))
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (EnvironmentError, socket.timeout):
+        sock.close()
+        raise
+    return sock
+
+
+def recv_handshake_frame(sock):
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        raise EnvironmentError("coordinator closed the connection")
+    frame_type, frame_len = FRAME_HEADER.unpack(header)
+    payload = recv_exact(sock, frame_len)
+    if payload is None:
+        raise EnvironmentError("coordinator closed the connection")
+    return frame_type, payload
+
+
+def run_slot(address, settings, pool, slot_idx):
+    wait_until = time.time() + settings["connect_timeout"]
+    while True:
+        try:
+            sock = connect_coordinator(address, settings, slot_idx)
+        except EnvironmentError as ex:
+            if time.time() > wait_until:
+                sys.stderr.write(
+                    "[ERROR] slot {0}: connect {1} failed: {2}{3}".format(slot_idx, address, ex, os.linesep)
+                )
+                return
+            time.sleep(0.5)
+            continue
+
+        try:
+            AgentSlot(sock, settings, pool, slot_idx).serve()
+        except EnvironmentError:
+            pass
+        finally:
+            sock.close()
+        if not settings["forever"]:
+            return
+        wait_until = time.time() + settings["connect_timeout"]
+
+
+def main():
+    parser = ArgumentParser(usage="%(prog)s [options...] <coordinator address>")
+    parser.add_argument(
+        "-p",
+        "--slots",
+        action="store",
+        help="number of JVMs run concurrently on this agent(default: 2)",
+        metavar="<number>",
+        dest="slots",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "-J",
+        "--java-path",
+        action="store",
+        help="set path to java",
+        metavar="<java path>",
+        dest="java_path",
+        default=None,
+    )
+    parser.add_argument(
+        "--base-dir",
+        action="store",
+        help="run xresloader in <dir> instead of the work dir of coordinator, for a checkout at another path",
+        metavar="<dir>",
+        dest="base_dir",
+        default=None,
+    )
+    parser.add_argument(
+        "--root",
+        action="store",
+        help="only run xresloader jar and work dir under <dir>(default: --base-dir or current dir)",
+        metavar="<dir>",
+        dest="root",
+        default=None,
+    )
+    parser.add_argument(
+        "--allow-java-option",
+        action="append",
+        help="also accept java options from coordinator starting with <prefix>(example: -XX:+UseZGC)",
+        metavar="<prefix>",
+        dest="allow_java_options",
+        default=[],
+    )
+    parser.add_argument(
+        "--name",
+        action="store",
+        help="agent name shown by coordinator(default: host name)",
+        metavar="<name>",
+        dest="name",
+        default=socket.gethostname(),
+    )
+    parser.add_argument(
+        "--token",
+        action="store",
+        help="token shared with coordinator(--agent-token), required when coordinator is not a loopback address",
+        metavar="<token>",
+        dest="token",
+        default=None,
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        action="store",
+        help="keep retrying to connect for <seconds>(default: 60)",
+        metavar="<seconds>",
+        dest="connect_timeout",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--memory-aware",
+        action="store_true",
+        help="limit running JVMs by available memory of this host and set heap size when no Xmx is given",
+        dest="memory_aware",
+        default=False,
+    )
+    parser.add_argument(
+        "--memory-limit",
+        action="store",
+        help="assume <MB> memory is available for JVMs, implies --memory-aware",
+        metavar="<MB>",
+        dest="memory_limit",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--cpu-pinning",
+        action="store_true",
+        help="pin each slot's JVM to its own cpus of this host and size GC and JIT threads by its share(linux only)",
+        dest="cpu_pinning",
+        default=False,
+    )
+    parser.add_argument(
+        "--forever",
+        action="store_true",
+        help="reconnect after coordinator exits instead of exiting",
+        dest="forever",
+        default=False,
+    )
+    parser.add_argument(
+        "address",
+        help="coordinator address",
+        metavar="<host:port>",
+    )
+    options = parser.parse_args()
+
+    if not options.token and not is_loopback_host(parse_address(options.address, "127.0.0.1")[0]):
+        sys.stderr.write("[ERROR] --token is required when coordinator is not a loopback address" + os.linesep)
+        return -1
+
+    java_path = options.java_path
+    if not java_path:
+        java_path = "java"
+        java_home = os.getenv("JAVA_HOME")
+        java_exec = "java.exe" if "win32" == sys.platform else "java"
+        if java_home and os.path.exists(os.path.join(java_home, "bin", java_exec)):
+            java_path = os.path.join(java_home, "bin", java_exec)
+
+    settings = {
+        "slots": max(1, options.slots),
+        "java_path": java_path,
+        "base_dir": os.path.abspath(options.base_dir) if options.base_dir else None,
+        "root": os.path.abspath(options.root or options.base_dir or os.getcwd()),
+        "allow_java_options": options.allow_java_options,
+        "name": options.name,
+        "token": options.token,
+        "connect_timeout": options.connect_timeout,
+        "forever": options.forever,
+        "memory_mb": None,
+        "memory_budget": None,
+        "cpu_plan": None,
+    }
+    if options.memory_aware or options.memory_limit is not None:
+        settings["memory_mb"] = options.memory_limit or available_memory_mb()
+        if settings["memory_mb"] is None:
+            sys.stderr.write("[NOTICE] memory aware: available memory unknown, disabled" + os.linesep)
+        else:
+            settings["memory_budget"] = MemoryBudget(max(0, settings["memory_mb"] - MEMORY_RESERVED_MB))
+            sys.stdout.write(
+                "[NOTICE] memory aware: {0}MB - {1}MB reserved for {2} slot(s){3}".format(
+                    settings["memory_mb"], MEMORY_RESERVED_MB, settings["slots"], os.linesep
+                )
+            )
+    if options.cpu_pinning:
+        settings["cpu_plan"] = plan_cpu_pinning(settings["slots"])
+        sys.stdout.write("[NOTICE] cpu pinning: {0}{1}".format("; ".join(settings["cpu_plan"]["reasons"]), os.linesep))
+    pool = JvmPool()
+    slot_threads = []
+    for slot_idx in range(0, settings["slots"]):
+        slot_thd = threading.Thread(target=run_slot, args=[options.address, settings, pool, slot_idx])
+        slot_thd.daemon = True
+        slot_thd.start()
+        slot_threads.append(slot_thd)
+    try:
+        for slot_thd in slot_threads:
+            # 带超时的join才能响应Ctrl+C
+            while slot_thd.is_alive():
+                slot_thd.join(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from subprocess import PIPE
+
+from xresconv_daemon import DRAIN_POLL_MIN_INTERVAL, next_drain_poll_interval, pipe_pending_bytes
+from xresconv_executor import OUTPUT_LINE_LIMIT, encode_cmd_lines, pick_from_queues, pick_once
+from xresconv_resource import jvm_preexec_func
+from xresconv_trace import worker_jvm_tid
+
+# ==================================================================================
+# asyncio 执行引擎(python 3.8+): 在一个事件循环线程里启动所有本地JVM，写入标准输入，转发输出并等待退出
+# 线程引擎每个worker需要一个线程，每个JVM还需要两个转发输出的线程，并发数很高时大量线程会互相争抢GIL
+# 这里每个worker是一个协程，分发、取消、重试、历史记录和时间线都复用 ConvertExecutor 的逻辑，结果和线程引擎一致
+# 主线程只等待事件循环线程结束，所以收到 SIGINT/SIGTERM 时和线程引擎一样由主线程取消转换
+# agent的会话仍然在 AgentServer 的线程里执行
+
+
+def attach_child_watcher(loop):
+    """ python 3.8 到 3.11 默认每个子进程一个等待退出的线程，支持 pidfd 时改用事件循环等待。3.12 以后自动使用 pidfd """
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, "PidfdChildWatcher") or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except EnvironmentError:
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+
+async def read_output_line(reader):
+    """ 和 readline(OUTPUT_LINE_LIMIT) 一样，超长的行分多次返回，结束时返回空 """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as ex:
+        return ex.partial
+    except asyncio.LimitOverrunError as ex:
+        return await reader.read(max(1, ex.consumed))
+
+
+class AsyncJvmProcess:
+    """ 注册到 run_state["processes"] 里的JVM，取消转换时信号处理函数和agent的线程也会调用 terminate/kill """
+
+    def __init__(self, loop, process):
+        self.loop = loop
+        self.process = process
+        self.pid = process.pid
+
+    def poll(self):
+        return self.process.returncode
+
+    def terminate(self):
+        self.loop.call_soon_threadsafe(self._send_signal, "terminate")
+
+    def kill(self):
+        self.loop.call_soon_threadsafe(self._send_signal, "kill")
+
+    def _send_signal(self, method):
+        if self.process.returncode is not None:
+            return
+        try:
+            getattr(self.process, method)()
+        except ProcessLookupError:
+            pass
+
+
+class AsyncEngine:
+    def __init__(self, executor):
+        self.executor = executor
+        self.settings = executor.settings
+        self.loop = None
+
+    def run_workers(self, target, count, args):
+        """ 和 ConvertExecutor.run_workers 一样，target 是协程函数 """
+        loop_thd = threading.Thread(target=self.run_loop, args=[target, count, args])
+        loop_thd.start()
+        # 等待退出，不带超时的join不会被信号打断
+        while loop_thd.is_alive():
+            loop_thd.join(1.0)
+
+    def run_loop(self, target, count, args):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        attach_child_watcher(self.loop)
+        try:
+            workers = [self.run_worker(target, [args[0], i] + list(args[1:])) for i in range(0, count)]
+            self.loop.run_until_complete(asyncio.gather(*workers))
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+            self.loop = None
+
+    async def run_worker(self, target, args):
+        # 和线程引擎一样，一个worker出错时不影响其他worker
+        try:
+            await target(*args)
+        except Exception:
+            traceback.print_exc()
+
+    # ++++++++++++++++++++++++++++++++++++++++++ JVM ++++++++++++++++++++++++++++++++++++++++++
+    async def forward_output(self, reader, fd, output_stat):
+        while True:
+            output_line = await read_output_line(reader)
+            if not output_line:
+                break
+            self.executor.forward_output_line(output_line, fd, output_stat)
+
+    async def wait_jvm_drained(self, run_state, process):
+        """ 和 ConvertExecutor.wait_jvm_drained 一样，事件循环里还没有写入管道的数据也算没有读完 """
+        transport = process.stdin.transport
+        pipe = transport.get_extra_info("pipe")
+        if pipe is None:
+            return False
+        poll_interval = DRAIN_POLL_MIN_INTERVAL
+        while run_state["cancelled"] is None and process.returncode is None:
+            if transport.get_write_buffer_size() == 0:
+                pending_bytes = pipe_pending_bytes(pipe)
+                if pending_bytes is None:
+                    return False
+                if pending_bytes == 0:
+                    return True
+            await asyncio.sleep(poll_interval)
+            poll_interval = next_drain_poll_interval(poll_interval)
+        return False
+
+    async def run_jvm_session(self, run_state, idx, pick_func, attempt):
+        executor = self.executor
+        plan = run_state["plan"]
+        trace = run_state["trace"]
+        if run_state["cancelled"] is not None:
+            return None
+        java_options, cpu_set, memory_size_mb = executor.jvm_session_options(plan, idx)
+        # 内存预算只能阻塞等待，放到线程池里
+        if memory_size_mb > 0:
+            acquired = await self.loop.run_in_executor(
+                None, executor.acquire_jvm_memory, run_state, idx, memory_size_mb
+            )
+            if not acquired:
+                return None
+
+        start_time = time.time()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *java_options,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=PIPE,
+                cwd=plan.base_dir,
+                limit=OUTPUT_LINE_LIMIT,
+                preexec_fn=jvm_preexec_func(cpu_set),
+            )
+        except EnvironmentError:
+            if memory_size_mb > 0:
+                executor.memory_budget.release(memory_size_mb)
+            raise
+        spawn_end_time = time.time()
+        process_entry = {"pexec": AsyncJvmProcess(self.loop, process), "terminated": False, "failed_fast": False}
+        executor.register_process(run_state, process_entry)
+
+        error_func = executor.fail_fast_func(run_state, process_entry, idx)
+        stdout_stat = executor.new_output_stat(idx, error_func)
+        stderr_stat = executor.new_output_stat(idx, error_func)
+        output_tasks = [
+            self.loop.create_task(self.forward_output(process.stdout, sys.stdout, stdout_stat)),
+            self.loop.create_task(self.forward_output(process.stderr, sys.stderr, stderr_stat)),
+        ]
+
+        this_thd_cmds = []
+        # 每批写入的命令数和JVM读走这批命令的时间，用于统计每个命令的耗时
+        batch_sizes = []
+        drain_times = []
+        stdin_broken = False
+        session_limit = run_state["session_limit"]
+        paced = self.settings["dispatch_depth"] != 0
+        while run_state["cancelled"] is None and not stdin_broken:
+            if session_limit > 0 and len(this_thd_cmds) >= session_limit:
+                break
+            if paced and this_thd_cmds:
+                drain_wait_time = time.time()
+                paced = await self.wait_jvm_drained(run_state, process)
+                if paced:
+                    drain_times.append(time.time())
+                if trace is not None and time.time() - drain_wait_time > 0.001:
+                    trace.add_span("drain wait", "dispatch", worker_jvm_tid(idx), drain_wait_time, time.time())
+                if run_state["cancelled"] is not None:
+                    break
+            cmds = executor.pick_dispatch_cmds(run_state, pick_func, paced)
+            if not cmds:
+                break
+            batch_start_time = time.time()
+            this_thd_cmds.extend(cmds)
+            batch_sizes.append(len(cmds))
+            try:
+                process.stdin.write(encode_cmd_lines(cmds))
+                await process.stdin.drain()
+            except EnvironmentError:
+                stdin_broken = True
+            if trace is not None:
+                executor.trace_dispatch_batch(trace, idx, cmds, batch_start_time)
+        stdin_close_time = time.time()
+        try:
+            process.stdin.close()
+            await process.stdin.wait_closed()
+        except EnvironmentError:
+            stdin_broken = True
+        cmd_exit_code = await process.wait()
+        exit_time = time.time()
+        executor.unregister_process(run_state, process_entry)
+        if memory_size_mb > 0:
+            executor.memory_budget.release(memory_size_mb)
+
+        await asyncio.gather(*output_tasks)
+        end_time = time.time()
+
+        return executor.finish_jvm_session(
+            run_state,
+            idx,
+            attempt,
+            {
+                "process_entry": process_entry,
+                "cmds": this_thd_cmds,
+                "batch_sizes": batch_sizes,
+                "drain_times": drain_times,
+                "exit_code": cmd_exit_code,
+                "stdin_broken": stdin_broken,
+                "cpu_set": cpu_set,
+                "timepoints": [start_time, spawn_end_time, stdin_close_time, exit_time, end_time],
+                "stdout_bytes": stdout_stat["bytes"],
+                "stderr_bytes": stderr_stat["bytes"],
+            },
+        )
+
+    # ++++++++++++++++++++++++++++++++++++++++++ worker ++++++++++++++++++++++++++++++++++++++++++
+    async def run_jvm_sessions(self, run_state, idx, pick_func):
+        while True:
+            batch_result = await self.run_jvm_session(run_state, idx, pick_func, 0)
+            self.executor.add_batch_result(run_state, batch_result)
+            if not self.executor.session_limit_reached(run_state, batch_result):
+                break
+
+    async def worker_func(self, run_state, idx):
+        await self.run_jvm_sessions(run_state, idx, self.executor.worker_pick_func(run_state, idx))
+
+    async def drain_worker_func(self, run_state, idx):
+        await self.run_jvm_sessions(run_state, idx, pick_from_queues(run_state["worker_cmd_lists"], run_state["lock"]))
+
+    async def retry_worker_func(self, run_state, idx, retry_chunks, retry_round):
+        while True:
+            chunk = self.executor.pop_retry_chunk(run_state, retry_chunks)
+            if chunk is None:
+                break
+            batch_result = await self.run_jvm_session(run_state, idx, pick_once(chunk), retry_round)
+            self.executor.add_batch_result(run_state, batch_result)
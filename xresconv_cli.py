@@ -2,22 +2,48 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import sys
 import platform
+import signal
+import time
 
 # ==================================================================================
-import threading
 import xml.etree.ElementTree as ET
 from multiprocessing import cpu_count
-from argparse import ArgumentParser
-from subprocess import PIPE, Popen
+from argparse import ArgumentParser, ArgumentTypeError
+
+from print_color import cprintf_flush, cprintf_open_sink, cprintf_stderr, cprintf_stdout, print_style
+from xresconv_incremental import CheckpointJournal, IncrementalCache
+from xresconv_daemon import (
+    DAEMON_DEFAULT_IDLE_TIMEOUT,
+    daemon_supported,
+    default_socket_path,
+    ensure_daemon,
+)
+from xresconv_agent import AGENT_DEFAULT_PORT, AgentServer
+from xresconv_executor import ConvertExecutor, parse_dispatch_depth
+from xresconv_history import HistoryStore
+from xresconv_metrics import write_run_metrics
+from xresconv_output import OutputStage
+from xresconv_plan import ConvertPlan
+from xresconv_trace import TRACE_TID_MAIN, TraceRecorder
+from xresconv_watch import FileWatcher, normalize_watch_path
+
+
+def parse_parallelism(value):
+    if "auto" == value.lower():
+        return "auto"
+    try:
+        ret = int(value)
+    except ValueError:
+        raise ArgumentTypeError("invalid parallelism: {0}".format(value))
+    if ret <= 0:
+        raise ArgumentTypeError("parallelism must be greater than 0")
+    return ret
 
-from print_color import cprintf_stderr, cprintf_stdout, print_style
 
 def main():
     console_encoding = sys.getfilesystemencoding()
-    java_encoding = "utf-8"
 
     if 2 == sys.version_info[0] and "utf-8" != sys.getdefaultencoding().lower():
         try:
@@ -26,34 +52,29 @@ def main():
             reload(sys)
             sys.setdefaultencoding("utf-8")
 
-    xconv_split_by_spaces = re.compile("\\s+", re.IGNORECASE)
-
     xconv_options = {
         "version": "1.4.0",
         "conv_list": None,
         "real_run": True,
-        "args": {},
-        "ext_args_l1": [],
         "ext_args_l2": [],
-        "work_dir": ".",
-        "xresloader_path": "xresloader.jar",
-        "item": [],
         "parallelism": int((cpu_count() - 1) / 2) + 1,
-        "java_options": [],
         "java_path": "java",
-        "default_scheme": {},
         "data_version": None,
-        "output_matrix": {"file_path": None, "outputs": []},
-        "protocol_files": {"file_path": None, "inputs": []},
-        "data_source_dir": {"file_path": None, "inputs": []},
+        "incremental_cache": None,
+        "history_file": None,
+        "failed_list": None,
+        "plan_cache": None,
+        "trace_file": None,
+        "metrics_file": None,
+        "output_manifest": None,
+        "journal_file": None,
     }
 
     # 默认双线程，实际测试过程中java的运行优化反而比多线程更能提升效率
     if xconv_options["parallelism"] > 2:
         xconv_options["parallelism"] = 2
 
-    xconv_xml_global_nodes = []
-    xconv_xml_list_item_nodes = []
+    startup_cwd = os.getcwd()
 
     usage = "%(prog)s [options...] <convert list file> [-- [xresloader options...]]"
     parser = ArgumentParser(usage=usage)
@@ -87,12 +108,13 @@ def main():
         "-p",
         "--parallelism",
         action="store",
-        help="set parallelism task number(default:"
+        help="set parallelism task number, or auto to choose by cpu, memory and throughput recorded by --history"
+        + "(default:"
         + str(xconv_options["parallelism"])
         + ")",
-        metavar="<number>",
+        metavar="<number|auto>",
         dest="parallelism",
-        type=int,
+        type=parse_parallelism,
         default=xconv_options["parallelism"],
     )
     parser.add_argument(
@@ -123,6 +145,270 @@ def main():
         default=None,
     )
 
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="skip commands whose inputs are not changed since last successful run",
+        dest="incremental",
+        default=False,
+    )
+    parser.add_argument(
+        "--incremental-cache",
+        action="store",
+        help="set incremental cache file(default: <convert list file>.incremental.json)",
+        metavar="<cache file>",
+        dest="incremental_cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="run commands on pre-started xresloader JVMs kept by a background daemon"
+        + "(saves JVM startup, JIT warm-up is not reused between runs)",
+        dest="daemon",
+        default=False,
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        action="store",
+        help="set unix socket path of daemon(default: " + default_socket_path() + ")",
+        metavar="<socket path>",
+        dest="daemon_socket",
+        default=default_socket_path(),
+    )
+    parser.add_argument(
+        "--daemon-idle-timeout",
+        action="store",
+        help="set idle seconds before daemon exits(default: " + str(DAEMON_DEFAULT_IDLE_TIMEOUT) + ")",
+        metavar="<seconds>",
+        dest="daemon_idle_timeout",
+        type=float,
+        default=DAEMON_DEFAULT_IDLE_TIMEOUT,
+    )
+    parser.add_argument(
+        "--listen",
+        action="store",
+        help="accept xresconv_agent.py connections on [host:]port(default host: 127.0.0.1, example: 0.0.0.0:"
+        + str(AGENT_DEFAULT_PORT)
+        + "), agents run commands together with local JVMs",
+        metavar="<[host:]port>",
+        dest="listen",
+        default=None,
+    )
+    parser.add_argument(
+        "--agent-token",
+        action="store",
+        help="only accept agents started with the same --token, required when --listen is not a loopback address",
+        metavar="<token>",
+        dest="agent_token",
+        default=None,
+    )
+    parser.add_argument(
+        "--wait-agents",
+        action="store",
+        help="wait until <number> agent slots connected before converting(at most 60 seconds)",
+        metavar="<number>",
+        dest="wait_agents",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--schedule",
+        action="store",
+        help="set dispatch order, declare: order in convert list, cost: longest estimated job first, "
+        + "estimated by durations recorded by --history(default: declare)",
+        choices=["declare", "cost"],
+        dest="schedule",
+        default="declare",
+    )
+    parser.add_argument(
+        "--affinity",
+        action="store_true",
+        help="send all commands of the same data source file to the same JVM",
+        dest="affinity",
+        default=False,
+    )
+    parser.add_argument(
+        "--memory-aware",
+        action="store_true",
+        help="limit running JVMs by available memory(cgroup or /proc/meminfo) and set heap size when no Xmx is given",
+        dest="memory_aware",
+        default=False,
+    )
+    parser.add_argument(
+        "--memory-limit",
+        action="store",
+        help="assume <MB> memory is available for JVMs, implies --memory-aware",
+        metavar="<MB>",
+        dest="memory_limit",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--cpu-pinning",
+        action="store_true",
+        help="pin each worker's JVM to its own cpus and size GC and JIT threads by its share(linux only)",
+        dest="cpu_pinning",
+        default=False,
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="record duration, exit code and output size of every command into history file",
+        dest="history",
+        default=False,
+    )
+    parser.add_argument(
+        "--history-file",
+        action="store",
+        help="set history file(default: <convert list file>.history.jsonl)",
+        metavar="<history file>",
+        dest="history_file",
+        default=None,
+    )
+    parser.add_argument(
+        "--dispatch-depth",
+        action="store",
+        help="write <number> command groups to a JVM each time it has read all previous ones, gss to shrink as the "
+        + "queue drains, or 0 to write all picked commands at once(default: 1)",
+        metavar="<number|gss>",
+        dest="dispatch_depth",
+        type=parse_dispatch_depth,
+        default=1,
+    )
+    parser.add_argument(
+        "--engine",
+        action="store",
+        help="thread: threads for each worker and JVM output, asyncio: run all local JVMs on one event loop thread "
+        + "(python 3.8+, default: thread)",
+        choices=["thread", "asyncio"],
+        dest="engine",
+        default="thread",
+    )
+    parser.add_argument(
+        "--log-flush-interval",
+        action="store",
+        help="write console output in batches at most once every <seconds>, 0 to write every line at once "
+        + "(default: 0.05)",
+        metavar="<seconds>",
+        dest="log_flush_interval",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--retry",
+        action="store",
+        help="retry failed commands on new JVMs for at most <number> rounds(default: 0), "
+        + "xresloader only reports the number of failures, so commands succeeded in a failed JVM are rerun too",
+        metavar="<number>",
+        dest="retry",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop dispatching and terminate running JVMs on the first failure, failed commands are not retried",
+        dest="fail_fast",
+        default=False,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="record completed commands into a journal and skip them when the interrupted run is restarted",
+        dest="resume",
+        default=False,
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        action="store",
+        help="with --resume, start a new JVM after every <number> commands so they can be journaled(default: 50)",
+        metavar="<number>",
+        dest="checkpoint_interval",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--journal-file",
+        action="store",
+        help="set journal file of --resume(default: <convert list file>.journal.jsonl)",
+        metavar="<journal file>",
+        dest="journal_file",
+        default=None,
+    )
+    parser.add_argument(
+        "--failed-list",
+        action="store",
+        help="write failed commands into <file> as json, "
+        + "commands of a JVM with failures are rerun one per JVM to find out which of them failed",
+        metavar="<file>",
+        dest="failed_list",
+        default=None,
+    )
+    parser.add_argument(
+        "--plan-cache",
+        action="store_true",
+        help="cache the parsed convert list and skip xml parsing when no xml file changed",
+        dest="plan_cache",
+        default=False,
+    )
+    parser.add_argument(
+        "--plan-cache-file",
+        action="store",
+        help="set plan cache file(default: <convert list file>.plan.json)",
+        metavar="<cache file>",
+        dest="plan_cache_file",
+        default=None,
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, watch data sources, protocol files and convert list, reconvert changed items",
+        dest="watch",
+        default=False,
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        action="store",
+        help="wait until no file changes for <seconds> before reconverting(default: 0.5)",
+        metavar="<seconds>",
+        dest="watch_debounce",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--trace",
+        action="store",
+        help="write a chrome trace event timeline of this run into <file>",
+        metavar="<file>",
+        dest="trace_file",
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        action="store",
+        help="write OpenMetrics/Prometheus text metrics of the last run into <file>(node-exporter textfile)",
+        metavar="<file>",
+        dest="metrics_file",
+        default=None,
+    )
+    parser.add_argument(
+        "--stage-output",
+        action="store_true",
+        help="convert into a staging dir and only replace output files whose content changed",
+        dest="stage_output",
+        default=False,
+    )
+    parser.add_argument(
+        "--output-manifest",
+        action="store",
+        help="write content hashes of output files into <file>(default: <output dir>/.xresconv-manifest.json)",
+        metavar="<file>",
+        dest="output_manifest",
+        default=None,
+    )
+
     parser.add_argument(
         "convert_list_file",
         nargs="+",
@@ -147,6 +433,35 @@ def main():
     xconv_options["conv_list"] = options.convert_list_file.pop(0)
     xconv_options["ext_args_l2"] = options.convert_list_file
     xconv_options["data_version"] = options.data_version
+    if options.incremental:
+        if options.incremental_cache:
+            xconv_options["incremental_cache"] = os.path.abspath(options.incremental_cache)
+        else:
+            xconv_options["incremental_cache"] = (
+                os.path.abspath(xconv_options["conv_list"]) + ".incremental.json"
+            )
+    if options.resume:
+        if options.journal_file:
+            xconv_options["journal_file"] = os.path.abspath(options.journal_file)
+        else:
+            xconv_options["journal_file"] = os.path.abspath(xconv_options["conv_list"]) + ".journal.jsonl"
+    if options.plan_cache:
+        if options.plan_cache_file:
+            xconv_options["plan_cache"] = os.path.abspath(options.plan_cache_file)
+        else:
+            xconv_options["plan_cache"] = os.path.abspath(xconv_options["conv_list"]) + ".plan.json"
+    if options.metrics_file:
+        xconv_options["metrics_file"] = os.path.abspath(options.metrics_file)
+    if options.output_manifest:
+        xconv_options["output_manifest"] = os.path.abspath(options.output_manifest)
+    if options.trace_file:
+        xconv_options["trace_file"] = os.path.abspath(options.trace_file)
+    if options.failed_list:
+        xconv_options["failed_list"] = os.path.abspath(options.failed_list)
+    if options.history_file:
+        xconv_options["history_file"] = os.path.abspath(options.history_file)
+    else:
+        xconv_options["history_file"] = os.path.abspath(xconv_options["conv_list"]) + ".history.jsonl"
     if options.java_path and os.path.exists(options.java_path):
         xconv_options["java_path"] = options.java_path
     else:
@@ -158,175 +473,58 @@ def main():
         if java_home and os.path.exists(os.path.join(java_home, 'bin', java_exec)):
             xconv_options["java_path"] = os.path.join(java_home, 'bin', java_exec)
     # ========================================= 全局配置解析 =========================================
-    """ 读取xml文件 """
+    trace = None
+    if xconv_options["trace_file"]:
+        trace = TraceRecorder(xconv_options["trace_file"])
+
+    plan = ConvertPlan(xconv_options["conv_list"], options.rule_schemes, options.data_version)
+    plan_load_start_time = time.time()
+    try:
+        plan_cache_hit = plan.load(xconv_options["plan_cache"])
+    except ET.ParseError as ex:
+        print(ex)
+        cprintf_stderr([print_style.FC_RED], "[ERROR]: {0}" + os.linesep, ex)
+        exit(-2)
+    except EnvironmentError as ex:
+        print(ex)
+        cprintf_stderr([print_style.FC_RED], "[ERROR]: {0}" + os.linesep, ex)
+        exit(-2)
+
+    # 加载转换列表和生成命令的耗时只算在第一次转换里
+    plan_phases = {"load_plan": time.time() - plan_load_start_time}
+    if trace is not None:
+        trace.add_span(
+            "load plan",
+            "plan",
+            TRACE_TID_MAIN,
+            plan_load_start_time,
+            time.time(),
+            {"xml_files": len(plan.xml_files), "items": len(plan.items), "cache_hit": plan_cache_hit},
+        )
 
-    def load_xml_file(file_path):
-        try:
-            xml_doc = ET.parse(file_path)
-        except ET.ParseError as ex:
-            print(ex)
-            cprintf_stderr([print_style.FC_RED], "[ERROR]: {0}" + os.linesep, ex)
-            exit(-2)
-        except EnvironmentError as ex:
-            print(ex)
-            cprintf_stderr([print_style.FC_RED], "[ERROR]: {0}" + os.linesep, ex)
-            exit(-2)
-
-        root_node = xml_doc.getroot()
-
-        if root_node is None:
-            print("[ERROR] root node not found in xml")
-            print_help_msg(-3)
-
-        # 枚举include文件
-        include_nodes = root_node.findall("./include")
-        if include_nodes and len(include_nodes) > 0:
-            dir_prefix = os.path.dirname(file_path)
-            for include_node in include_nodes:
-                include_file_path = include_node.text
-                if include_file_path and len(include_file_path) > 1:
-                    if include_file_path[0] != "/" and include_file_path[1] != ":":
-                        include_file_path = os.path.join(dir_prefix, include_file_path)
-                    load_xml_file(include_file_path)
-
-        global_nodes = root_node.findall("./global")
-        if global_nodes and len(global_nodes) > 0:
-            for node in global_nodes:
-                xconv_xml_global_nodes.append({"file_path": file_path, "node": node})
-
-        list_item_nodes = root_node.findall("./list/item")
-        if list_item_nodes and len(list_item_nodes) > 0:
-            for node in list_item_nodes:
-                xconv_xml_list_item_nodes.append({"file_path": file_path, "node": node})
-
-    load_xml_file(xconv_options["conv_list"])
-
-    # global配置解析/合并
-    def load_global_options(gns):
-        for global_node in gns:
-            for global_option in global_node["node"]:
-                tag_name = global_option.tag.lower()
-                text_value = global_option.text
-                if text_value:
-                    trip_value = text_value.strip()
-                else:
-                    trip_value = None
-
-                if not trip_value:
-                    continue
-
-                if tag_name == "work_dir":
-                    xconv_options["work_dir"] = text_value
-
-                elif tag_name == "xresloader_path":
-                    xconv_options["xresloader_path"] = text_value
-
-                elif tag_name == "proto":
-                    xconv_options["args"]["-p"] = trip_value
-
-                elif tag_name == "output_type":
-                    if (
-                        global_node["file_path"]
-                        != xconv_options["output_matrix"]["file_path"]
-                    ):
-                        xconv_options["output_matrix"]["outputs"] = []
-                        xconv_options["output_matrix"]["file_path"] = global_node[
-                            "file_path"
-                        ]
-                    output_rule = {
-                        "type": trip_value,
-                        "rename": None,
-                        "tags": set(),
-                        "classes": set(),
-                    }
-                    rename_rule = global_option.get("rename")
-                    if rename_rule and rename_rule.strip():
-                        output_rule["rename"] = rename_rule
-                    tag_rule = global_option.get("tag")
-                    if tag_rule and tag_rule.strip():
-                        output_rule["tags"] = set(
-                            filter(
-                                lambda x: x,
-                                xconv_split_by_spaces.split(tag_rule.strip()),
-                            )
-                        )
-                    class_rule = global_option.get("class")
-                    if class_rule and class_rule.strip():
-                        output_rule["classes"] = set(
-                            filter(
-                                lambda x: x,
-                                xconv_split_by_spaces.split(class_rule.strip()),
-                            )
-                        )
-
-                    xconv_options["output_matrix"]["outputs"].append(output_rule)
-
-                elif tag_name == "proto_file":
-                    if (
-                        global_node["file_path"]
-                        != xconv_options["protocol_files"]["file_path"]
-                    ):
-                        xconv_options["protocol_files"]["inputs"] = []
-                        xconv_options["protocol_files"]["file_path"] = global_node[
-                            "file_path"
-                        ]
-                    xconv_options["protocol_files"]["inputs"].append("-f")
-                    xconv_options["protocol_files"]["inputs"].append('"' + text_value + '"')
-
-                elif tag_name == "output_dir":
-                    xconv_options["args"]["-o"] = '"' + text_value + '"'
-
-                elif tag_name == "data_src_dir" or tag_name == "data_source_dir":
-                    if (
-                        global_node["file_path"]
-                        != xconv_options["data_source_dir"]["file_path"]
-                    ):
-                        xconv_options["data_source_dir"]["inputs"] = []
-                        xconv_options["data_source_dir"]["file_path"] = global_node[
-                            "file_path"
-                        ]
-                    xconv_options["data_source_dir"]["inputs"].append("-d")
-                    xconv_options["data_source_dir"]["inputs"].append('"' + text_value + '"')
-                elif tag_name == "data_version":
-                    if xconv_options["data_version"] is None:
-                        xconv_options["data_version"] = text_value
-
-                elif tag_name == "rename":
-                    xconv_options["args"]["-n"] = '"' + trip_value + '"'
-
-                elif tag_name == "option":
-                    xconv_options["ext_args_l1"].append(trip_value)
-                elif tag_name == "java_option":
-                    xconv_options["java_options"].append(trip_value)
-                elif tag_name == "default_scheme":
-                    if "name" in global_option.attrib:
-                        scheme_key = global_option.attrib["name"]
-                        if scheme_key in xconv_options["default_scheme"]:
-                            xconv_options["default_scheme"][scheme_key].append(
-                                trip_value
-                            )
-                        else:
-                            xconv_options["default_scheme"][scheme_key] = [text_value]
-                else:
-                    print("[ERROR] unknown global configure " + tag_name)
-
-    if xconv_xml_global_nodes and len(xconv_xml_global_nodes) > 0:
-        load_global_options(xconv_xml_global_nodes)
+    for include_cycle in plan.include_cycles:
+        cprintf_stderr(
+            [print_style.FC_RED],
+            "[ERROR] include cycle ignored: {0}{1}",
+            " -> ".join(include_cycle),
+            os.linesep,
+        )
+    for warning in plan.warnings:
+        print("[ERROR] " + warning)
 
     # ----------------------------------------- 全局配置解析 -----------------------------------------
 
-    conv_list_dir = os.path.dirname(xconv_options["conv_list"])
-    if conv_list_dir:
-        os.chdir(conv_list_dir)
-    os.chdir(xconv_options["work_dir"])
+    # 开始转换后所有worker的输出都由一个线程按批写出
+    cprintf_open_sink(options.log_flush_interval)
+    os.chdir(plan.base_dir)
 
+    conv_compat_py2_write_buffer = False
     conv_start_msg = (
         "[NOTICE] start to run conv cmds on dir: {0}" + os.linesep
     ).format(os.getcwd())
     if sys.version_info.major >= 3:
         cprintf_stdout([print_style.FC_YELLOW], conv_start_msg)
     else:
-        conv_compat_py2_write_buffer = False
         try:
             cprintf_stdout(
                 [print_style.FC_YELLOW], conv_start_msg.decode(console_encoding)
@@ -338,299 +536,325 @@ def main():
             conv_compat_py2_write_buffer = True
             cprintf_stdout([print_style.FC_YELLOW], conv_start_msg)
 
-    if not os.path.exists(xconv_options["xresloader_path"]):
+    if not os.path.exists(plan.path(plan.options["xresloader_path"])):
         cprintf_stderr(
             [print_style.FC_RED],
             "[ERROR] xresloader not found.({0}, you can download it from {1})"
             + os.linesep,
-            xconv_options["xresloader_path"],
+            plan.options["xresloader_path"],
             "https://github.com/xresloader/xresloader/releases",
         )
         exit(-4)
 
-    # ========================================= 转换表配置解析 =========================================
-    # 转换项配置解析/合并
-    def load_list_item_nodes(lis):
-        for item_info in lis:
-            item = item_info["node"]
-            conv_item_obj = {
-                "file": False,
-                "scheme": False,
-                "options": [],
-                "enable": False,
-                "scheme_data": {},
-                "tags": set(),
-                "classes": set(),
-            }
-
-            if "file" in item.attrib:
-                conv_item_obj["file"] = item.attrib["file"]
-            if "scheme" in item.attrib:
-                conv_item_obj["scheme"] = item.attrib["scheme"]
-            if "tag" in item.attrib:
-                conv_item_obj["tags"] = set(
-                    filter(lambda x: x, xconv_split_by_spaces.split(item.attrib["tag"]))
-                )
-            if "class" in item.attrib:
-                conv_item_obj["classes"] = set(
-                    filter(
-                        lambda x: x, xconv_split_by_spaces.split(item.attrib["class"])
-                    )
-                )
-
-            # 局部选项
-            for local_option in item.findall("./option"):
-                text_value = local_option.text
-                if text_value:
-                    trip_value = text_value.strip()
-                else:
-                    trip_value = None
-
-                if not trip_value:
-                    continue
-
-                conv_item_obj["options"].append(trip_value)
-
-            # 局部选项
-            for local_option in item.findall("./scheme"):
-                text_value = local_option.text
-                if text_value:
-                    trip_value = text_value.strip()
-                else:
-                    trip_value = None
-
-                if not trip_value:
-                    continue
-
-                if "name" in local_option.attrib:
-                    scheme_key = local_option.attrib["name"]
-                    if scheme_key and scheme_key in conv_item_obj["scheme_data"]:
-                        conv_item_obj["scheme_data"][scheme_key].append(text_value)
-                    else:
-                        conv_item_obj["scheme_data"][scheme_key] = [text_value]
-            for key in xconv_options["default_scheme"]:
-                if key not in conv_item_obj["scheme_data"]:
-                    conv_item_obj["scheme_data"][key] = xconv_options["default_scheme"][
-                        key
-                    ]
-
-            # 转换规则
-            if (
-                not options.rule_schemes
-                or 0 == len(options.rule_schemes)
-                or conv_item_obj["scheme"] in options.rule_schemes
-            ):
-                conv_item_obj["enable"] = True
-
-            xconv_options["item"].append(conv_item_obj)
-
-    if xconv_xml_list_item_nodes and len(xconv_xml_list_item_nodes) > 0:
-        load_list_item_nodes(xconv_xml_list_item_nodes)
-    # ----------------------------------------- 转换配置解析 -----------------------------------------
-
     # ========================================= 生成转换命令 =========================================
-    if not xconv_options["data_version"] is None:
-        xconv_options["args"]["-a"] = '"' + str(xconv_options["data_version"]) + '"'
+    output_stage = None
+    if options.stage_output and not options.test:
+        if "-o" not in plan.options["args"]:
+            cprintf_stderr([print_style.FC_RED], "[ERROR] staging output requires output_dir{0}", os.linesep)
+            exit(-7)
+        output_stage = OutputStage(
+            plan.base_dir, plan.options["args"]["-o"].strip('"'), xconv_options["output_manifest"]
+        )
 
-    # ++++++++++++++++++++++++++++++++++++++++++ 全局命令和配置 ++++++++++++++++++++++++++++++++++++++++++
-    global_cmd_args_map = xconv_options["args"].copy()
-    global_cmd_args_prefix_array = []
-    global_cmd_args_suffix_array = []
+    build_start_time = time.time()
+    cmd_list = plan.build_commands(
+        ext_args=xconv_options["ext_args_l2"],
+        output_dir=output_stage.staging_arg if output_stage is not None else None,
+    )
+    plan_phases["build_commands"] = time.time() - build_start_time
+    if trace is not None:
+        trace.add_span(
+            "build commands", "plan", TRACE_TID_MAIN, build_start_time, time.time(), {"commands": len(cmd_list)}
+        )
 
-    if len(xconv_options["ext_args_l1"]) > 0:
-        global_cmd_args_prefix_array.extend(xconv_options["ext_args_l1"])
+    incremental_cache = None
+    if xconv_options["incremental_cache"]:
+        incremental_cache = IncrementalCache(xconv_options["incremental_cache"])
+        incremental_cache.load()
+
+    journal = None
+    if xconv_options["journal_file"]:
+        journal = CheckpointJournal(xconv_options["journal_file"])
+
+    # 按耗时调度和自动并发数只读取历史记录，只有 --history 才写入
+    history_store = None
+    if options.history or "cost" == options.schedule or "auto" == options.parallelism:
+        history_store = HistoryStore(xconv_options["history_file"], not options.history)
+        history_store.load()
+
+    daemon_socket = None
+    if options.daemon and not options.test:
+        daemon_socket = options.daemon_socket
+
+    agent_server = None
+    if options.listen and not options.test:
+        # agent的输出写在agent所在机器上，协调端无法确认输出文件，不能记录到增量缓存、断点记录和输出清单里
+        listen_conflicts = []
+        if options.incremental:
+            listen_conflicts.append("--incremental")
+        if options.resume:
+            listen_conflicts.append("--resume")
+        if options.stage_output:
+            listen_conflicts.append("--stage-output")
+        if listen_conflicts:
+            cprintf_stderr(
+                [print_style.FC_RED],
+                "[ERROR] {0} can not be used with --listen, outputs of agents are written on their own hosts{1}",
+                ", ".join(listen_conflicts),
+                os.linesep,
+            )
+            exit(-6)
+        try:
+            agent_server = AgentServer(options.listen, options.agent_token)
+        except (ValueError, EnvironmentError) as ex:
+            cprintf_stderr([print_style.FC_RED], "[ERROR] listen on {0} failed: {1}{2}", options.listen, ex, os.linesep)
+            exit(-6)
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] waiting for agents on {0}:{1}{2}",
+            agent_server.address[0],
+            agent_server.address[1],
+            os.linesep,
+        )
 
-    # ++++++++++++++++++++++++++++++++++++++++++ 命令行参数 ++++++++++++++++++++++++++++++++++++++++++
-    if len(xconv_options["ext_args_l2"]) > 0:
-        global_cmd_args_suffix_array.extend(xconv_options["ext_args_l2"])
+    executor = ConvertExecutor(
+        {
+            "java_path": xconv_options["java_path"],
+            "java_options": ["-{0}".format(x) for x in options.java_options],
+            "parallelism": options.parallelism,
+            "schedule": options.schedule,
+            "affinity": options.affinity,
+            "retry": options.retry,
+            "dispatch_depth": options.dispatch_depth,
+            "fail_fast": options.fail_fast,
+            "checkpoint_interval": options.checkpoint_interval,
+            "daemon_socket": daemon_socket,
+            "agent_server": agent_server,
+            "memory_aware": options.memory_aware or options.memory_limit is not None,
+            "memory_limit": options.memory_limit,
+            "cpu_pinning": options.cpu_pinning,
+            "engine": options.engine,
+            "keep_jvms": options.watch,
+            "dry_run": options.test,
+            "py2_write_buffer": conv_compat_py2_write_buffer,
+        }
+    )
 
-    cmd_list = []
-    for conv_item in xconv_options["item"]:
-        if not conv_item["enable"]:
-            continue
+    if "auto" == options.parallelism:
+        auto_parallelism_reasons = executor.resolve_parallelism(plan, cmd_list, history_store)
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] parallelism auto: {0} ({1}){2}",
+            executor.parallelism,
+            "; ".join(auto_parallelism_reasons),
+            os.linesep,
+        )
 
-        item_output_matrix = xconv_options["output_matrix"]["outputs"]
-        if not item_output_matrix:
-            item_output_matrix = [{}]
-
-        for item_output in item_output_matrix:
-            item_cmd_args_array = []
-            item_cmd_args_array.extend(global_cmd_args_prefix_array)
-            item_cmd_args_array.extend(xconv_options["protocol_files"]["inputs"])
-            item_cmd_args_array.extend(xconv_options["data_source_dir"]["inputs"])
-
-            # merge global options
-            if "tags" in item_output and item_output["tags"]:
-                check_limit = False
-                for tag in item_output["tags"]:
-                    if tag in conv_item["tags"]:
-                        check_limit = True
-                        break
-                if not check_limit:
-                    continue
-            if "classes" in item_output and item_output["classes"]:
-                check_limit = False
-                for tag in item_output["classes"]:
-                    if tag in conv_item["classes"]:
-                        check_limit = True
-                        break
-                if not check_limit:
-                    continue
-
-            item_cmd_args_map = global_cmd_args_map.copy()
-            if "type" in item_output and item_output["type"]:
-                item_cmd_args_map["-t"] = item_output["type"]
-            if "rename" in item_output and item_output["rename"]:
-                item_cmd_args_map["-n"] = '"{0}"'.format(item_output["rename"])
-
-            for key in item_cmd_args_map:
-                item_cmd_args_array.append(key)
-                item_cmd_args_array.append(item_cmd_args_map[key])
-
-            # add item options
-            if conv_item["options"]:
-                item_cmd_args_array.extend(conv_item["options"])
-
-            # add item scheme
-            if conv_item["file"] and conv_item["scheme"]:
-                item_cmd_args_array.append("-s")
-                item_cmd_args_array.append('"{:s}"'.format(conv_item["file"]))
-                item_cmd_args_array.append("-m")
-                item_cmd_args_array.append('"{:s}"'.format(conv_item["scheme"]))
-            else:
-                for key in conv_item["scheme_data"]:
-                    for opt_val in conv_item["scheme_data"][key]:
-                        item_cmd_args_array.append("-m")
-                        item_cmd_args_array.append('"{:s}={:s}"'.format(key, opt_val))
+    memory_reasons = executor.resolve_memory(plan)
+    if memory_reasons:
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] memory aware: parallelism {0} ({1}){2}",
+            executor.parallelism,
+            "; ".join(memory_reasons),
+            os.linesep,
+        )
 
-            item_cmd_args_array.extend(global_cmd_args_suffix_array)
-            cmd_list.append(item_cmd_args_array)
+    engine_reasons = executor.resolve_engine()
+    if engine_reasons:
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] engine: {0}{1}",
+            "; ".join(engine_reasons),
+            os.linesep,
+        )
 
-    cmd_list.reverse()
-    # ----------------------------------------- 生成转换命令 -----------------------------------------
+    cpu_pinning_reasons = executor.resolve_cpu_pinning()
+    if cpu_pinning_reasons:
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] cpu pinning: {0}{1}",
+            "; ".join(cpu_pinning_reasons),
+            os.linesep,
+        )
 
-    all_worker_thread = []
-    exit_data = {
-        "exit_code": 0,
-    }
-    cmd_picker_lock = threading.Lock()
+    # ----------------------------------------- 生成转换命令 -----------------------------------------
 
-    def print_buffer_to_fd(fd, buffer):
-        if sys.version_info.major >= 3:
-            fd.write(buffer.decode(java_encoding))
-        else:
-            if console_encoding == java_encoding or conv_compat_py2_write_buffer:
-                sys.stderr.write(buffer)
-            else:
-                sys.stderr.write(buffer.decode(java_encoding))
-
-    def print_stdout_func(pexec):
-        for output_line in pexec.stdout.readlines():
-            print_buffer_to_fd(sys.stdout, output_line)
-
-    def print_stderr_func(pexec):
-        for output_line in pexec.stderr.readlines():
-            print_buffer_to_fd(sys.stderr, output_line)
-
-    def worker_func(idx, exit_data):
-        java_options = [xconv_options["java_path"]]
-        if len(options.java_options) > 0:
-            for java_option in options.java_options:
-                java_options.append("-{0}".format(java_option))
-        if len(xconv_options["java_options"]) > 0:
-            for java_option in xconv_options["java_options"]:
-                java_options.append(java_option)
-
-        java_options.append("-Dfile.encoding={0}".format(java_encoding))
-        java_options.append("-jar")
-        java_options.append(xconv_options["xresloader_path"])
-        java_options.append("--stdin")
-
-        once_pick_count = len(xconv_options["output_matrix"]["outputs"])
-        if once_pick_count <= 1:
-            once_pick_count = 1
-        pexec = None
-        if not options.test:
-            pexec = Popen(
-                java_options, stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=False
+    # ----------------------------------------- 实际开始转换 -----------------------------------------
+    if daemon_socket:
+        if not daemon_supported():
+            cprintf_stderr(
+                [print_style.FC_RED],
+                "[ERROR] daemon mode requires unix socket support{0}",
+                os.linesep,
             )
+            exit(-5)
+        try:
+            ensure_daemon(daemon_socket, options.daemon_idle_timeout)
+        except EnvironmentError as ex:
+            cprintf_stderr([print_style.FC_RED], "[ERROR] start daemon failed: {0}{1}", ex, os.linesep)
+            exit(-5)
+
+    run_flags = {"interrupted": False}
 
-            worker_thd_print_stdout = threading.Thread(
-                target=print_stdout_func, args=[pexec]
+    def sync_output(failed):
+        """ 暂存模式下把变化的输出文件同步到输出目录，返回同步失败时额外的失败数 """
+        sync_start_time = time.time()
+        try:
+            sync_result = output_stage.commit(failed)
+        except EnvironmentError as ex:
+            cprintf_stderr([print_style.FC_RED], "[ERROR] sync output failed: {0}{1}", ex, os.linesep)
+            return 1
+        sync_end_time = time.time()
+        plan_phases["sync_output"] = sync_end_time - sync_start_time
+        if trace is not None:
+            trace.add_span(
+                "sync output",
+                "output",
+                TRACE_TID_MAIN,
+                sync_start_time,
+                sync_end_time,
+                {"changed": len(sync_result["changed"]), "unchanged": sync_result["unchanged"]},
             )
-            worker_thd_print_stderr = threading.Thread(
-                target=print_stderr_func, args=[pexec]
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] output synced: {0} changed, {1} unchanged{2}",
+            len(sync_result["changed"]),
+            sync_result["unchanged"],
+            os.linesep,
+        )
+        return 0
+
+    def dispatch_cmds(cmd_list):
+        run_start_time = time.time()
+        plan_time = sum(plan_phases.values())
+        if output_stage is not None:
+            output_stage.prepare()
+        run_result = executor.run(
+            plan,
+            cmd_list,
+            incremental_cache=incremental_cache,
+            history_store=history_store,
+            failed_list=xconv_options["failed_list"],
+            trace=trace,
+            journal=journal,
+        )
+        run_flags["interrupted"] = run_result["interrupted"]
+        # 取消后没有执行完的命令也算失败，测试运行时不执行任何命令
+        failed_count = run_result["failed"]
+        if run_result["cancelled"] is not None and not options.test:
+            failed_count = failed_count + run_result["unfinished"]
+        if output_stage is not None:
+            if run_result["cancelled"] is None:
+                failed_count = failed_count + sync_output(run_result["failed"])
+            else:
+                # 被结束的JVM可能只写了一半的文件，这次转换的输出都不同步
+                output_stage.discard()
+        # 监听模式下每次转换后都重新写入，包含之前所有次转换的时间线
+        if trace is not None:
+            trace.save()
+        if xconv_options["metrics_file"] and not options.test:
+            write_run_metrics(
+                xconv_options["metrics_file"],
+                run_result,
+                executor.parallelism,
+                time.time() - run_start_time + plan_time,
+                plan_phases,
             )
-            worker_thd_print_stdout.start()
-            worker_thd_print_stderr.start()
-
-            while True:
-                cmd_picker_lock.acquire()
-                if len(cmd_list) <= 0:
-                    cmd_picker_lock.release()
-                    break
-
-                for _ in range(0, once_pick_count):
-                    if not cmd_list:
-                        break
-                    pexec.stdin.write(" ".join(cmd_list.pop()).encode(java_encoding))
-                    pexec.stdin.write(os.linesep.encode(java_encoding))
-
-                cmd_picker_lock.release()
-                pexec.stdin.flush()
-            pexec.stdin.close()
-            for output_line in pexec.stdout.readlines():
-                print(output_line.decode(java_encoding))
-            cmd_exit_code = pexec.wait()
-
-            worker_thd_print_stdout.join()
-            worker_thd_print_stderr.join()
-
-            exit_data["exit_code"] = exit_data["exit_code"] + cmd_exit_code
-        else:
-            this_thd_cmds = []
-            while True:
-                cmd_picker_lock.acquire()
-                if len(cmd_list) <= 0:
-                    cmd_picker_lock.release()
-                    break
-
-                for _ in range(0, once_pick_count):
-                    if not cmd_list:
-                        break
-
-                    # python2 must use encode string to bytes or there will be messy code
-                    # python3 must not use encode methed because it will transform string to bytes
-                    if sys.version_info.major < 3 and not conv_compat_py2_write_buffer:
-                        this_thd_cmds.append(
-                            " ".join(cmd_list.pop()).encode(console_encoding)
-                        )
-                    else:
-                        this_thd_cmds.append(" ".join(cmd_list.pop()))
-                cmd_picker_lock.release()
+        plan_phases.clear()
+        return failed_count
 
+    if agent_server is not None and options.wait_agents > 0:
+        connected_agents = agent_server.wait_agents(options.wait_agents, 60)
+        if connected_agents < options.wait_agents:
             cprintf_stdout(
-                [print_style.FC_GREEN],
-                ('"{0}"' + os.linesep + "\t> {1}" + os.linesep).format(
-                    '" "'.join(java_options), (os.linesep + "\t> ").join(this_thd_cmds)
-                ),
+                [print_style.FC_YELLOW],
+                "[NOTICE] only {0} of {1} agent slot(s) connected, start converting{2}",
+                connected_agents,
+                options.wait_agents,
+                os.linesep,
             )
 
-    # ----------------------------------------- 实际开始转换 -----------------------------------------
-    for i in range(0, options.parallelism):
-        this_worker_thd = threading.Thread(target=worker_func, args=[i, exit_data])
-        this_worker_thd.start()
-        all_worker_thread.append(this_worker_thd)
+    exit_code = dispatch_cmds(cmd_list)
+    if not options.watch or options.test or run_flags["interrupted"]:
+        if agent_server is not None:
+            agent_server.close()
+        return exit_code
 
-    # 等待退出
-    for thd in all_worker_thread:
-        thd.join()
+    # ========================================= 监听模式 =========================================
+    # 监听数据源文件、协议文件、xresloader和转换列表，变化后只重新转换受影响的转换项
+    watch_item_files = {}
+    for conv_item in plan.items:
+        if not conv_item["enable"]:
+            continue
+        for file_path in plan.item_input_candidates(conv_item):
+            watch_item_files.setdefault(normalize_watch_path(file_path), []).append(conv_item)
+    watch_global_files = set(
+        [
+            normalize_watch_path(plan.path(x))
+            for x in plan.options["protocol_files"]["paths"] + [plan.options["xresloader_path"]]
+        ]
+    )
+    watch_xml_files = set([normalize_watch_path(x) for x in plan.xml_files])
 
+    watcher = FileWatcher(list(watch_item_files.keys()) + list(watch_global_files) + list(watch_xml_files))
     cprintf_stdout(
-        [print_style.FC_MAGENTA],
-        "[INFO] all jobs done. {0} job(s) failed.{1}".format(exit_data["exit_code"], os.linesep),
+        [print_style.FC_YELLOW],
+        "[NOTICE] watching {0} file(s) by {1}, press Ctrl+C to stop{2}",
+        len(watcher.files),
+        watcher.backend.name,
+        os.linesep,
     )
-    return exit_data["exit_code"]
+
+    # 转换过程中的信号由执行器处理，等待文件变化时收到 SIGTERM 和 Ctrl+C 一样退出
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        while True:
+            changed_files = watcher.wait_changes(options.watch_debounce)
+            if changed_files & watch_xml_files:
+                # 转换列表变化时重新启动整个进程，重新加载所有配置
+                cprintf_stdout([print_style.FC_YELLOW], "[NOTICE] convert list changed, reload{0}", os.linesep)
+                watcher.close()
+                executor.close()
+                if agent_server is not None:
+                    agent_server.close()
+                os.chdir(startup_cwd)
+                # execv 不会执行 atexit ，先写出输出队列里的内容
+                cprintf_flush()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+
+            if changed_files & watch_global_files:
+                changed_cmd_list = cmd_list
+            else:
+                changed_items = set()
+                for file_path in changed_files:
+                    for conv_item in watch_item_files.get(file_path, []):
+                        changed_items.add(id(conv_item))
+                changed_cmd_list = [x for x in cmd_list if id(x["item"]) in changed_items]
+
+            cprintf_stdout(
+                [print_style.FC_YELLOW],
+                "[NOTICE] {0} file(s) changed, reconvert {1} command(s){2}",
+                len(changed_files),
+                len(changed_cmd_list),
+                os.linesep,
+            )
+            plan.reset_input_files()
+            exit_code = dispatch_cmds(changed_cmd_list)
+            if run_flags["interrupted"]:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        executor.close()
+        if agent_server is not None:
+            agent_server.close()
+    return exit_code
+
 
 if __name__ == "__main__":
     exit(main())
@@ -0,0 +1,747 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import array
+import stat
+import errno
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+from argparse import ArgumentParser
+from subprocess import PIPE, Popen
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # windows
+    fcntl = None
+    termios = None
+
+from xresconv_resource import jvm_preexec_func
+
+# ==================================================================================
+# xresloader 常驻进程服务
+# xresloader 的 --stdin 模式只能在进程退出时通过返回码报告失败数量，所以一个JVM只能服务一个会话。
+# 这里的daemon按 (工作目录, java参数, jar文件) 维护预先启动好的JVM池，客户端连接时直接取用已经启动完毕的JVM，
+# 同时在后台补充新的JVM，从而把JVM启动和jar加载的开销移出转表的关键路径。
+# jar文件或java参数变化时旧的JVM会被关闭并重新启动，空闲超时后daemon自动退出。
+# 每个会话都使用一个新的JVM(xresloader结束标准输入后才退出并返回失败数量)，只省掉JVM启动和加载jar的时间，JIT预热不会跨会话复用。
+# daemon会按请求启动任意的java命令，所以socket放在只有当前用户能访问的目录里，两端都检查对方是不是当前用户。
+
+DAEMON_PROTOCOL_VERSION = 1
+DAEMON_DEFAULT_IDLE_TIMEOUT = 600
+DAEMON_CONNECT_TIMEOUT = 10
+
+FRAME_STDOUT = b"o"
+FRAME_STDERR = b"e"
+FRAME_EXIT = b"x"
+FRAME_ERROR = b"r"
+# JVM读完了已经写入的所有标准输入，载荷是已经被读取的总字节数。会话开始时先发送一次0表示支持这个消息
+FRAME_DRAINED = b"d"
+FRAME_HEADER = struct.Struct("!cI")
+DRAINED_PAYLOAD = struct.Struct("!Q")
+OUTPUT_LINE_LIMIT = 64 * 1024
+# 查询管道是否清空的间隔从 DRAIN_POLL_MIN_INTERVAL 开始每次翻倍，最长 DRAIN_POLL_INTERVAL
+# 命令很快执行完时JVM不会因为等待下一次查询而空闲，执行时间长的命令也不会频繁查询
+DRAIN_POLL_MIN_INTERVAL = 0.0001
+DRAIN_POLL_INTERVAL = 0.01
+# 旧版本的daemon和agent不发送 FRAME_DRAINED ，超过这个时间没有收到任何消息时不再等待
+DRAIN_PROBE_TIMEOUT = 5.0
+
+
+def daemon_supported():
+    return hasattr(socket, "AF_UNIX")
+
+
+def default_socket_path():
+    if hasattr(os, "getuid"):
+        user_id = str(os.getuid())
+    else:
+        user_id = os.getenv("USERNAME", "user")
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if not runtime_dir or not os.path.isdir(runtime_dir):
+        runtime_dir = tempfile.gettempdir()
+    return os.path.join(runtime_dir, "xresconv-cli-{0}".format(user_id), "daemon.sock")
+
+
+def ensure_private_dir(dir_path):
+    """ 创建只有当前用户能访问的目录，已经存在时检查所有者和权限，防止其他用户预先创建同名的目录或socket """
+    try:
+        os.mkdir(dir_path, 0o700)
+    except EnvironmentError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    st = os.lstat(dir_path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o077 or (hasattr(os, "getuid") and st.st_uid != os.getuid()):
+        raise EnvironmentError(errno.EACCES, "{0} is not a private directory of current user".format(dir_path))
+
+
+def check_peer_user(sock):
+    """ 对端不是当前用户时抛出异常，平台不支持 SO_PEERCRED 时只依赖目录和socket文件的权限 """
+    if not hasattr(socket, "SO_PEERCRED") or not hasattr(os, "getuid"):
+        return
+    _, peer_uid, _ = struct.unpack("3i", sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    if peer_uid != os.getuid():
+        raise EnvironmentError(errno.EACCES, "xresconv daemon peer is owned by another user({0})".format(peer_uid))
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        block = sock.recv(size - len(data))
+        if not block:
+            return None
+        data = data + block
+    return data
+
+
+def recv_line(sock, max_size=1024 * 1024):
+    data = b""
+    while not data.endswith(b"\n"):
+        block = sock.recv(1)
+        if not block:
+            return None
+        data = data + block
+        if len(data) > max_size:
+            return None
+    return data
+
+
+def send_frame(sock, send_lock, frame_type, payload):
+    send_lock.acquire()
+    try:
+        sock.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+    finally:
+        send_lock.release()
+
+
+# ========================================= 服务端 =========================================
+def next_drain_poll_interval(poll_interval):
+    return min(DRAIN_POLL_INTERVAL, poll_interval * 2)
+
+
+def pipe_pending_bytes(pipe):
+    """ 管道里还没有被读取的字节数，不支持时返回None """
+    if fcntl is None or not hasattr(termios, "FIONREAD"):
+        return None
+    pending = array.array("i", [0])
+    try:
+        fcntl.ioctl(pipe.fileno(), termios.FIONREAD, pending, True)
+    except (EnvironmentError, ValueError):
+        return None
+    return pending[0]
+
+
+class DrainReporter:
+    """ 服务端: JVM读完写入的所有标准输入后发送 FRAME_DRAINED ，客户端据此决定什么时候分发下一批命令
+        xresloader 只在执行完前面的命令后才会读取下一行，所以管道清空就说明JVM手里只剩最后读到的命令
+        不支持查询管道时什么都不发送，客户端会退回到一次写入所有命令
+    """
+
+    def __init__(self, pipe, send_func):
+        self.pipe = pipe
+        self.send_func = send_func
+        self.written_bytes = 0
+        self.reported_bytes = 0
+        self.closed = threading.Event()
+        self.written = threading.Event()
+        self.thd = None
+        if pipe_pending_bytes(pipe) is None:
+            return
+        send_func(FRAME_DRAINED, DRAINED_PAYLOAD.pack(0))
+        self.thd = threading.Thread(target=self._run)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def add_written(self, size):
+        """ 写入JVM的标准输入之后调用 """
+        self.written_bytes = self.written_bytes + size
+        self.written.set()
+
+    def _run(self):
+        poll_interval = DRAIN_POLL_MIN_INTERVAL
+        while not self.closed.is_set():
+            written_bytes = self.written_bytes
+            if written_bytes <= self.reported_bytes:
+                # 没有新写入的命令时等待下一次写入
+                self.written.wait()
+                self.written.clear()
+                poll_interval = DRAIN_POLL_MIN_INTERVAL
+                continue
+            if pipe_pending_bytes(self.pipe) != 0:
+                self.closed.wait(poll_interval)
+                poll_interval = next_drain_poll_interval(poll_interval)
+                continue
+            try:
+                self.send_func(FRAME_DRAINED, DRAINED_PAYLOAD.pack(written_bytes))
+            except EnvironmentError:
+                return
+            self.reported_bytes = written_bytes
+
+    def close(self):
+        """ 关闭JVM的标准输入和发送返回码之前调用，之后不会再发送 FRAME_DRAINED """
+        self.closed.set()
+        self.written.set()
+        if self.thd is not None:
+            self.thd.join()
+
+
+class JvmProfile:
+    def __init__(self, request):
+        self.cwd = request["cwd"]
+        self.java_options = request["java_options"]
+        self.jar_path = os.path.join(self.cwd, request["jar"])
+        # 绑定的CPU，每个worker使用自己的配置，同一组配置的JVM不会互相当作旧配置重启
+        self.cpu_set = request.get("cpu_set")
+
+        try:
+            st = os.stat(self.jar_path)
+            jar_state = "{0}:{1}".format(st.st_mtime, st.st_size)
+        except EnvironmentError:
+            jar_state = "missing"
+
+        sha1 = hashlib.sha1()
+        for value in [self.cwd, jar_state] + self.java_options:
+            sha1.update(value.encode("utf-8"))
+            sha1.update(b"\0")
+        self.group_key = sha1.hexdigest()
+        if self.cpu_set:
+            sha1.update(",".join([str(x) for x in self.cpu_set]).encode("utf-8"))
+        self.key = sha1.hexdigest()
+
+    def spawn(self):
+        return Popen(
+            self.java_options,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+            shell=False,
+            cwd=self.cwd,
+            preexec_fn=jvm_preexec_func(self.cpu_set),
+        )
+
+
+class JvmPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle_jvms = {}
+        self.profiles = {}
+
+    def _terminate(self, pexec):
+        try:
+            pexec.stdin.close()
+        except EnvironmentError:
+            pass
+        if pexec.poll() is None:
+            pexec.terminate()
+        pexec.wait()
+
+    def acquire(self, profile, pool_size):
+        stale_jvms = []
+        pexec = None
+        self.lock.acquire()
+        try:
+            # jar或java参数变化后，同一工作目录下旧配置的JVM全部重启
+            for key in list(self.profiles.keys()):
+                if self.profiles[key].group_key != profile.group_key and self.profiles[key].cwd == profile.cwd:
+                    stale_jvms.extend(self.idle_jvms.pop(key, []))
+                    del self.profiles[key]
+            self.profiles[profile.key] = profile
+
+            idle_jvms = self.idle_jvms.setdefault(profile.key, [])
+            while idle_jvms and pexec is None:
+                candidate = idle_jvms.pop(0)
+                if candidate.poll() is None:
+                    pexec = candidate
+        finally:
+            self.lock.release()
+
+        for stale in stale_jvms:
+            self._terminate(stale)
+
+        if pexec is None:
+            pexec = profile.spawn()
+
+        refill_thd = threading.Thread(target=self.refill, args=[profile, pool_size])
+        refill_thd.daemon = True
+        refill_thd.start()
+        return pexec
+
+    def refill(self, profile, pool_size):
+        while True:
+            self.lock.acquire()
+            try:
+                if profile.key not in self.profiles:
+                    return
+                idle_jvms = self.idle_jvms.setdefault(profile.key, [])
+                if len(idle_jvms) >= pool_size:
+                    return
+            finally:
+                self.lock.release()
+
+            try:
+                pexec = profile.spawn()
+            except EnvironmentError:
+                return
+
+            self.lock.acquire()
+            try:
+                if profile.key in self.profiles:
+                    self.idle_jvms[profile.key].append(pexec)
+                    pexec = None
+            finally:
+                self.lock.release()
+            if pexec is not None:
+                self._terminate(pexec)
+                return
+
+    def shutdown(self):
+        self.lock.acquire()
+        try:
+            all_jvms = []
+            for key in self.idle_jvms:
+                all_jvms.extend(self.idle_jvms[key])
+            self.idle_jvms = {}
+            self.profiles = {}
+        finally:
+            self.lock.release()
+        for pexec in all_jvms:
+            self._terminate(pexec)
+
+
+class XresloaderDaemon:
+    def __init__(self, socket_path, idle_timeout):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.pool = JvmPool()
+        self.lock = threading.Lock()
+        self.active_sessions = 0
+        self.last_active_time = time.time()
+        self.running = True
+
+    def run(self):
+        if os.path.dirname(self.socket_path) == os.path.dirname(default_socket_path()):
+            ensure_private_dir(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            try:
+                connect_daemon(self.socket_path).close()
+                # 已经有daemon在运行
+                return
+            except EnvironmentError as ex:
+                # 不是当前用户的socket时不能删除，也不能替换
+                if errno.EACCES == ex.errno:
+                    raise
+                os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # bind 时直接以0600创建socket文件，不留其他用户可以连接的时间窗口
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(64)
+        server.settimeout(1.0)
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    self.lock.acquire()
+                    idle = 0 == self.active_sessions and time.time() - self.last_active_time > self.idle_timeout
+                    self.lock.release()
+                    if idle:
+                        break
+                    continue
+
+                conn.settimeout(None)
+                try:
+                    check_peer_user(conn)
+                except EnvironmentError:
+                    conn.close()
+                    continue
+                self._session_begin()
+                session_thd = threading.Thread(target=self.serve, args=[conn])
+                session_thd.daemon = True
+                session_thd.start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.pool.shutdown()
+
+    def _session_begin(self):
+        self.lock.acquire()
+        self.active_sessions = self.active_sessions + 1
+        self.last_active_time = time.time()
+        self.lock.release()
+
+    def _session_end(self):
+        self.lock.acquire()
+        self.active_sessions = self.active_sessions - 1
+        self.last_active_time = time.time()
+        self.lock.release()
+
+    def serve(self, conn):
+        send_lock = threading.Lock()
+        try:
+            header = recv_line(conn)
+            if header is None:
+                return
+            request = json.loads(header.decode("utf-8"))
+            if request.get("version") != DAEMON_PROTOCOL_VERSION:
+                send_frame(conn, send_lock, FRAME_ERROR, b"protocol version mismatch")
+                return
+            if "stop" == request.get("command"):
+                self.running = False
+                send_frame(conn, send_lock, FRAME_EXIT, struct.pack("!i", 0))
+                return
+
+            profile = JvmProfile(request)
+            try:
+                pexec = self.pool.acquire(profile, max(1, int(request.get("pool_size", 1))))
+            except EnvironmentError as ex:
+                send_frame(conn, send_lock, FRAME_ERROR, str(ex).encode("utf-8"))
+                return
+            self._run_session(conn, send_lock, pexec)
+        except (ValueError, KeyError, EnvironmentError):
+            pass
+        finally:
+            try:
+                conn.close()
+            except EnvironmentError:
+                pass
+            self._session_end()
+
+    def _run_session(self, conn, send_lock, pexec):
+        def forward_output(pipe, frame_type):
+            client_alive = True
+            for output_line in iter(lambda: pipe.readline(OUTPUT_LINE_LIMIT), b""):
+                # 客户端断开后也要继续读完输出，否则JVM会阻塞在写管道上
+                if not client_alive:
+                    continue
+                try:
+                    send_frame(conn, send_lock, frame_type, output_line)
+                except EnvironmentError:
+                    client_alive = False
+                    # 客户端断开(包括取消转换)后结果没有人接收，直接结束JVM
+                    try:
+                        if pexec.poll() is None:
+                            pexec.terminate()
+                    except EnvironmentError:
+                        pass
+
+        # 第一条消息是 FRAME_DRAINED 时客户端才会等待JVM读完命令再分发
+        drain_reporter = DrainReporter(
+            pexec.stdin, lambda frame_type, data: send_frame(conn, send_lock, frame_type, data)
+        )
+        stdout_thd = threading.Thread(target=forward_output, args=[pexec.stdout, FRAME_STDOUT])
+        stderr_thd = threading.Thread(target=forward_output, args=[pexec.stderr, FRAME_STDERR])
+        stdout_thd.start()
+        stderr_thd.start()
+
+        try:
+            while True:
+                block = conn.recv(65536)
+                if not block:
+                    break
+                pexec.stdin.write(block)
+                pexec.stdin.flush()
+                drain_reporter.add_written(len(block))
+        except EnvironmentError:
+            pass
+        drain_reporter.close()
+        try:
+            pexec.stdin.close()
+        except EnvironmentError:
+            pass
+
+        stdout_thd.join()
+        stderr_thd.join()
+        exit_code = pexec.wait()
+        try:
+            send_frame(conn, send_lock, FRAME_EXIT, struct.pack("!i", exit_code))
+        except EnvironmentError:
+            pass
+
+
+# ========================================= 客户端 =========================================
+class DaemonInput:
+    def __init__(self, sock):
+        self.sock = sock
+        self.sent_bytes = 0
+
+    def write(self, data):
+        self.sock.sendall(data)
+        self.sent_bytes = self.sent_bytes + len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except EnvironmentError:
+            pass
+
+
+class DaemonProcess:
+    """ 和 subprocess.Popen 接口一致的daemon会话，stdin/stdout/stderr/wait 可以直接替换原来的JVM进程
+        keep_sock 时会话结束后不关闭连接，同一个连接可以继续用于下一个会话
+    """
+
+    def __init__(self, sock, stdin=None, keep_sock=False):
+        self.sock = sock
+        self.keep_sock = keep_sock
+        self.returncode = None
+        self.error_message = None
+        # 没有收到结束或错误消息连接就断开了
+        self.connection_lost = True
+        self.terminated = False
+        self.stdin = stdin or DaemonInput(sock)
+        # 收到的第一条消息是 FRAME_DRAINED 时为True，是其他消息时为False(旧版本的服务端)
+        self.drain_supported = None
+        self.drained_bytes = 0
+        self.drain_cond = threading.Condition()
+        stdout_r, self.stdout_w = os.pipe()
+        stderr_r, self.stderr_w = os.pipe()
+        self.stdout = os.fdopen(stdout_r, "rb")
+        self.stderr = os.fdopen(stderr_r, "rb")
+        self.done = threading.Event()
+        self.demux_thd = threading.Thread(target=self._demux)
+        self.demux_thd.daemon = True
+        self.demux_thd.start()
+
+    def _write_fd(self, fd, data):
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+
+    def _demux(self):
+        try:
+            while True:
+                header = recv_exact(self.sock, FRAME_HEADER.size)
+                if header is None:
+                    break
+                frame_type, frame_len = FRAME_HEADER.unpack(header)
+                payload = recv_exact(self.sock, frame_len)
+                if payload is None:
+                    break
+                if self.drain_supported is None:
+                    self._set_drained(FRAME_DRAINED == frame_type, 0)
+                if FRAME_DRAINED == frame_type:
+                    self._set_drained(True, DRAINED_PAYLOAD.unpack(payload)[0])
+                elif FRAME_STDOUT == frame_type:
+                    self._write_fd(self.stdout_w, payload)
+                elif FRAME_STDERR == frame_type:
+                    self._write_fd(self.stderr_w, payload)
+                elif FRAME_EXIT == frame_type:
+                    self.returncode = struct.unpack("!i", payload)[0]
+                    self.connection_lost = False
+                    break
+                elif FRAME_ERROR == frame_type:
+                    self.connection_lost = False
+                    self.error_message = payload.decode("utf-8", "replace")
+                    self._write_fd(self.stderr_w, b"[ERROR] xresconv daemon: " + payload + b"\n")
+                    break
+        except EnvironmentError as ex:
+            self.error_message = str(ex)
+        finally:
+            os.close(self.stdout_w)
+            os.close(self.stderr_w)
+            if not self.keep_sock or self.connection_lost:
+                self.sock.close()
+            self.done.set()
+            self._set_drained(self.drain_supported, self.drained_bytes)
+
+    def _set_drained(self, supported, drained_bytes):
+        self.drain_cond.acquire()
+        try:
+            self.drain_supported = supported
+            self.drained_bytes = drained_bytes
+            self.drain_cond.notify_all()
+        finally:
+            self.drain_cond.release()
+
+    def wait_drained(self):
+        """ 等待JVM读完已经写入的所有标准输入，返回False表示服务端不支持或者会话已经结束(或被结束) """
+        probe_until = time.time() + DRAIN_PROBE_TIMEOUT
+        self.drain_cond.acquire()
+        try:
+            while not self.done.is_set() and not self.terminated:
+                if self.drain_supported is None and time.time() > probe_until:
+                    self.drain_supported = False
+                if self.drain_supported is False:
+                    return False
+                if self.drain_supported and self.drained_bytes >= self.stdin.sent_bytes:
+                    return True
+                # 带超时的wait，python2下才能在等待过程中检查探测超时
+                self.drain_cond.wait(1.0)
+            return False
+        finally:
+            self.drain_cond.release()
+
+    def poll(self):
+        if not self.done.is_set():
+            return None
+        return self.wait()
+
+    def wait(self):
+        self.done.wait()
+        if self.returncode is None:
+            # 连接异常断开时无法得知失败数量，按全部失败处理；主动结束的会话和被信号结束的JVM一样返回负数
+            if self.terminated:
+                self.returncode = -1
+            else:
+                self.returncode = 1
+        return self.returncode
+
+    def terminate(self):
+        """ 断开连接，常驻服务发现客户端断开后会结束JVM """
+        self.mark_terminated()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except EnvironmentError:
+            pass
+
+    def mark_terminated(self):
+        """ 取消转换时等待JVM读完命令的worker要立刻停止分发，关闭标准输入 """
+        self.drain_cond.acquire()
+        try:
+            self.terminated = True
+            self.drain_cond.notify_all()
+        finally:
+            self.drain_cond.release()
+
+
+def connect_daemon(socket_path):
+    st = os.stat(socket_path)
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise EnvironmentError(errno.EACCES, "{0} is owned by another user({1})".format(socket_path, st.st_uid))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        check_peer_user(sock)
+    except EnvironmentError:
+        sock.close()
+        raise
+    return sock
+
+
+def start_daemon(socket_path, idle_timeout):
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--socket",
+        socket_path,
+        "--idle-timeout",
+        str(idle_timeout),
+    ]
+    devnull = open(os.devnull, "r+b")
+    kwargs = {"stdin": devnull, "stdout": devnull, "stderr": devnull, "close_fds": True}
+    if hasattr(os, "setsid"):
+        kwargs["preexec_fn"] = os.setsid
+    Popen(cmd, **kwargs)
+    devnull.close()
+
+
+def ensure_daemon(socket_path, idle_timeout):
+    """ 连接不上时在后台启动daemon并等待其就绪 """
+    try:
+        connect_daemon(socket_path).close()
+        return
+    except EnvironmentError as ex:
+        if ex.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+
+    start_daemon(socket_path, idle_timeout)
+    wait_until = time.time() + DAEMON_CONNECT_TIMEOUT
+    while True:
+        try:
+            connect_daemon(socket_path).close()
+            return
+        except EnvironmentError:
+            if time.time() > wait_until:
+                raise
+            time.sleep(0.05)
+
+
+def open_daemon_process(socket_path, java_options, xresloader_path, pool_size, cwd=None):
+    sock = connect_daemon(socket_path)
+    request = {
+        "version": DAEMON_PROTOCOL_VERSION,
+        "cwd": cwd or os.getcwd(),
+        "java_options": java_options,
+        "jar": xresloader_path,
+        "pool_size": pool_size,
+    }
+    sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+    return DaemonProcess(sock)
+
+
+def stop_daemon(socket_path):
+    try:
+        sock = connect_daemon(socket_path)
+    except EnvironmentError:
+        return False
+    sock.sendall(json.dumps({"version": DAEMON_PROTOCOL_VERSION, "command": "stop"}).encode("utf-8") + b"\n")
+    proc = DaemonProcess(sock)
+    proc.stdin.close()
+    proc.wait()
+    return True
+
+
+def main():
+    parser = ArgumentParser(usage="%(prog)s [options...]")
+    parser.add_argument(
+        "--socket",
+        action="store",
+        help="set unix socket path(default: " + default_socket_path() + ")",
+        metavar="<socket path>",
+        dest="socket_path",
+        default=default_socket_path(),
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        action="store",
+        help="exit after idle for <seconds>(default: " + str(DAEMON_DEFAULT_IDLE_TIMEOUT) + ")",
+        metavar="<seconds>",
+        dest="idle_timeout",
+        type=float,
+        default=DAEMON_DEFAULT_IDLE_TIMEOUT,
+    )
+    parser.add_argument(
+        "--stop",
+        action="store_true",
+        help="stop the running daemon",
+        dest="stop",
+        default=False,
+    )
+    options = parser.parse_args()
+
+    if not daemon_supported():
+        sys.stderr.write("[ERROR] unix socket is not supported on this platform" + os.linesep)
+        return -1
+
+    if options.stop:
+        if stop_daemon(options.socket_path):
+            return 0
+        return 1
+
+    try:
+        XresloaderDaemon(options.socket_path, options.idle_timeout).run()
+    except EnvironmentError as ex:
+        sys.stderr.write("[ERROR] start daemon failed: {0}{1}".format(ex, os.linesep))
+        return -1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,1213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import signal
+import threading
+from argparse import ArgumentTypeError
+from subprocess import PIPE, Popen
+
+from print_color import cprintf_stderr, cprintf_stdout, cprintf_write, print_style
+from xresconv_daemon import (
+    DRAIN_POLL_MIN_INTERVAL,
+    JvmPool,
+    JvmProfile,
+    next_drain_poll_interval,
+    open_daemon_process,
+    pipe_pending_bytes,
+)
+from xresconv_history import HISTORY_KIND_RUN, make_run_id
+from xresconv_incremental import IncrementalCache
+from xresconv_resource import (
+    MemoryBudget,
+    auto_parallelism,
+    available_memory_mb,
+    children_peak_rss_bytes,
+    cpu_pinning_java_options,
+    insert_java_option,
+    jvm_preexec_func,
+    plan_cpu_pinning,
+    plan_jvm_memory,
+)
+from xresconv_result import (
+    failed_batches,
+    failed_job_count,
+    is_batch_attributed,
+    split_failed_batch,
+    write_failure_list,
+)
+from xresconv_scheduler import (
+    assign_by_cost,
+    estimate_command_costs,
+    group_commands,
+    item_input_size,
+    split_session_durations,
+    split_large_groups,
+)
+from xresconv_trace import TRACE_TID_MAIN, worker_command_tid, worker_jvm_tid
+
+# ==================================================================================
+# 转换执行器: 把 ConvertPlan 生成的转换命令分配给多个xresloader JVM执行
+# 同一个执行器可以反复执行不同计划的命令，keep_jvms 时会保留一组预先启动的JVM给下一次执行使用
+
+OUTPUT_LINE_LIMIT = 64 * 1024
+JAVA_ENCODING = "utf-8"
+XRESLOADER_ERROR_TAG = b"[ERROR]"
+# 转换过程中收到这些信号时取消转换，再次收到时强制kill JVM
+CANCEL_SIGNALS = [("SIGINT", signal.SIGINT), ("SIGTERM", signal.SIGTERM)]
+# JVM收到 SIGTERM/SIGINT 后会执行关闭流程，以 128+信号值 退出，而不是被信号直接杀掉(返回码小于0)
+CANCEL_EXIT_CODES = [128 + x[1] for x in CANCEL_SIGNALS]
+
+EXECUTOR_DEFAULT_SETTINGS = {
+    "java_path": "java",
+    # 命令行传入的java参数，转换列表里的 java_option 会追加在后面
+    "java_options": [],
+    "parallelism": 2,
+    "schedule": "declare",
+    "affinity": False,
+    "retry": 0,
+    # 每次给JVM写入的命令组数，JVM读完之前写入的命令后才写入下一批。gss: 按剩余命令组数和worker数自适应，越往后越小
+    # 0: 取到就写入，只靠管道的背压限制，一个worker可能把队列里的命令都放进自己的管道
+    "dispatch_depth": 1,
+    # 第一个失败(JVM输出错误日志或返回失败数量)后停止分发，结束所有运行中的JVM，不再重试
+    "fail_fast": False,
+    # 使用断点续转日志时每个JVM最多执行的命令数，xresloader只在JVM退出时返回结果，JVM退出后才能记录到日志里
+    "checkpoint_interval": 50,
+    "daemon_socket": None,
+    # xresconv_agent.AgentServer ，连接上的agent和本地JVM一起从队列里拉取命令
+    "agent_server": None,
+    "keep_jvms": False,
+    # 按可用内存限制同时运行的JVM数量，没有指定 -Xmx 时自动设置堆大小。memory_limit 为None时自动探测(MB)
+    "memory_aware": False,
+    "memory_limit": None,
+    # 给每个worker启动的JVM绑定互不重叠的CPU，并按分到的CPU数设置GC和JIT线程数
+    "cpu_pinning": False,
+    # thread: 每个worker一个线程，每个JVM两个转发输出的线程。asyncio: 一个事件循环线程执行所有本地JVM(python 3.8+)
+    "engine": "thread",
+    "dry_run": False,
+    # python2下控制台编码和java输出编码不一致并且无法转换时，直接输出原始数据
+    "py2_write_buffer": False,
+}
+
+
+def parse_dispatch_depth(value):
+    """ dispatch_depth 的命令行参数: 不小于0的整数或者gss """
+    if "gss" == value.lower():
+        return "gss"
+    try:
+        ret = int(value)
+    except ValueError:
+        raise ArgumentTypeError("invalid dispatch depth: {0}".format(value))
+    if ret < 0:
+        raise ArgumentTypeError("dispatch depth must not be less than 0")
+    return ret
+
+
+def cmd_label(cmd):
+    return cmd["item"]["name"] or cmd["item"]["file"] or ""
+
+
+def encode_cmd_lines(cmds):
+    """ 写入xresloader标准输入的内容，每行一个命令 """
+    return "".join([" ".join(cmd["args"]) + os.linesep for cmd in cmds]).encode(JAVA_ENCODING)
+
+
+def pick_from_queue(worker_cmd_list, cmd_picker_lock):
+    def pick_func():
+        ret = []
+        cmd_picker_lock.acquire()
+        if worker_cmd_list:
+            ret = worker_cmd_list.pop()["cmds"]
+        cmd_picker_lock.release()
+        return ret
+
+    return pick_func
+
+
+def pick_from_queues(worker_cmd_lists, cmd_picker_lock):
+    """ 从剩余最多的队列里取，用于没有自己队列的agent """
+
+    def pick_func():
+        ret = []
+        cmd_picker_lock.acquire()
+        longest_cmd_list = None
+        for worker_cmd_list in worker_cmd_lists:
+            if worker_cmd_list and (longest_cmd_list is None or len(worker_cmd_list) > len(longest_cmd_list)):
+                longest_cmd_list = worker_cmd_list
+        if longest_cmd_list is not None:
+            ret = longest_cmd_list.pop()["cmds"]
+        cmd_picker_lock.release()
+        return ret
+
+    return pick_func
+
+
+def pick_with_fallback(pick_func, fallback_func):
+    def pick_func_with_fallback():
+        return pick_func() or fallback_func()
+
+    return pick_func_with_fallback
+
+
+def is_cancel_exit_code(exit_code):
+    """ JVM被取消时的返回码: 被信号杀掉或者收到取消信号后自己退出 """
+    return exit_code < 0 or exit_code in CANCEL_EXIT_CODES
+
+
+def pick_once(cmds):
+    picked = {"done": False}
+
+    def pick_func():
+        if picked["done"]:
+            return []
+        picked["done"] = True
+        return cmds
+
+    return pick_func
+
+
+class ConvertExecutor:
+    def __init__(self, settings=None):
+        self.settings = dict(EXECUTOR_DEFAULT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.console_encoding = sys.getfilesystemencoding()
+        self.jvm_pool = None
+        self.memory_plan = None
+        self.memory_budget = None
+        self.cpu_plan = None
+        # 执行本地worker的引擎，resolve_engine 之前为None
+        self.engine = None
+        if self.settings["keep_jvms"] and not self.settings["daemon_socket"] and not self.settings["dry_run"]:
+            self.jvm_pool = JvmPool()
+
+    def close(self):
+        if self.jvm_pool is not None:
+            self.jvm_pool.shutdown()
+
+    @property
+    def parallelism(self):
+        return self.settings["parallelism"]
+
+    # ++++++++++++++++++++++++++++++++++++++++++ java命令 ++++++++++++++++++++++++++++++++++++++++++
+    def build_java_options(self, plan):
+        java_options = [self.settings["java_path"]]
+        java_options.extend(self.settings["java_options"])
+        java_options.extend(plan.options["java_options"])
+        java_options.append("-Dfile.encoding={0}".format(JAVA_ENCODING))
+        java_options.append("-jar")
+        java_options.append(plan.options["xresloader_path"])
+        java_options.append("--stdin")
+        return java_options
+
+    def build_local_java_options(self, plan):
+        """ 本机启动的JVM还要加上自动设置的堆大小和绑定CPU后的线程数 """
+        java_options = self.build_java_options(plan)
+        if self.memory_plan is not None and self.memory_plan["heap_option"]:
+            java_options = insert_java_option(java_options, self.memory_plan["heap_option"])
+        if self.cpu_plan is not None and self.cpu_plan["cpu_sets"]:
+            java_options = cpu_pinning_java_options(java_options, self.cpu_plan["active_processors"])
+        return java_options
+
+    def worker_cpu_set(self, idx):
+        """ worker绑定的CPU，没有绑定时返回None。重试和排空队列的worker复用同一个编号的CPU """
+        if self.cpu_plan is None or not self.cpu_plan["cpu_sets"]:
+            return None
+        cpu_sets = self.cpu_plan["cpu_sets"]
+        return cpu_sets[idx % len(cpu_sets)]
+
+    def resolve_parallelism(self, plan, cmd_list, history_store):
+        """ 并发数是 auto 时根据机器资源和历史吞吐量确定，返回决策说明 """
+        if "auto" != self.settings["parallelism"]:
+            return []
+        run_records = []
+        if history_store is not None:
+            run_records = history_store.run_records()
+        self.settings["parallelism"], reasons = auto_parallelism(
+            self.build_java_options(plan),
+            len(set([id(cmd["item"]) for cmd in cmd_list])),
+            run_records,
+        )
+        return reasons
+
+    def resolve_memory(self, plan):
+        """ memory_aware 时根据可用内存确定堆大小并限制并发数，返回决策说明，只在第一次调用时生效 """
+        if not self.settings["memory_aware"] or self.memory_plan is not None:
+            return []
+        memory_mb = self.settings["memory_limit"] or available_memory_mb()
+        if memory_mb is None:
+            self.memory_plan = {"heap_option": None, "reasons": ["memory: unknown"]}
+            return self.memory_plan["reasons"]
+
+        # 预先启动的JVM在等待时也占用内存
+        jvms_per_worker = 1
+        if self.jvm_pool is not None:
+            jvms_per_worker = 2
+        self.memory_plan = plan_jvm_memory(
+            self.build_java_options(plan), self.parallelism, memory_mb, jvms_per_worker
+        )
+        self.settings["parallelism"] = self.memory_plan["parallelism"]
+        self.memory_budget = MemoryBudget(self.memory_plan["budget_mb"])
+        return self.memory_plan["reasons"]
+
+    def resolve_cpu_pinning(self):
+        """ cpu_pinning 时按最终的并发数给每个worker分配CPU，返回决策说明，只在第一次调用时生效 """
+        if not self.settings["cpu_pinning"] or self.cpu_plan is not None:
+            return []
+        # daemon的JVM由daemon进程启动，agent按自己的 --cpu-pinning 绑定
+        if self.settings["daemon_socket"]:
+            self.cpu_plan = {"cpu_sets": [], "active_processors": None, "reasons": ["daemon mode, disabled"]}
+        else:
+            self.cpu_plan = plan_cpu_pinning(self.parallelism)
+        return self.cpu_plan["reasons"]
+
+    def resolve_engine(self):
+        """ engine 是 asyncio 时创建 xresconv_async.AsyncEngine ，不支持时使用线程，返回决策说明，只在第一次调用时生效 """
+        if self.engine is not None:
+            return []
+        self.engine = self
+        if "asyncio" != self.settings["engine"] or self.settings["dry_run"]:
+            return []
+        if sys.version_info < (3, 8):
+            return ["asyncio engine requires python 3.8 or upper, use thread engine"]
+        # daemon的会话和 --watch 预先启动的JVM不是由事件循环创建的子进程
+        if self.settings["daemon_socket"]:
+            return ["daemon sessions are not subprocesses, use thread engine"]
+        if self.jvm_pool is not None:
+            return ["pre-started JVMs are not subprocesses of the event loop, use thread engine"]
+
+        # python2无法解析 async 语法，只在需要时导入
+        from xresconv_async import AsyncEngine
+
+        self.engine = AsyncEngine(self)
+        return []
+
+    # ++++++++++++++++++++++++++++++++++++++++++ 增量转换 ++++++++++++++++++++++++++++++++++++++++++
+    def compute_fingerprints(self, plan, cmd_list, incremental_cache):
+        """ 设置每个命令的 cmd["fingerprint"] ，包括命令参数、java参数、xresloader和所有输入文件的hash """
+        incremental_cache.reset_checked_files()
+        fingerprint_extra_values = self.build_java_options(plan)
+        fingerprint_extra_values.append(incremental_cache.file_hash(plan.path(plan.options["xresloader_path"])))
+        for cmd in cmd_list:
+            cmd["fingerprint"] = incremental_cache.fingerprint(
+                cmd["args"],
+                plan.item_input_files(cmd["item"]) + plan.options["protocol_files"]["paths"],
+                fingerprint_extra_values,
+                plan.base_dir,
+            )
+
+    def filter_unchanged_cmds(self, plan, cmd_list, incremental_cache):
+        self.compute_fingerprints(plan, cmd_list, incremental_cache)
+        incremental_cmd_list = []
+        for cmd in cmd_list:
+            if not incremental_cache.is_unchanged(cmd["key"], cmd["fingerprint"]):
+                incremental_cmd_list.append(cmd)
+
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] incremental mode: {0} of {1} command(s) unchanged and skipped{2}",
+            len(cmd_list) - len(incremental_cmd_list),
+            len(cmd_list),
+            os.linesep,
+        )
+        return incremental_cmd_list
+
+    def filter_completed_cmds(self, plan, cmd_list, journal, incremental_cache):
+        """ 跳过断点续转日志里已经完成并且指纹没有变化的命令，没有增量转换缓存时每次都重新计算文件hash """
+        if incremental_cache is None:
+            self.compute_fingerprints(plan, cmd_list, IncrementalCache(None))
+        completed = journal.load()
+        if not completed:
+            return cmd_list
+        resume_cmd_list = [x for x in cmd_list if completed.get(x["key"]) != x["fingerprint"]]
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] resume: {0} of {1} command(s) already completed and skipped{2}",
+            len(cmd_list) - len(resume_cmd_list),
+            len(cmd_list),
+            os.linesep,
+        )
+        return resume_cmd_list
+
+    # ++++++++++++++++++++++++++++++++++++++++++ 调度顺序 ++++++++++++++++++++++++++++++++++++++++++
+    # 队列里的元素是命令组，同一组的命令会在同一个JVM里连续执行
+    # 默认所有worker共享一个队列；按耗时调度时每个worker按LPT分配独立的队列
+    def build_worker_cmd_lists(self, plan, cmd_list, history_store):
+        parallelism = self.parallelism
+        if "cost" == self.settings["schedule"]:
+            durations = {}
+            if history_store is not None:
+                durations = history_store.last_durations()
+            estimate_command_costs(
+                cmd_list,
+                durations,
+                lambda conv_item: item_input_size([plan.path(x) for x in plan.item_input_files(conv_item)]),
+            )
+
+        # 按数据源文件分组时，同一个Excel文件的所有命令交给同一个JVM，可以复用xresloader进程内的文件缓存
+        def get_cmd_workbook(cmd):
+            item_input_files = plan.item_input_files(cmd["item"])
+            if item_input_files:
+                return os.path.normcase(plan.path(item_input_files[0]))
+            if cmd["item"]["file"]:
+                return os.path.normcase(plan.path(cmd["item"]["file"]))
+            return id(cmd["item"])
+
+        if self.settings["affinity"]:
+            cmd_groups = group_commands(cmd_list, get_cmd_workbook)
+            # 单个文件的命令太多时拆开，保证各个JVM的负载均衡
+            if parallelism > 1 and cmd_groups:
+                cmd_groups = split_large_groups(cmd_groups, sum([x["cost"] for x in cmd_groups]) / parallelism)
+        else:
+            cmd_groups = group_commands(cmd_list, lambda cmd: id(cmd["item"]))
+
+        if "cost" == self.settings["schedule"]:
+            worker_cmd_lists = assign_by_cost(cmd_groups, parallelism)
+            for worker_cmd_list in worker_cmd_lists:
+                worker_cmd_list.reverse()
+        else:
+            cmd_groups.reverse()
+            worker_cmd_lists = [cmd_groups for _ in range(0, parallelism)]
+        return worker_cmd_lists
+
+    # ++++++++++++++++++++++++++++++++++++++++++ 输出转发 ++++++++++++++++++++++++++++++++++++++++++
+    def print_buffer_to_fd(self, fd, buffer):
+        # 所有worker的输出都交给 print_color 的输出队列，每一行完整写出，不会和其他JVM的输出交错
+        if sys.version_info.major >= 3:
+            buffer = buffer.decode(JAVA_ENCODING, "replace")
+        elif self.console_encoding != JAVA_ENCODING and not self.settings["py2_write_buffer"]:
+            buffer = buffer.decode(JAVA_ENCODING, "replace")
+        cprintf_write(fd, None, buffer)
+
+    # 逐行转发JVM的输出，单行最多读取 OUTPUT_LINE_LIMIT 字节，保证内存占用有上限
+    # error_func 不为None时，遇到xresloader的错误日志会调用一次
+    def new_output_stat(self, idx, error_func=None):
+        return {
+            "bytes": 0,
+            "prefix": "[worker {0}] ".format(idx).encode(JAVA_ENCODING),
+            "at_line_start": True,
+            "error_func": error_func,
+        }
+
+    def forward_output(self, pipe, fd, output_stat):
+        for output_line in iter(lambda: pipe.readline(OUTPUT_LINE_LIMIT), b""):
+            self.forward_output_line(output_line, fd, output_stat)
+
+    def forward_output_line(self, output_line, fd, output_stat):
+        """ output_stat 由 new_output_stat 创建，超长的行会被拆成多段转发 """
+        output_stat["bytes"] = output_stat["bytes"] + len(output_line)
+        error_func = output_stat["error_func"]
+        if error_func is not None and XRESLOADER_ERROR_TAG in output_line:
+            output_stat["error_func"] = None
+            error_func()
+        if output_stat["at_line_start"]:
+            output_line = output_stat["prefix"] + output_line
+        output_stat["at_line_start"] = output_line.endswith(b"\n")
+        self.print_buffer_to_fd(fd, output_line)
+
+    # ++++++++++++++++++++++++++++++++++++++++++ JVM ++++++++++++++++++++++++++++++++++++++++++
+    def open_jvm(self, plan, java_options, agent=None, cpu_set=None):
+        if agent is not None:
+            return agent.open_process(plan.base_dir, java_options[1:], plan.options["xresloader_path"])
+        if self.settings["daemon_socket"]:
+            return open_daemon_process(
+                self.settings["daemon_socket"],
+                java_options,
+                plan.options["xresloader_path"],
+                self.parallelism,
+                plan.base_dir,
+            )
+        if self.jvm_pool is not None:
+            # 绑定CPU时每个worker有自己的配置，只需要给自己预先启动一个JVM
+            pool_size = self.parallelism
+            if cpu_set:
+                pool_size = 1
+            return self.jvm_pool.acquire(
+                JvmProfile(
+                    {
+                        "cwd": plan.base_dir,
+                        "java_options": java_options,
+                        "jar": plan.options["xresloader_path"],
+                        "cpu_set": cpu_set,
+                    }
+                ),
+                pool_size,
+            )
+        return Popen(
+            java_options,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+            shell=False,
+            cwd=plan.base_dir,
+            preexec_fn=jvm_preexec_func(cpu_set),
+        )
+
+    # ++++++++++++++++++++++++++++++++++++++++++ 取消 ++++++++++++++++++++++++++++++++++++++++++
+    # run_state["processes"] 里是运行中的JVM {"pexec", "terminated", "failed_fast"}
+    # 取消后不再分发新的命令，运行中的JVM都会被结束，被结束的JVM里的命令算作取消而不是失败
+    def register_process(self, run_state, process_entry):
+        run_state["lock"].acquire()
+        try:
+            run_state["processes"].append(process_entry)
+            cancelled = run_state["cancelled"] is not None
+        finally:
+            run_state["lock"].release()
+        if cancelled:
+            self.terminate_process(process_entry)
+
+    def unregister_process(self, run_state, process_entry):
+        run_state["lock"].acquire()
+        run_state["processes"].remove(process_entry)
+        run_state["lock"].release()
+
+    def terminate_process(self, process_entry, force=False):
+        pexec = process_entry["pexec"]
+        try:
+            if pexec.poll() is not None:
+                return
+            process_entry["terminated"] = True
+            # 常驻服务和agent的会话没有kill，只能通知对端结束JVM
+            if force and hasattr(pexec, "kill"):
+                pexec.kill()
+            else:
+                pexec.terminate()
+        except EnvironmentError:
+            pass
+
+    def cancel_run(self, run_state, reason, force=False):
+        """ 取消这次转换，重复取消时只有 force 才会再次结束JVM(强制kill) """
+        run_state["lock"].acquire()
+        try:
+            first_cancel = run_state["cancelled"] is None
+            if first_cancel:
+                run_state["cancelled"] = reason
+            process_entries = list(run_state["processes"])
+        finally:
+            run_state["lock"].release()
+        if first_cancel:
+            cprintf_stderr(
+                [print_style.FC_RED],
+                "[ERROR] {0}, stop dispatching and terminate {1} running JVM(s){2}",
+                reason,
+                len(process_entries),
+                os.linesep,
+            )
+        elif not force:
+            return
+        for process_entry in process_entries:
+            self.terminate_process(process_entry, force)
+
+    def fail_fast(self, run_state, process_entry, idx):
+        # 输出了错误日志的JVM里至少有一个命令失败，被结束后不算作取消
+        process_entry["failed_fast"] = True
+        self.cancel_run(run_state, "fail fast: worker {0} reported an error".format(idx))
+
+    def fail_fast_func(self, run_state, process_entry, idx):
+        """ 转发输出时遇到错误日志调用的函数，没有开启 fail_fast 时返回None """
+        if not self.settings["fail_fast"]:
+            return None
+
+        def error_func():
+            self.fail_fast(run_state, process_entry, idx)
+
+        return error_func
+
+    # 启动一个JVM，把 pick_func 返回的命令写入标准输入，直到返回空列表
+    # 转换已经取消时不启动JVM，返回None
+    def jvm_session_options(self, plan, idx, agent=None):
+        """ 返回 (java参数, 绑定的CPU, 需要申请的内存MB)，agent所在的机器自己决定内存限制和CPU绑定 """
+        if agent is not None:
+            return self.build_java_options(plan), None, 0
+        memory_size_mb = 0
+        if self.memory_budget is not None:
+            memory_size_mb = self.memory_plan["footprint_mb"]
+        return self.build_local_java_options(plan), self.worker_cpu_set(idx), memory_size_mb
+
+    def acquire_jvm_memory(self, run_state, idx, memory_size_mb):
+        """ 超出内存预算时排队等待其他JVM退出，等待过程中转换被取消时释放内存并返回False """
+        if memory_size_mb <= 0:
+            return True
+        trace = run_state["trace"]
+        memory_wait_time = time.time()
+        self.memory_budget.acquire(memory_size_mb)
+        # 排队等待其他JVM退出的时间
+        if trace is not None and time.time() - memory_wait_time > 0.001:
+            trace.add_span("memory wait", "jvm", worker_jvm_tid(idx), memory_wait_time, time.time())
+        if run_state["cancelled"] is not None:
+            self.memory_budget.release(memory_size_mb)
+            return False
+        return True
+
+    def pick_dispatch_cmds(self, run_state, pick_func, paced):
+        """ 取下一批要写入JVM的命令，没有剩余命令时返回空列表 """
+        cmds = []
+        for _ in range(0, self.dispatch_chunk_size(run_state) if paced else 1):
+            group_cmds = pick_func()
+            if not group_cmds:
+                break
+            cmds.extend(group_cmds)
+        return cmds
+
+    def run_jvm_session(self, run_state, idx, pick_func, attempt, agent=None):
+        plan = run_state["plan"]
+        trace = run_state["trace"]
+        if run_state["cancelled"] is not None:
+            return None
+        java_options, cpu_set, memory_size_mb = self.jvm_session_options(plan, idx, agent)
+        if not self.acquire_jvm_memory(run_state, idx, memory_size_mb):
+            return None
+
+        start_time = time.time()
+        try:
+            pexec = self.open_jvm(plan, java_options, agent, cpu_set)
+        except EnvironmentError:
+            if memory_size_mb > 0:
+                self.memory_budget.release(memory_size_mb)
+            raise
+        spawn_end_time = time.time()
+        process_entry = {"pexec": pexec, "terminated": False, "failed_fast": False}
+        self.register_process(run_state, process_entry)
+
+        # xresloader的错误日志可能输出在标准输出或标准错误里，两个都要检查
+        error_func = self.fail_fast_func(run_state, process_entry, idx)
+        stdout_stat = self.new_output_stat(idx, error_func)
+        stderr_stat = self.new_output_stat(idx, error_func)
+        worker_thd_print_stdout = threading.Thread(
+            target=self.forward_output, args=[pexec.stdout, sys.stdout, stdout_stat]
+        )
+        worker_thd_print_stderr = threading.Thread(
+            target=self.forward_output, args=[pexec.stderr, sys.stderr, stderr_stat]
+        )
+        worker_thd_print_stdout.start()
+        worker_thd_print_stderr.start()
+
+        this_thd_cmds = []
+        # 每批写入的命令数和JVM读走这批命令的时间，用于统计每个命令的耗时
+        batch_sizes = []
+        drain_times = []
+        stdin_broken = False
+        session_limit = run_state["session_limit"]
+        paced = self.settings["dispatch_depth"] != 0
+        while run_state["cancelled"] is None and not stdin_broken:
+            if session_limit > 0 and len(this_thd_cmds) >= session_limit:
+                break
+            # JVM读完之前的命令才分发下一批，不支持查询时退回到只靠管道背压
+            if paced and this_thd_cmds:
+                drain_wait_time = time.time()
+                paced = self.wait_jvm_drained(run_state, pexec)
+                if paced:
+                    drain_times.append(time.time())
+                if trace is not None and time.time() - drain_wait_time > 0.001:
+                    trace.add_span("drain wait", "dispatch", worker_jvm_tid(idx), drain_wait_time, time.time())
+                if run_state["cancelled"] is not None:
+                    break
+            cmds = self.pick_dispatch_cmds(run_state, pick_func, paced)
+            if not cmds:
+                break
+            batch_start_time = time.time()
+            this_thd_cmds.extend(cmds)
+            batch_sizes.append(len(cmds))
+            try:
+                pexec.stdin.write(encode_cmd_lines(cmds))
+                pexec.stdin.flush()
+            except EnvironmentError:
+                # JVM已经退出(包括被取消)，剩下的命令不再写入
+                stdin_broken = True
+            if trace is not None:
+                # 写入阻塞的时间就是标准输入的背压
+                self.trace_dispatch_batch(trace, idx, cmds, batch_start_time)
+        stdin_close_time = time.time()
+        try:
+            pexec.stdin.close()
+        except EnvironmentError:
+            stdin_broken = True
+        cmd_exit_code = pexec.wait()
+        exit_time = time.time()
+        self.unregister_process(run_state, process_entry)
+        if memory_size_mb > 0:
+            self.memory_budget.release(memory_size_mb)
+
+        worker_thd_print_stdout.join()
+        worker_thd_print_stderr.join()
+        end_time = time.time()
+
+        return self.finish_jvm_session(
+            run_state,
+            idx,
+            attempt,
+            {
+                "process_entry": process_entry,
+                "cmds": this_thd_cmds,
+                "batch_sizes": batch_sizes,
+                "drain_times": drain_times,
+                "exit_code": cmd_exit_code,
+                "stdin_broken": stdin_broken,
+                "cpu_set": cpu_set,
+                "timepoints": [start_time, spawn_end_time, stdin_close_time, exit_time, end_time],
+                "stdout_bytes": stdout_stat["bytes"],
+                "stderr_bytes": stderr_stat["bytes"],
+            },
+        )
+
+    def finish_jvm_session(self, run_state, idx, attempt, session):
+        """ JVM退出并转发完输出后统计结果，记录时间线和历史，返回批次结果
+            session 是 {"process_entry", "cmds", "batch_sizes", "drain_times", "exit_code", "stdin_broken", "cpu_set",
+                "timepoints", "stdout_bytes", "stderr_bytes"}，timepoints 是 [启动, 启动完成, 关闭标准输入, 退出, 输出转发完成]
+            drain_times 是JVM读走每批命令的时间，没有按完成情况分发时会比 batch_sizes 短
+        """
+        history_store = run_state["history_store"]
+        trace = run_state["trace"]
+        process_entry = session["process_entry"]
+        this_thd_cmds = session["cmds"]
+        cmd_exit_code = session["exit_code"]
+        jvm_pid = getattr(process_entry["pexec"], "pid", None)
+        start_time = session["timepoints"][0]
+        end_time = session["timepoints"][-1]
+        output_bytes = session["stdout_bytes"] + session["stderr_bytes"]
+
+        # 返回码小于0说明JVM被信号杀掉了，这个JVM里的命令都算失败
+        # 没有写完命令JVM就退出了时也无法知道哪些命令执行了，同样都算失败
+        # 取消时被结束的JVM里的命令结果未知，只有输出了错误日志的JVM可以确定至少有一个命令失败
+        # 终端的Ctrl-C会同时发给JVM，这时JVM可能在被 terminate_process 结束之前就退出了，所以也要检查转换是否已经取消
+        cancelled = (process_entry["terminated"] or run_state["cancelled"] is not None) and is_cancel_exit_code(
+            cmd_exit_code
+        )
+        if cancelled:
+            failed_count = 0
+            if process_entry["failed_fast"]:
+                failed_count = min(1, len(this_thd_cmds))
+        elif cmd_exit_code < 0 or session["stdin_broken"]:
+            failed_count = len(this_thd_cmds)
+        else:
+            failed_count = cmd_exit_code
+
+        # 每批命令的耗时来自JVM读走命令的时间，一批里有多个命令时只能按预估耗时的比例分摊，记录为估算值
+        spawn_end_time, exit_time = session["timepoints"][1], session["timepoints"][3]
+        cmd_durations = split_session_durations(
+            this_thd_cmds, session["batch_sizes"], session["drain_times"], exit_time, exit_time - spawn_end_time
+        )
+
+        if trace is not None:
+            self.trace_jvm_session(
+                trace,
+                idx,
+                session,
+                cmd_durations,
+                {
+                    "jvm": jvm_pid,
+                    "attempt": attempt,
+                    "commands": len(this_thd_cmds),
+                    "exit_code": cmd_exit_code,
+                    "output_bytes": output_bytes,
+                    "cancelled": cancelled,
+                    "cpus": session["cpu_set"],
+                },
+            )
+
+        # 被取消的JVM的耗时不完整，不记录到历史里
+        if history_store is not None and this_thd_cmds and not cancelled:
+            # 输出量只能按JVM统计，按耗时的比例分摊
+            total_duration = sum([x[0] for x in cmd_durations])
+            history_records = []
+            for cmd, (duration, estimated) in zip(this_thd_cmds, cmd_durations):
+                if total_duration > 0:
+                    cmd_output_bytes = int(output_bytes * duration / total_duration)
+                else:
+                    cmd_output_bytes = int(output_bytes / len(this_thd_cmds))
+                history_records.append(
+                    {
+                        "run": run_state["run_id"],
+                        "time": end_time,
+                        "key": cmd["key"],
+                        "name": cmd_label(cmd) or None,
+                        "type": cmd["type"],
+                        "duration": duration,
+                        "estimated": estimated,
+                        "exit_code": cmd_exit_code,
+                        "output_bytes": cmd_output_bytes,
+                        "worker": idx,
+                        "jvm": jvm_pid,
+                        "attempt": attempt,
+                    }
+                )
+            history_store.append(history_records)
+
+        if self.settings["fail_fast"] and failed_count > 0 and not cancelled:
+            self.cancel_run(run_state, "fail fast: {0} command(s) failed in worker {1}".format(failed_count, idx))
+
+        return {
+            "cmds": this_thd_cmds,
+            "failed": failed_count,
+            "cancelled": cancelled,
+            "worker": idx,
+            "duration": end_time - start_time,
+            "stdout_bytes": session["stdout_bytes"],
+            "stderr_bytes": session["stderr_bytes"],
+        }
+
+    # ++++++++++++++++++++++++++++++++++++++++++ 按完成情况分发 ++++++++++++++++++++++++++++++++++++++++++
+    # xresloader 执行完一行命令才读取下一行，JVM的标准输入管道清空时，手里只剩最后读到的一批命令
+    # 这时再写入下一批，每个JVM最多持有两批命令，空闲的JVM总能从队列里拿到命令，转换末尾的负载也更均衡
+    def wait_jvm_drained(self, run_state, pexec):
+        """ 等待JVM读完已经写入标准输入的命令，返回False表示无法得知(不支持查询管道或者JVM已经退出) """
+        if hasattr(pexec, "wait_drained"):
+            return pexec.wait_drained()
+        poll_interval = DRAIN_POLL_MIN_INTERVAL
+        while run_state["cancelled"] is None and pexec.poll() is None:
+            pending_bytes = pipe_pending_bytes(pexec.stdin)
+            if pending_bytes is None:
+                return False
+            if pending_bytes == 0:
+                return True
+            time.sleep(poll_interval)
+            poll_interval = next_drain_poll_interval(poll_interval)
+        return False
+
+    def dispatch_chunk_size(self, run_state):
+        """ 一次写入的命令组数 """
+        dispatch_depth = self.settings["dispatch_depth"]
+        if "gss" != dispatch_depth:
+            return max(1, int(dispatch_depth))
+
+        # guided self-scheduling: 剩余命令组平分给所有worker，JVM会预读一批，所以再减半
+        run_state["lock"].acquire()
+        try:
+            worker_cmd_lists = dict([(id(x), x) for x in run_state["worker_cmd_lists"]])
+            remaining = sum([len(x) for x in worker_cmd_lists.values()])
+            worker_count = max(1, run_state["next_worker_idx"])
+        finally:
+            run_state["lock"].release()
+        return max(1, (remaining + 2 * worker_count - 1) // (2 * worker_count))
+
+    def trace_dispatch_batch(self, trace, idx, cmds, batch_start_time):
+        trace.add_span(
+            "batch",
+            "dispatch",
+            worker_jvm_tid(idx),
+            batch_start_time,
+            time.time(),
+            {"commands": len(cmds), "first": cmd_label(cmds[0])},
+        )
+
+    def trace_jvm_session(self, trace, idx, session, cmd_durations, args):
+        cmds = session["cmds"]
+        start_time, spawn_end_time, stdin_close_time, exit_time, end_time = session["timepoints"]
+        jvm_tid = worker_jvm_tid(idx)
+        trace.register_worker(idx)
+        trace.add_span("jvm", "jvm", jvm_tid, start_time, end_time, args)
+        trace.add_span("spawn", "jvm", jvm_tid, start_time, spawn_end_time)
+        trace.add_span("wait exit", "jvm", jvm_tid, stdin_close_time, exit_time)
+        trace.add_span("drain output", "output", jvm_tid, exit_time, end_time)
+        if not cmds:
+            return
+
+        # 知道JVM读走每批命令的时间时，第一个命令从JVM读走第一批命令开始
+        cmd_start_time = spawn_end_time
+        if session["drain_times"] and len(session["drain_times"]) == len(session["batch_sizes"]):
+            cmd_start_time = session["drain_times"][0]
+        for cmd, (duration, estimated) in zip(cmds, cmd_durations):
+            trace.add_span(
+                cmd_label(cmd),
+                "command",
+                worker_command_tid(idx),
+                cmd_start_time,
+                cmd_start_time + duration,
+                {"type": cmd["type"], "key": cmd["key"], "estimated": estimated},
+            )
+            cmd_start_time = cmd_start_time + duration
+
+    # 主线程的各个阶段，累计到 run_state["phases"] ，同时记录到时间线
+    def add_phase(self, run_state, phase, start_time, end_time, span_name=None, args=None):
+        run_state["phases"][phase] = run_state["phases"].get(phase, 0.0) + (end_time - start_time)
+        if run_state["trace"] is not None:
+            run_state["trace"].add_span(span_name or phase, phase, TRACE_TID_MAIN, start_time, end_time, args)
+
+    def add_batch_result(self, run_state, batch_result):
+        if batch_result is None:
+            return
+        if run_state["journal"] is not None and batch_result["failed"] <= 0 and not batch_result["cancelled"]:
+            if batch_result["cmds"]:
+                run_state["journal"].append(run_state["run_id"], batch_result["cmds"])
+        run_state["lock"].acquire()
+        run_state["batch_results"].append(batch_result)
+        run_state["lock"].release()
+
+    def session_limit_reached(self, run_state, batch_result):
+        """ 达到每个JVM的命令数限制时需要启动新的JVM继续执行 """
+        if batch_result is None or run_state["session_limit"] <= 0:
+            return False
+        return len(batch_result["cmds"]) >= run_state["session_limit"]
+
+    def run_jvm_sessions(self, run_state, idx, pick_func):
+        while True:
+            batch_result = self.run_jvm_session(run_state, idx, pick_func, 0)
+            self.add_batch_result(run_state, batch_result)
+            if not self.session_limit_reached(run_state, batch_result):
+                break
+
+    def worker_pick_func(self, run_state, idx):
+        pick_func = pick_from_queue(run_state["worker_cmd_lists"][idx], run_state["lock"])
+        # 按完成情况分发时，自己的队列空了以后帮其他worker执行剩下的命令
+        if self.settings["dispatch_depth"] != 0:
+            pick_func = pick_with_fallback(
+                pick_func, pick_from_queues(run_state["worker_cmd_lists"], run_state["lock"])
+            )
+        return pick_func
+
+    def worker_func(self, run_state, idx):
+        if not self.settings["dry_run"]:
+            self.run_jvm_sessions(run_state, idx, self.worker_pick_func(run_state, idx))
+            return
+
+        pick_func = pick_from_queue(run_state["worker_cmd_lists"][idx], run_state["lock"])
+        java_options = self.build_local_java_options(run_state["plan"])
+        this_thd_cmds = []
+        while True:
+            cmds = pick_func()
+            if not cmds:
+                break
+
+            for cmd in cmds:
+                # python2 must use encode string to bytes or there will be messy code
+                # python3 must not use encode methed because it will transform string to bytes
+                if sys.version_info.major < 3 and not self.settings["py2_write_buffer"]:
+                    this_thd_cmds.append(" ".join(cmd["args"]).encode(self.console_encoding))
+                else:
+                    this_thd_cmds.append(" ".join(cmd["args"]))
+
+        cprintf_stdout(
+            [print_style.FC_GREEN],
+            ('"{0}"' + os.linesep + "\t> {1}" + os.linesep).format(
+                '" "'.join(java_options), (os.linesep + "\t> ").join(this_thd_cmds)
+            ),
+        )
+
+    # agent的一个连接相当于一个worker，第一次取到命令后才在agent上启动JVM，中途连接的agent也能分担剩下的命令
+    def remote_worker_func(self, run_state, agent):
+        pick_func = pick_from_queues(run_state["worker_cmd_lists"], run_state["lock"])
+        first_cmds = pick_func()
+        if not first_cmds:
+            return
+
+        run_state["lock"].acquire()
+        idx = run_state["next_worker_idx"]
+        run_state["next_worker_idx"] = idx + 1
+        run_state["lock"].release()
+        cprintf_stdout(
+            [print_style.FC_YELLOW],
+            "[NOTICE] agent {0}({1}) runs as worker {2}{3}",
+            agent.name,
+            agent.address[0],
+            idx,
+            os.linesep,
+        )
+        if run_state["trace"] is not None:
+            run_state["trace"].register_worker(idx, "agent {0}".format(agent.name))
+
+        while True:
+            pick_first = pick_once(first_cmds)
+            batch_result = self.run_jvm_session(run_state, idx, lambda: pick_first() or pick_func(), 0, agent)
+            if batch_result is not None and agent.broken:
+                break
+            self.add_batch_result(run_state, batch_result)
+            if not self.session_limit_reached(run_state, batch_result):
+                return
+            first_cmds = pick_func()
+            if not first_cmds:
+                return
+
+        # 连接断开时不知道哪些命令已经执行完了，全部放回队列交给其他worker
+        cprintf_stderr(
+            [print_style.FC_RED],
+            "[ERROR] agent {0} disconnected, requeue {1} command(s){2}",
+            agent.name,
+            len(batch_result["cmds"]),
+            os.linesep,
+        )
+        run_state["lock"].acquire()
+        run_state["worker_cmd_lists"][0].append({"cmds": batch_result["cmds"]})
+        run_state["lock"].release()
+
+    def drain_worker_func(self, run_state, idx):
+        pick_func = pick_from_queues(run_state["worker_cmd_lists"], run_state["lock"])
+        self.run_jvm_sessions(run_state, idx, pick_func)
+
+    # 失败的批次拆小后在新的JVM里重试，既可以重试偶发的失败，也可以定位到具体失败的命令
+    def pop_retry_chunk(self, run_state, retry_chunks):
+        run_state["lock"].acquire()
+        try:
+            if not retry_chunks:
+                return None
+            return retry_chunks.pop()
+        finally:
+            run_state["lock"].release()
+
+    def retry_worker_func(self, run_state, idx, retry_chunks, retry_round):
+        while True:
+            chunk = self.pop_retry_chunk(run_state, retry_chunks)
+            if chunk is None:
+                break
+            self.add_batch_result(run_state, self.run_jvm_session(run_state, idx, pick_once(chunk), retry_round))
+
+    def install_signal_handlers(self, run_state):
+        """ 返回原来的信号处理函数，不在主线程里执行时不处理信号 """
+
+        def handle_signal(signum, frame):
+            run_state["interrupted"] = True
+            signal_name = signum
+            for name, value in CANCEL_SIGNALS:
+                if value == signum:
+                    signal_name = name
+            self.cancel_run(run_state, "interrupted by {0}".format(signal_name), run_state["cancelled"] is not None)
+
+        old_handlers = {}
+        for _, signum in CANCEL_SIGNALS:
+            try:
+                old_handlers[signum] = signal.signal(signum, handle_signal)
+            except ValueError:
+                break
+        return old_handlers
+
+    def restore_signal_handlers(self, old_handlers):
+        for signum in old_handlers:
+            signal.signal(signum, old_handlers[signum] or signal.SIG_DFL)
+
+    def run_workers(self, target, count, args):
+        all_worker_thread = []
+        for i in range(0, count):
+            this_worker_thd = threading.Thread(target=target, args=[args[0], i] + list(args[1:]))
+            this_worker_thd.start()
+            all_worker_thread.append(this_worker_thd)
+
+        # 等待退出，python2下不带超时的join不会被信号打断
+        for thd in all_worker_thread:
+            while thd.is_alive():
+                thd.join(1.0)
+
+    # ----------------------------------------- 实际开始转换 -----------------------------------------
+    def run(
+        self, plan, cmd_list, incremental_cache=None, history_store=None, failed_list=None, trace=None, journal=None
+    ):
+        """ 执行转换命令，返回 {"run", "commands", "skipped", "failed", "cancelled", "interrupted", "unfinished",
+                "batches", "phases", "wall_time", "peak_rss"}
+            incremental_cache 和 history_store 可以在多次执行之间复用，trace 是 TraceRecorder ，由调用者保存
+            journal 是 CheckpointJournal ，跳过上次中断前已经完成的命令，整次转换都成功后删除
+            cancelled 是取消的原因(fail_fast 或收到 SIGINT/SIGTERM)，unfinished 是取消后没有执行完的命令数
+        """
+        dry_run = self.settings["dry_run"]
+        run_start_time = time.time()
+        input_cmd_count = len(cmd_list)
+        if incremental_cache is not None:
+            cmd_list = self.filter_unchanged_cmds(plan, cmd_list, incremental_cache)
+        if dry_run:
+            journal = None
+        if journal is not None:
+            cmd_list = self.filter_completed_cmds(plan, cmd_list, journal, incremental_cache)
+            journal.open()
+        self.resolve_parallelism(plan, cmd_list, history_store)
+        self.resolve_memory(plan)
+        self.resolve_cpu_pinning()
+        self.resolve_engine()
+        engine = self.engine
+
+        run_state = {
+            "plan": plan,
+            "history_store": history_store,
+            "run_id": make_run_id(),
+            "lock": threading.Lock(),
+            "worker_cmd_lists": self.build_worker_cmd_lists(plan, cmd_list, history_store),
+            "batch_results": [],
+            "trace": trace,
+            "phases": {},
+            # agent的worker编号排在本地worker后面
+            "next_worker_idx": self.parallelism,
+            # 取消的原因，收到信号时 interrupted 为True
+            "cancelled": None,
+            "interrupted": False,
+            "processes": [],
+            "journal": journal,
+            # 每个JVM最多执行的命令数，0表示不限制
+            "session_limit": 0,
+        }
+        if journal is not None:
+            run_state["session_limit"] = self.settings["checkpoint_interval"]
+        run_cmd_count = len(cmd_list)
+        dispatch_start_time = time.time()
+        self.add_phase(run_state, "schedule", run_start_time, dispatch_start_time)
+
+        agent_server = self.settings["agent_server"]
+        if dry_run:
+            agent_server = None
+        old_signal_handlers = {}
+        if not dry_run:
+            old_signal_handlers = self.install_signal_handlers(run_state)
+        try:
+            if agent_server is not None:
+                agent_server.begin(lambda agent: self.remote_worker_func(run_state, agent))
+            # agent的会话始终在各自的线程里执行，engine 只负责本地JVM
+            engine.run_workers(engine.worker_func, self.parallelism, [run_state])
+            if agent_server is not None:
+                agent_server.end()
+                # 本地worker结束后断开的agent放回队列的命令
+                requeued_count = len(run_state["worker_cmd_lists"][0])
+                if requeued_count > 0 and run_state["cancelled"] is None:
+                    engine.run_workers(engine.drain_worker_func, min(self.parallelism, requeued_count), [run_state])
+            self.add_phase(
+                run_state,
+                "dispatch",
+                dispatch_start_time,
+                time.time(),
+                args={"commands": run_cmd_count, "parallelism": self.parallelism},
+            )
+
+            retry_rounds = self.settings["retry"]
+            if self.settings["fail_fast"]:
+                retry_rounds = 0
+            # 重试之后还有不能确定是哪个命令失败的批次时，输出失败列表前再把这些批次按每个命令一个JVM执行一轮
+            # xresloader只报告失败数量，所以同一批里已经成功的命令也会重新执行
+            locate_round = retry_rounds + 1
+            if not failed_list or dry_run or self.settings["fail_fast"]:
+                locate_round = retry_rounds
+            for retry_round in range(1, locate_round + 1):
+                locating = retry_round > retry_rounds
+                retry_batches = failed_batches(run_state["batch_results"])
+                if locating:
+                    retry_batches = [x for x in retry_batches if not is_batch_attributed(x)]
+                if not retry_batches or run_state["cancelled"] is not None:
+                    break
+
+                retry_chunks = []
+                for batch in retry_batches:
+                    if locating:
+                        retry_chunks.extend(split_failed_batch(batch["cmds"], len(batch["cmds"])))
+                    else:
+                        retry_chunks.extend(split_failed_batch(batch["cmds"], max(4, 2 * self.parallelism)))
+                retry_chunks.reverse()
+                retry_batch_ids = set([id(x) for x in retry_batches])
+                run_state["batch_results"] = [x for x in run_state["batch_results"] if id(x) not in retry_batch_ids]
+
+                if locating:
+                    retry_label = "locate failed commands"
+                    retry_notice = "[NOTICE] {0}: rerun {1} command(s) of {2} batch(es) one per JVM{4}"
+                else:
+                    retry_label = "retry round {0}".format(retry_round)
+                    retry_notice = "[NOTICE] {0}: rerun {1} command(s) of {2} failed batch(es) in {3} JVM(s){4}"
+                cprintf_stdout(
+                    [print_style.FC_YELLOW],
+                    retry_notice,
+                    retry_label,
+                    sum([len(x["cmds"]) for x in retry_batches]),
+                    len(retry_batches),
+                    len(retry_chunks),
+                    os.linesep,
+                )
+                retry_chunk_count = len(retry_chunks)
+                retry_start_time = time.time()
+                engine.run_workers(
+                    engine.retry_worker_func,
+                    min(self.parallelism, len(retry_chunks)),
+                    [run_state, retry_chunks, retry_round],
+                )
+                self.add_phase(
+                    run_state,
+                    "retry",
+                    retry_start_time,
+                    time.time(),
+                    retry_label,
+                    {"chunks": retry_chunk_count},
+                )
+        finally:
+            self.restore_signal_handlers(old_signal_handlers)
+
+        finish_start_time = time.time()
+        batch_results = run_state["batch_results"]
+        exit_code = failed_job_count(batch_results)
+        # 取消时被结束的JVM里结果未知的命令和还没有分发的命令，没有取消或者只是测试运行时都不算
+        unfinished_count = 0
+        if run_state["cancelled"] is not None and not dry_run:
+            unfinished_count = run_cmd_count
+            for batch in batch_results:
+                if batch["cancelled"]:
+                    unfinished_count = unfinished_count - batch["failed"]
+                else:
+                    unfinished_count = unfinished_count - len(batch["cmds"])
+        for batch in failed_batches(batch_results):
+            if is_batch_attributed(batch):
+                for cmd in batch["cmds"]:
+                    cprintf_stderr([print_style.FC_RED], "[ERROR] failed: {0}{1}", " ".join(cmd["args"]), os.linesep)
+            else:
+                cprintf_stderr(
+                    [print_style.FC_RED],
+                    "[ERROR] {0} of {1} command(s) in one JVM failed, use --retry or --failed-list to locate them{2}",
+                    batch["failed"],
+                    len(batch["cmds"]),
+                    os.linesep,
+                )
+
+        if failed_list and not dry_run:
+            write_failure_list(failed_list, run_state["run_id"], run_cmd_count, batch_results)
+
+        if incremental_cache is not None and not dry_run:
+            for batch in batch_results:
+                for cmd in batch["cmds"]:
+                    if batch["failed"] <= 0 and not batch["cancelled"]:
+                        incremental_cache.mark_done(cmd["key"], cmd["fingerprint"])
+                    else:
+                        incremental_cache.mark_failed(cmd["key"])
+            incremental_cache.save()
+
+        if journal is not None:
+            journal.close(run_state["cancelled"] is None and exit_code == 0)
+
+        wall_time = time.time() - run_start_time
+        if history_store is not None and not dry_run:
+            run_record = {
+                "run": run_state["run_id"],
+                "time": time.time(),
+                "kind": HISTORY_KIND_RUN,
+                "commands": run_cmd_count,
+                "failed": exit_code,
+                "parallelism": self.parallelism,
+                "wall_time": wall_time,
+            }
+            if run_state["cancelled"] is not None:
+                run_record["cancelled"] = run_state["cancelled"]
+            history_store.append([run_record])
+
+        self.add_phase(run_state, "finish", finish_start_time, time.time(), args={"failed": exit_code})
+
+        if run_state["cancelled"] is None:
+            cprintf_stdout(
+                [print_style.FC_MAGENTA],
+                "[INFO] all jobs done. {0} job(s) failed.{1}".format(exit_code, os.linesep),
+            )
+        else:
+            cprintf_stdout(
+                [print_style.FC_MAGENTA],
+                "[INFO] cancelled({0}). {1} job(s) done, {2} job(s) failed, {3} job(s) cancelled or not started.{4}",
+                run_state["cancelled"],
+                run_cmd_count - unfinished_count - exit_code,
+                exit_code,
+                unfinished_count,
+                os.linesep,
+            )
+        # 常驻服务里的JVM不是本进程的子进程，统计不到
+        peak_rss = None
+        if not dry_run and not self.settings["daemon_socket"]:
+            peak_rss = children_peak_rss_bytes()
+        return {
+            "run": run_state["run_id"],
+            "commands": run_cmd_count,
+            "skipped": input_cmd_count - run_cmd_count,
+            "failed": exit_code,
+            "cancelled": run_state["cancelled"],
+            "interrupted": run_state["interrupted"],
+            "unfinished": unfinished_count,
+            "batches": batch_results,
+            "phases": run_state["phases"],
+            "wall_time": wall_time,
+            "peak_rss": peak_rss,
+        }
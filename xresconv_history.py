@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import threading
+from argparse import ArgumentParser
+
+# ==================================================================================
+# 转换记录: 每行一条json记录的追加写入文件，默认放在转换列表文件旁边
+# 命令记录: {"run", "time", "key", "name", "type", "duration", "estimated", "exit_code", "output_bytes", "worker", "jvm"}
+# estimated 为True时 duration 是按预估耗时的比例从一批命令的耗时里分摊的，没有这个字段的旧记录也都是估算值
+# 运行记录: {"run", "time", "kind": "run", "commands", "failed", "parallelism", "wall_time"}
+
+HISTORY_KIND_COMMAND = "command"
+HISTORY_KIND_RUN = "run"
+
+
+def is_estimated(record):
+    return record.get("estimated", True)
+
+
+def make_run_id():
+    return "{0}-{1}".format(time.strftime("%Y%m%d%H%M%S"), os.getpid())
+
+
+class HistoryStore:
+    """ read_only 时只读取已有的记录，新记录只保存在内存里，不写入文件 """
+
+    def __init__(self, file_path, read_only=False):
+        self.file_path = file_path
+        self.read_only = read_only
+        self.records = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.records = []
+        if not os.path.exists(self.file_path):
+            return False
+        try:
+            with open(self.file_path, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        # 进程被强杀时最后一行可能不完整
+                        continue
+                    if isinstance(record, dict):
+                        self.records.append(record)
+        except EnvironmentError:
+            return False
+        return True
+
+    def append(self, records):
+        if not records:
+            return
+        content = "".join([json.dumps(record, sort_keys=True) + "\n" for record in records])
+        self.lock.acquire()
+        try:
+            if not self.read_only:
+                with open(self.file_path, "ab") as f:
+                    f.write(content.encode("utf-8"))
+            self.records.extend(records)
+        finally:
+            self.lock.release()
+
+    def command_records(self):
+        return [x for x in self.records if x.get("kind", HISTORY_KIND_COMMAND) == HISTORY_KIND_COMMAND and "key" in x]
+
+    def run_records(self):
+        return [x for x in self.records if x.get("kind") == HISTORY_KIND_RUN]
+
+    def last_durations(self):
+        """ 每个命令最近一次准确的耗时，分摊出来的估算值本身就是按预估耗时算的，不能再拿来预估耗时 """
+        ret = {}
+        for record in self.command_records():
+            if "duration" in record and not is_estimated(record):
+                ret[record["key"]] = record["duration"]
+        return ret
+
+
+# ========================================= 统计报告 =========================================
+def format_duration(record, width=10):
+    # 估算的耗时前面加 ~
+    value = "{0}{1:.3f}s".format("~" if is_estimated(record) else "", record.get("duration", 0.0))
+    return "{0:>{1}}".format(value, width + 1)
+
+
+def write_estimated_legend(out):
+    out.write("  (~: estimated, split from the duration of a batch of commands){0}".format(os.linesep))
+
+
+def command_label(record):
+    label = record.get("name") or record.get("key", "")[0:12]
+    if record.get("type"):
+        label = "{0} ({1})".format(label, record["type"])
+    return label
+
+
+def group_commands_by_run(store):
+    runs = []
+    run_index = {}
+    for record in store.command_records():
+        run_id = record.get("run", "")
+        if run_id not in run_index:
+            run_index[run_id] = len(runs)
+            runs.append({"run": run_id, "commands": {}})
+        runs[run_index[run_id]]["commands"][record["key"]] = record
+    return runs
+
+
+def report_slowest(store, top_n, out):
+    runs = group_commands_by_run(store)
+    out.write("Slowest commands(last run: {0}){1}".format(runs[-1]["run"] if runs else "-", os.linesep))
+    if not runs:
+        return
+    records = sorted(runs[-1]["commands"].values(), key=lambda x: x.get("duration", 0.0), reverse=True)
+    for record in records[0:top_n]:
+        out.write(
+            "  {0}  exit={1:<3} out={2:<9} {3}{4}".format(
+                format_duration(record),
+                record.get("exit_code", "-"),
+                record.get("output_bytes", "-"),
+                command_label(record),
+                os.linesep,
+            )
+        )
+    if [x for x in records[0:top_n] if is_estimated(x)]:
+        write_estimated_legend(out)
+
+
+def report_regressions(store, top_n, ratio, min_delta, out):
+    """ 对比每个命令最近一次和上一次的耗时 """
+    last_record = {}
+    prev_record = {}
+    for run in group_commands_by_run(store):
+        for key in run["commands"]:
+            if key in last_record:
+                prev_record[key] = last_record[key]
+            last_record[key] = run["commands"][key]
+
+    regressions = []
+    for key in prev_record:
+        prev_duration = prev_record[key].get("duration", 0.0)
+        last_duration = last_record[key].get("duration", 0.0)
+        if last_duration - prev_duration < min_delta:
+            continue
+        if prev_duration > 0 and last_duration / prev_duration < ratio:
+            continue
+        regressions.append((last_duration - prev_duration, prev_record[key], last_record[key]))
+
+    regressions.sort(key=lambda x: x[0], reverse=True)
+    out.write("Regressions(slower than {0:.2f}x and +{1:.3f}s){2}".format(ratio, min_delta, os.linesep))
+    for delta, prev, record in regressions[0:top_n]:
+        out.write(
+            "  {0} -> {1}  (+{2:.3f}s)  {3}{4}".format(
+                format_duration(prev), format_duration(record), delta, command_label(record), os.linesep
+            )
+        )
+    if [x for x in regressions[0:top_n] if is_estimated(x[1]) or is_estimated(x[2])]:
+        write_estimated_legend(out)
+
+
+def report_throughput(store, top_n, out):
+    out.write("Throughput trend{0}".format(os.linesep))
+    for record in store.run_records()[-top_n:]:
+        wall_time = record.get("wall_time", 0.0)
+        commands = record.get("commands", 0)
+        if wall_time > 0:
+            throughput = commands / wall_time
+        else:
+            throughput = 0.0
+        out.write(
+            "  {0}  commands={1:<6} failed={2:<4} parallelism={3:<3} wall={4:>9.3f}s  {5:.2f} cmd/s{6}".format(
+                record.get("run", "-"),
+                commands,
+                record.get("failed", 0),
+                record.get("parallelism", "-"),
+                wall_time,
+                throughput,
+                os.linesep,
+            )
+        )
+
+
+def main():
+    parser = ArgumentParser(usage="%(prog)s <command> [options...]")
+    sub_parsers = parser.add_subparsers(dest="command")
+    report_parser = sub_parsers.add_parser("report", help="show slowest commands, regressions and throughput trend")
+    report_parser.add_argument(
+        "history_file",
+        help="history file(<convert list file>.history.jsonl)",
+        metavar="<history file>",
+    )
+    report_parser.add_argument(
+        "-n",
+        "--top",
+        action="store",
+        help="show top <number> records(default: 20)",
+        metavar="<number>",
+        dest="top",
+        type=int,
+        default=20,
+    )
+    report_parser.add_argument(
+        "--ratio",
+        action="store",
+        help="regression ratio threshold(default: 1.5)",
+        metavar="<ratio>",
+        dest="ratio",
+        type=float,
+        default=1.5,
+    )
+    report_parser.add_argument(
+        "--min-delta",
+        action="store",
+        help="ignore regressions less than <seconds>(default: 0.1)",
+        metavar="<seconds>",
+        dest="min_delta",
+        type=float,
+        default=0.1,
+    )
+    options = parser.parse_args()
+    if options.command != "report":
+        parser.print_help()
+        return -1
+
+    store = HistoryStore(options.history_file)
+    if not store.load():
+        sys.stderr.write("[ERROR] can not load history file {0}{1}".format(options.history_file, os.linesep))
+        return -2
+
+    report_slowest(store, options.top, sys.stdout)
+    sys.stdout.write(os.linesep)
+    report_regressions(store, options.top, options.ratio, options.min_delta, sys.stdout)
+    sys.stdout.write(os.linesep)
+    report_throughput(store, options.top, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
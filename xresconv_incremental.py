@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import time
+import threading
+
+# ==================================================================================
+# 增量转表: 记录每条转换命令的输入指纹，输入未变化的命令在下次执行时跳过
+# 文件检查参考 git index 的做法: 先比较 mtime+size，只有不一致时才重新计算内容hash
+
+INCREMENTAL_CACHE_VERSION = 1
+INCREMENTAL_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file_content(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(INCREMENTAL_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def hash_text_list(values):
+    sha1 = hashlib.sha1()
+    for value in values:
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+        sha1.update(value)
+        sha1.update(b"\0")
+    return sha1.hexdigest()
+
+
+def replace_file(src_path, dst_path):
+    if hasattr(os, "replace"):
+        os.replace(src_path, dst_path)
+    else:
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
+
+def atomic_write_text(file_path, content):
+    tmp_path = "{0}.{1}.tmp".format(file_path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(content.encode("utf-8"))
+    replace_file(tmp_path, file_path)
+
+
+class IncrementalCache:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.files = {}
+        self.commands = {}
+        self.last_write_time = 0
+        self.dirty = False
+        self.checked_files = {}
+
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return False
+        try:
+            with open(self.file_path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (ValueError, EnvironmentError):
+            return False
+
+        if not isinstance(data, dict) or data.get("version") != INCREMENTAL_CACHE_VERSION:
+            return False
+        self.files = data.get("files", {})
+        self.commands = data.get("commands", {})
+        self.last_write_time = data.get("timestamp", 0)
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": INCREMENTAL_CACHE_VERSION,
+            "timestamp": time.time(),
+            "files": self.files,
+            "commands": self.commands,
+        }
+        atomic_write_text(self.file_path, json.dumps(data, indent=1, sort_keys=True))
+        self.dirty = False
+
+    def reset_checked_files(self):
+        self.checked_files = {}
+
+    def file_hash(self, file_path):
+        abs_path = os.path.abspath(file_path)
+        if abs_path in self.checked_files:
+            return self.checked_files[abs_path]
+
+        content_hash = self._stat_or_hash(abs_path)
+        self.checked_files[abs_path] = content_hash
+        return content_hash
+
+    def _stat_or_hash(self, abs_path):
+        try:
+            st = os.stat(abs_path)
+        except EnvironmentError:
+            return "missing"
+
+        cached = self.files.get(abs_path)
+        # 和git的racy检查一样，写缓存时刚修改过的文件不能只信任mtime
+        if (
+            cached
+            and cached.get("mtime") == st.st_mtime
+            and cached.get("size") == st.st_size
+            and st.st_mtime < self.last_write_time
+        ):
+            return cached["hash"]
+
+        try:
+            content_hash = hash_file_content(abs_path)
+        except EnvironmentError:
+            return "missing"
+        self.files[abs_path] = {
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "hash": content_hash,
+        }
+        self.dirty = True
+        return content_hash
+
+    def fingerprint(self, cmd_args, input_files, extra_values, base_dir="."):
+        """ input_files 是相对于 base_dir 的路径，指纹里记录的是相对路径 """
+        values = list(extra_values)
+        values.append(" ".join(cmd_args))
+        for input_file in sorted(set(input_files)):
+            values.append(input_file)
+            values.append(self.file_hash(os.path.join(base_dir, input_file)))
+        return hash_text_list(values)
+
+    def is_unchanged(self, cmd_key, fingerprint):
+        return self.commands.get(cmd_key) == fingerprint
+
+    def mark_done(self, cmd_key, fingerprint):
+        if self.commands.get(cmd_key) != fingerprint:
+            self.commands[cmd_key] = fingerprint
+            self.dirty = True
+
+    def mark_failed(self, cmd_key):
+        if cmd_key in self.commands:
+            del self.commands[cmd_key]
+            self.dirty = True
+
+
+# ==================================================================================
+# 断点续转: 每个JVM成功执行完后立刻把其中命令的key和指纹追加到日志文件里
+# 转换被中断(CI超时、agent被抢占、Ctrl+C)后使用 --resume 重新执行时，跳过日志里指纹没有变化的命令
+# 整次转换都成功后删除日志，下一次从头开始
+class CheckpointJournal:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def load(self):
+        """ 返回 {命令key: 指纹}，进程被杀时最后一行可能不完整，跳过无法解析的行 """
+        ret = {}
+        if not os.path.exists(self.file_path):
+            return ret
+        try:
+            with open(self.file_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        continue
+                    if isinstance(record, dict) and "key" in record and "fingerprint" in record:
+                        ret[record["key"]] = record["fingerprint"]
+        except EnvironmentError:
+            pass
+        return ret
+
+    def open(self):
+        self.fd = open(self.file_path, "ab")
+
+    def append(self, run_id, cmds):
+        lines = []
+        append_time = time.time()
+        for cmd in cmds:
+            record = {"run": run_id, "time": append_time, "key": cmd["key"], "fingerprint": cmd["fingerprint"]}
+            lines.append(json.dumps(record, sort_keys=True) + "\n")
+        self.lock.acquire()
+        try:
+            # 进程随时可能被杀掉，每次都写到磁盘上
+            self.fd.write("".join(lines).encode("utf-8"))
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+        finally:
+            self.lock.release()
+
+    def close(self, complete):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+        if complete and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+
+def command_key(cmd_args):
+    return hash_text_list(cmd_args)
+
+
+def item_input_names(conv_item):
+    """ 转换项依赖的数据源文件名(file属性和scheme里的 文件名|表名|... 配置) """
+    candidates = []
+    if conv_item["file"]:
+        candidates.append(conv_item["file"])
+    for key in conv_item["scheme_data"]:
+        for opt_val in conv_item["scheme_data"][key]:
+            if not opt_val:
+                continue
+            file_name = opt_val.split("|")[0].strip()
+            if file_name:
+                candidates.append(file_name)
+    return candidates
+
+
+def item_input_candidates(conv_item, data_source_dirs):
+    """ 数据源文件所有可能的路径，不管文件是否存在 """
+    ret = []
+    for file_name in item_input_names(conv_item):
+        if os.path.isabs(file_name):
+            ret.append(file_name)
+            continue
+        ret.append(file_name)
+        for search_dir in data_source_dirs:
+            ret.append(os.path.join(search_dir, file_name))
+    return ret
+
+
+def resolve_item_input_files(conv_item, data_source_dirs, base_dir="."):
+    """ 找出转换项依赖的并且存在的数据源文件，返回的是相对于 base_dir 的路径 """
+    search_dirs = ["."]
+    search_dirs.extend(data_source_dirs)
+
+    ret = []
+    for file_name in item_input_names(conv_item):
+        if os.path.isabs(file_name):
+            if os.path.isfile(file_name):
+                ret.append(file_name)
+            continue
+        for search_dir in search_dirs:
+            file_path = os.path.join(search_dir, file_name)
+            if os.path.isfile(os.path.join(base_dir, file_path)):
+                ret.append(file_path)
+                break
+    return ret
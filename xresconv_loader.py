@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import xml.etree.ElementTree as ET
+
+# ==================================================================================
+# 转换列表加载: 先解析include图里的所有文件，再按深度优先的后序(和原来递归加载的顺序一致)合并
+# 每个文件只加载一次，循环include会被报告并忽略
+# 使用iterparse边解析边把已经处理过的节点从树上摘掉，只保留 global 和 list/item 节点
+# 解析时一直持有GIL，多线程解析不会更快(5万个转换项、65个文件时8个线程和1个线程耗时相同)，所以按顺序解析
+
+
+def normalize_list_path(file_path):
+    return os.path.normcase(os.path.normpath(os.path.abspath(file_path)))
+
+
+def resolve_include_path(dir_prefix, include_file_path):
+    if include_file_path[0] != "/" and include_file_path[1] != ":":
+        include_file_path = os.path.join(dir_prefix, include_file_path)
+    return normalize_list_path(include_file_path)
+
+
+def parse_list_file(file_path):
+    """ 解析一个转换列表文件，返回 {"path", "includes", "globals", "items"} """
+    ret = {"path": file_path, "includes": [], "globals": [], "items": []}
+    dir_prefix = os.path.dirname(file_path)
+    node_path = []
+    for event, node in ET.iterparse(file_path, events=("start", "end")):
+        if "start" == event:
+            node_path.append(node)
+            continue
+
+        node_path.pop()
+        depth = len(node_path)
+        if depth == 2 and "item" == node.tag and "list" == node_path[1].tag:
+            ret["items"].append(node)
+            node_path[1].remove(node)
+        elif depth == 1:
+            if "include" == node.tag:
+                include_file_path = node.text
+                if include_file_path and len(include_file_path) > 1:
+                    ret["includes"].append(resolve_include_path(dir_prefix, include_file_path))
+            elif "global" == node.tag:
+                ret["globals"].append(node)
+            node_path[0].remove(node)
+    return ret
+
+
+def load_include_graph(file_path):
+    """ 返回 (文件列表, global节点列表, item节点列表, 循环include列表)
+        节点列表的元素是 {"file_path", "node"}，解析失败时抛出 ET.ParseError 或 EnvironmentError
+    """
+    root_path = normalize_list_path(file_path)
+    parsed_files = {}
+    pending_files = [root_path]
+    while pending_files:
+        result = parse_list_file(pending_files.pop(0))
+        parsed_files[result["path"]] = result
+        for include_path in result["includes"]:
+            if include_path not in parsed_files and include_path not in pending_files:
+                pending_files.append(include_path)
+
+    ordered_files = []
+    cycles = []
+    visited_files = set()
+    visiting_stack = []
+
+    def visit(visit_path):
+        if visit_path in visiting_stack:
+            cycles.append(visiting_stack[visiting_stack.index(visit_path):] + [visit_path])
+            return
+        if visit_path in visited_files:
+            return
+        visiting_stack.append(visit_path)
+        for include_path in parsed_files[visit_path]["includes"]:
+            visit(include_path)
+        visiting_stack.pop()
+        visited_files.add(visit_path)
+        ordered_files.append(visit_path)
+
+    visit(root_path)
+
+    global_nodes = []
+    item_nodes = []
+    for visit_path in ordered_files:
+        for node in parsed_files[visit_path]["globals"]:
+            global_nodes.append({"file_path": visit_path, "node": node})
+        for node in parsed_files[visit_path]["items"]:
+            item_nodes.append({"file_path": visit_path, "node": node})
+    return ordered_files, global_nodes, item_nodes, cycles
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from xresconv_incremental import atomic_write_text
+
+# ==================================================================================
+# 转换指标: 每次转换结束后把 ConvertExecutor.run 的结果写成 Prometheus/OpenMetrics 文本格式
+# 配合 node-exporter 的 textfile collector 使用，文件是原子替换的，每次只包含最后一次转换的数据
+
+METRICS_PREFIX = "xresconv_"
+
+
+def format_metric_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return "{0:.6f}".format(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    ret = []
+    for key in sorted(labels.keys()):
+        label_value = str(labels[key]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        ret.append('{0}="{1}"'.format(key, label_value))
+    return "{" + ",".join(ret) + "}"
+
+
+class MetricsBuilder:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, help_text, samples, unit=None):
+        """ samples 是 [(labels, value), ...]，value 为None的样本会被跳过 """
+        samples = [x for x in samples if x[1] is not None]
+        if not samples:
+            return
+        full_name = METRICS_PREFIX + name
+        self.lines.append("# HELP {0} {1}".format(full_name, help_text))
+        self.lines.append("# TYPE {0} gauge".format(full_name))
+        if unit:
+            self.lines.append("# UNIT {0} {1}".format(full_name, unit))
+        for labels, value in samples:
+            self.lines.append("{0}{1} {2}".format(full_name, format_labels(labels), format_metric_value(value)))
+
+    def text(self):
+        return "\n".join(self.lines + ["# EOF"]) + "\n"
+
+
+def build_run_metrics(run_result, parallelism, wall_time, extra_phases=None, end_time=None):
+    """ wall_time 是整个转换的耗时(包括加载转换列表等 extra_phases 里的阶段)
+        extra_phases 是 {阶段名: 秒}，和执行器记录的阶段合并输出
+    """
+    if end_time is None:
+        end_time = time.time()
+    phases = dict(run_result["phases"])
+    if extra_phases:
+        phases.update(extra_phases)
+
+    # worker的忙碌时间是它启动的所有JVM的存活时间之和，利用率相对于分发和重试阶段的总耗时
+    dispatch_time = phases.get("dispatch", 0.0) + phases.get("retry", 0.0)
+    worker_busy = {}
+    stdout_bytes = 0
+    stderr_bytes = 0
+    for batch in run_result["batches"]:
+        if "worker" in batch:
+            worker_busy[batch["worker"]] = worker_busy.get(batch["worker"], 0.0) + batch["duration"]
+        stdout_bytes = stdout_bytes + batch.get("stdout_bytes", 0)
+        stderr_bytes = stderr_bytes + batch.get("stderr_bytes", 0)
+
+    dispatched = run_result["commands"]
+    builder = MetricsBuilder()
+    builder.add(
+        "run_timestamp_seconds", "Unix time when the last conversion run finished.", [({}, end_time)], "seconds"
+    )
+    builder.add("run_wall_time_seconds", "Wall time of the last conversion run.", [({}, wall_time)], "seconds")
+    builder.add(
+        "phase_duration_seconds",
+        "Time spent in each phase of the last conversion run.",
+        [({"phase": x}, phases[x]) for x in sorted(phases.keys())],
+        "seconds",
+    )
+    builder.add("parallelism", "Number of JVMs run concurrently.", [({}, parallelism)])
+    builder.add("jobs_dispatched", "Convert commands dispatched to xresloader.", [({}, dispatched)])
+    unfinished = run_result.get("unfinished", 0)
+    succeeded = dispatched - run_result["failed"] - unfinished
+    builder.add("jobs_succeeded", "Convert commands that succeeded.", [({}, succeeded)])
+    builder.add("jobs_failed", "Convert commands that failed.", [({}, run_result["failed"])])
+    builder.add("jobs_cancelled", "Convert commands cancelled by fail fast or a signal.", [({}, unfinished)])
+    builder.add("jobs_skipped", "Convert commands skipped by incremental mode.", [({}, run_result.get("skipped", 0))])
+    throughput = None
+    if wall_time > 0:
+        throughput = dispatched / wall_time
+    builder.add("jobs_per_second", "Convert commands dispatched per second of wall time.", [({}, throughput)])
+    builder.add("jvms_started", "JVMs started, including retries.", [({}, len(run_result["batches"]))])
+    builder.add(
+        "worker_busy_seconds",
+        "Time each worker had a running JVM.",
+        [({"worker": x}, worker_busy[x]) for x in sorted(worker_busy.keys())],
+        "seconds",
+    )
+    if dispatch_time > 0:
+        builder.add(
+            "worker_utilisation_ratio",
+            "Busy time of each worker divided by the dispatch time.",
+            [({"worker": x}, min(1.0, worker_busy[x] / dispatch_time)) for x in sorted(worker_busy.keys())],
+            "ratio",
+        )
+    builder.add(
+        "output_bytes",
+        "Bytes forwarded from JVM output.",
+        [({"stream": "stdout"}, stdout_bytes), ({"stream": "stderr"}, stderr_bytes)],
+        "bytes",
+    )
+    builder.add(
+        "jvm_peak_rss_bytes",
+        "Peak resident memory of JVM child processes.",
+        [({}, run_result.get("peak_rss"))],
+        "bytes",
+    )
+    return builder.text()
+
+
+def write_run_metrics(file_path, run_result, parallelism, wall_time, extra_phases=None):
+    atomic_write_text(file_path, build_run_metrics(run_result, parallelism, wall_time, extra_phases))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+
+from xresconv_incremental import hash_file_content, replace_file, atomic_write_text
+
+# ==================================================================================
+# 输出暂存: xresloader 每次都会重写输出目录里的所有文件，下游按mtime热更新时会把所有配置都重新加载一遍
+# 暂存模式下 xresloader 输出到和输出目录同级的暂存目录，转换结束后按内容hash和输出目录里的文件比较
+# 只有内容变化的文件才会被 rename 替换进输出目录(同一个文件系统里是原子的)，没有变化的文件保持原来的mtime
+# 同时写入一份清单，记录输出目录里所有文件的hash和本次变化的文件列表，只有内容有变化时才会重写清单
+
+OUTPUT_STAGING_SUFFIX = ".xresconv-staging"
+OUTPUT_MANIFEST_NAME = ".xresconv-manifest.json"
+OUTPUT_MANIFEST_VERSION = 1
+
+
+def list_files(dir_path):
+    """ 目录下所有文件的相对路径，统一使用 / 分隔 """
+    ret = []
+    for root, dirs, files in os.walk(dir_path):
+        dirs.sort()
+        for file_name in sorted(files):
+            rel_path = os.path.relpath(os.path.join(root, file_name), dir_path)
+            ret.append(rel_path.replace(os.sep, "/"))
+    return ret
+
+
+class OutputStage:
+    def __init__(self, base_dir, output_dir, manifest_file=None):
+        """ output_dir 是转换列表里配置的输出目录(相对于 base_dir 或绝对路径) """
+        self.output_path = os.path.normpath(os.path.join(base_dir, output_dir))
+        self.staging_path = self.output_path + OUTPUT_STAGING_SUFFIX
+        # 输出目录是相对路径时暂存目录也用相对路径，分布式转换时agent可以用自己的 --base-dir
+        if os.path.isabs(output_dir):
+            self.staging_arg = self.staging_path
+        else:
+            self.staging_arg = os.path.relpath(self.staging_path, base_dir)
+        if manifest_file:
+            self.manifest_file = manifest_file
+        else:
+            self.manifest_file = os.path.join(self.output_path, OUTPUT_MANIFEST_NAME)
+        self.manifest_files = None
+
+    def load_manifest(self):
+        self.manifest_files = {}
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (EnvironmentError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != OUTPUT_MANIFEST_VERSION:
+            return
+        self.manifest_files = data.get("files", {})
+
+    def prepare(self):
+        """ 每次转换前清空暂存目录，上次中断留下的文件不会被同步 """
+        if os.path.exists(self.staging_path):
+            shutil.rmtree(self.staging_path)
+        os.makedirs(self.staging_path)
+
+    def discard(self):
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def existing_hash(self, rel_path, dst_path, size):
+        """ 输出目录里已有文件的hash，大小不同时直接认为有变化，mtime和大小都和清单一致时使用清单里的hash """
+        if not os.path.exists(dst_path):
+            return None
+        dst_stat = os.stat(dst_path)
+        if dst_stat.st_size != size:
+            return None
+        record = self.manifest_files.get(rel_path)
+        if record and record.get("size") == dst_stat.st_size and record.get("mtime") == dst_stat.st_mtime:
+            return record.get("sha1")
+        return hash_file_content(dst_path)
+
+    def commit(self, failed=0):
+        """ 把暂存目录里变化的文件同步到输出目录，返回 {"changed": [相对路径...], "unchanged": 数量} """
+        if self.manifest_files is None:
+            self.load_manifest()
+        old_files = dict(self.manifest_files)
+        changed = []
+        unchanged = 0
+        for rel_path in list_files(self.staging_path):
+            src_path = os.path.join(self.staging_path, rel_path)
+            dst_path = os.path.join(self.output_path, rel_path)
+            src_hash = hash_file_content(src_path)
+            if self.existing_hash(rel_path, dst_path, os.path.getsize(src_path)) == src_hash:
+                unchanged = unchanged + 1
+            else:
+                dst_dir = os.path.dirname(dst_path)
+                if not os.path.exists(dst_dir):
+                    os.makedirs(dst_dir)
+                replace_file(src_path, dst_path)
+                changed.append(rel_path)
+            dst_stat = os.stat(dst_path)
+            self.manifest_files[rel_path] = {"sha1": src_hash, "size": dst_stat.st_size, "mtime": dst_stat.st_mtime}
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+        # 已经被删除的输出文件不再出现在清单里
+        for rel_path in list(self.manifest_files.keys()):
+            if not os.path.exists(os.path.join(self.output_path, rel_path)):
+                del self.manifest_files[rel_path]
+
+        if changed or old_files != self.manifest_files or not os.path.exists(self.manifest_file):
+            manifest_dir = os.path.dirname(self.manifest_file)
+            if manifest_dir and not os.path.exists(manifest_dir):
+                os.makedirs(manifest_dir)
+            atomic_write_text(
+                self.manifest_file,
+                json.dumps(
+                    {
+                        "version": OUTPUT_MANIFEST_VERSION,
+                        "time": time.time(),
+                        "failed": failed,
+                        "changed": changed,
+                        "files": self.manifest_files,
+                    },
+                    indent=2,
+                    sort_keys=True,
+                ),
+            )
+        return {"changed": changed, "unchanged": unchanged}
@@ -0,0 +1,539 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+
+from xresconv_incremental import (
+    atomic_write_text,
+    command_key,
+    hash_file_content,
+    hash_text_list,
+    item_input_candidates,
+    resolve_item_input_files,
+)
+from xresconv_loader import load_include_graph
+
+# ==================================================================================
+# 转换计划: 解析转换列表(包括所有include的文件)得到的全局配置和转换项，以及由它们生成的转换命令
+# 计划里的相对路径都相对于 base_dir(转换列表所在目录下的 work_dir)，不依赖进程的当前目录
+
+PLAN_CACHE_VERSION = 3
+
+# 解析xml时会修改的全局配置
+PLAN_OPTION_KEYS = [
+    "work_dir",
+    "xresloader_path",
+    "args",
+    "ext_args_l1",
+    "java_options",
+    "default_scheme",
+    "data_version",
+    "output_matrix",
+    "protocol_files",
+    "data_source_dir",
+]
+
+xconv_split_by_spaces = re.compile("\\s+", re.IGNORECASE)
+
+
+def split_by_spaces(value):
+    return set(filter(lambda x: x, xconv_split_by_spaces.split(value.strip())))
+
+
+class OutputMatrixIndex:
+    """ output_type 的 tag/class 过滤条件的倒排索引，每个输出对应一个bit
+        输出有tag条件时转换项至少要有一个相同的tag，有class条件时至少要有一个相同的class
+    """
+
+    def __init__(self, output_matrix):
+        self.output_count = len(output_matrix)
+        self.tag_bits = {}
+        self.class_bits = {}
+        self.tag_required_bits = 0
+        self.class_required_bits = 0
+        for idx, item_output in enumerate(output_matrix):
+            bit = 1 << idx
+            if item_output.get("tags"):
+                self.tag_required_bits = self.tag_required_bits | bit
+                for tag in item_output["tags"]:
+                    self.tag_bits[tag] = self.tag_bits.get(tag, 0) | bit
+            if item_output.get("classes"):
+                self.class_required_bits = self.class_required_bits | bit
+                for class_name in item_output["classes"]:
+                    self.class_bits[class_name] = self.class_bits.get(class_name, 0) | bit
+        self.match_cache = {}
+
+    def match(self, tags, classes):
+        """ 返回转换项适用的输出下标，按 output_type 的配置顺序 """
+        cache_key = (frozenset(tags), frozenset(classes))
+        if cache_key in self.match_cache:
+            return self.match_cache[cache_key]
+
+        matched_tag_bits = 0
+        for tag in tags:
+            matched_tag_bits = matched_tag_bits | self.tag_bits.get(tag, 0)
+        matched_class_bits = 0
+        for class_name in classes:
+            matched_class_bits = matched_class_bits | self.class_bits.get(class_name, 0)
+        rejected_bits = (self.tag_required_bits & ~matched_tag_bits) | (self.class_required_bits & ~matched_class_bits)
+
+        ret = [idx for idx in range(0, self.output_count) if not (rejected_bits >> idx) & 1]
+        self.match_cache[cache_key] = ret
+        return ret
+
+
+class ConvertPlan:
+    def __init__(self, conv_list, rule_schemes=None, data_version=None):
+        self.conv_list = os.path.abspath(conv_list)
+        self.rule_schemes = list(rule_schemes or [])
+        self.options = {
+            "work_dir": ".",
+            "xresloader_path": "xresloader.jar",
+            "args": {},
+            "ext_args_l1": [],
+            "java_options": [],
+            "default_scheme": {},
+            "data_version": data_version,
+            "output_matrix": {"file_path": None, "outputs": []},
+            "protocol_files": {"file_path": None, "inputs": [], "paths": []},
+            "data_source_dir": {"file_path": None, "inputs": [], "paths": []},
+        }
+        self.items = []
+        self.xml_files = []
+        self.include_cycles = []
+        self.warnings = []
+        self.input_files_cache = {}
+
+    # ========================================= 加载 =========================================
+    def load(self, cache_file=None):
+        """ 加载转换列表，解析失败时抛出 ET.ParseError 或 EnvironmentError
+            指定了 cache_file 并且所有xml文件都没有变化时直接使用缓存，返回是否命中缓存
+        """
+        plan_cache = None
+        if cache_file:
+            # 命令行里会影响解析结果的参数也要作为缓存的key
+            plan_cache = PlanCache(cache_file, [self.conv_list, str(self.options["data_version"])] + self.rule_schemes)
+            cached_plan, cached_xml_files = plan_cache.load()
+            if cached_plan is not None:
+                restore_plan(self, cached_plan)
+                self.xml_files = cached_xml_files
+                return True
+
+        self.xml_files, global_nodes, list_item_nodes, self.include_cycles = load_include_graph(self.conv_list)
+        self.load_global_options(global_nodes)
+        self.load_list_item_nodes(list_item_nodes)
+        if plan_cache is not None:
+            plan_cache.save(compile_plan(self), self.xml_files)
+        return False
+
+    # global配置解析/合并
+    def load_global_options(self, gns):
+        options = self.options
+        for global_node in gns:
+            for global_option in global_node["node"]:
+                tag_name = global_option.tag.lower()
+                text_value = global_option.text
+                if text_value:
+                    trip_value = text_value.strip()
+                else:
+                    trip_value = None
+
+                if not trip_value:
+                    continue
+
+                if tag_name == "work_dir":
+                    options["work_dir"] = text_value
+
+                elif tag_name == "xresloader_path":
+                    options["xresloader_path"] = text_value
+
+                elif tag_name == "proto":
+                    options["args"]["-p"] = trip_value
+
+                elif tag_name == "output_type":
+                    if global_node["file_path"] != options["output_matrix"]["file_path"]:
+                        options["output_matrix"]["outputs"] = []
+                        options["output_matrix"]["file_path"] = global_node["file_path"]
+                    output_rule = {
+                        "type": trip_value,
+                        "rename": None,
+                        "tags": set(),
+                        "classes": set(),
+                    }
+                    rename_rule = global_option.get("rename")
+                    if rename_rule and rename_rule.strip():
+                        output_rule["rename"] = rename_rule
+                    tag_rule = global_option.get("tag")
+                    if tag_rule and tag_rule.strip():
+                        output_rule["tags"] = split_by_spaces(tag_rule)
+                    class_rule = global_option.get("class")
+                    if class_rule and class_rule.strip():
+                        output_rule["classes"] = split_by_spaces(class_rule)
+
+                    options["output_matrix"]["outputs"].append(output_rule)
+
+                elif tag_name == "proto_file":
+                    if global_node["file_path"] != options["protocol_files"]["file_path"]:
+                        options["protocol_files"]["inputs"] = []
+                        options["protocol_files"]["paths"] = []
+                        options["protocol_files"]["file_path"] = global_node["file_path"]
+                    options["protocol_files"]["inputs"].append("-f")
+                    options["protocol_files"]["inputs"].append('"' + text_value + '"')
+                    options["protocol_files"]["paths"].append(text_value)
+
+                elif tag_name == "output_dir":
+                    options["args"]["-o"] = '"' + text_value + '"'
+
+                elif tag_name == "data_src_dir" or tag_name == "data_source_dir":
+                    if global_node["file_path"] != options["data_source_dir"]["file_path"]:
+                        options["data_source_dir"]["inputs"] = []
+                        options["data_source_dir"]["paths"] = []
+                        options["data_source_dir"]["file_path"] = global_node["file_path"]
+                    options["data_source_dir"]["inputs"].append("-d")
+                    options["data_source_dir"]["inputs"].append('"' + text_value + '"')
+                    options["data_source_dir"]["paths"].append(text_value)
+                elif tag_name == "data_version":
+                    if options["data_version"] is None:
+                        options["data_version"] = text_value
+
+                elif tag_name == "rename":
+                    options["args"]["-n"] = '"' + trip_value + '"'
+
+                elif tag_name == "option":
+                    options["ext_args_l1"].append(trip_value)
+                elif tag_name == "java_option":
+                    options["java_options"].append(trip_value)
+                elif tag_name == "default_scheme":
+                    if "name" in global_option.attrib:
+                        scheme_key = global_option.attrib["name"]
+                        if scheme_key in options["default_scheme"]:
+                            options["default_scheme"][scheme_key].append(trip_value)
+                        else:
+                            options["default_scheme"][scheme_key] = [text_value]
+                else:
+                    self.warnings.append("unknown global configure " + tag_name)
+
+    # 转换项配置解析/合并
+    def load_list_item_nodes(self, lis):
+        for item_info in lis:
+            item = item_info["node"]
+            conv_item_obj = {
+                "name": None,
+                "file": False,
+                "scheme": False,
+                "options": [],
+                "enable": False,
+                "scheme_data": {},
+                "tags": set(),
+                "classes": set(),
+            }
+
+            if "name" in item.attrib:
+                conv_item_obj["name"] = item.attrib["name"]
+            if "file" in item.attrib:
+                conv_item_obj["file"] = item.attrib["file"]
+            if "scheme" in item.attrib:
+                conv_item_obj["scheme"] = item.attrib["scheme"]
+            if "tag" in item.attrib:
+                conv_item_obj["tags"] = split_by_spaces(item.attrib["tag"])
+            if "class" in item.attrib:
+                conv_item_obj["classes"] = split_by_spaces(item.attrib["class"])
+
+            # 局部选项
+            for local_option in item.findall("./option"):
+                text_value = local_option.text
+                if text_value:
+                    trip_value = text_value.strip()
+                else:
+                    trip_value = None
+
+                if not trip_value:
+                    continue
+
+                conv_item_obj["options"].append(trip_value)
+
+            # 局部选项
+            for local_option in item.findall("./scheme"):
+                text_value = local_option.text
+                if text_value:
+                    trip_value = text_value.strip()
+                else:
+                    trip_value = None
+
+                if not trip_value:
+                    continue
+
+                if "name" in local_option.attrib:
+                    scheme_key = local_option.attrib["name"]
+                    if scheme_key and scheme_key in conv_item_obj["scheme_data"]:
+                        conv_item_obj["scheme_data"][scheme_key].append(text_value)
+                    else:
+                        conv_item_obj["scheme_data"][scheme_key] = [text_value]
+            for key in self.options["default_scheme"]:
+                if key not in conv_item_obj["scheme_data"]:
+                    conv_item_obj["scheme_data"][key] = self.options["default_scheme"][key]
+
+            # 转换规则
+            if not self.rule_schemes or conv_item_obj["scheme"] in self.rule_schemes:
+                conv_item_obj["enable"] = True
+
+            self.items.append(conv_item_obj)
+
+    # ========================================= 路径 =========================================
+    @property
+    def base_dir(self):
+        return os.path.normpath(os.path.join(os.path.dirname(self.conv_list), self.options["work_dir"]))
+
+    def path(self, file_path):
+        """ 把相对于 base_dir 的路径转成绝对路径 """
+        return os.path.normpath(os.path.join(self.base_dir, file_path))
+
+    def item_input_files(self, conv_item):
+        """ 转换项依赖的并且存在的数据源文件(相对于 base_dir)，结果会缓存到 reset_input_files 为止 """
+        item_key = id(conv_item)
+        if item_key not in self.input_files_cache:
+            self.input_files_cache[item_key] = resolve_item_input_files(
+                conv_item, self.options["data_source_dir"]["paths"], self.base_dir
+            )
+        return self.input_files_cache[item_key]
+
+    def item_input_candidates(self, conv_item):
+        return [self.path(x) for x in item_input_candidates(conv_item, self.options["data_source_dir"]["paths"])]
+
+    def reset_input_files(self):
+        self.input_files_cache = {}
+
+    # ========================================= 生成转换命令 =========================================
+    def select_items(self, names=None, schemes=None, tags=None, classes=None):
+        """ 按名称(name或file属性)、scheme、tag和class筛选启用的转换项，每个条件内任意一个匹配即可 """
+        ret = []
+        for conv_item in self.items:
+            if not conv_item["enable"]:
+                continue
+            if names and conv_item["name"] not in names and conv_item["file"] not in names:
+                continue
+            if schemes and conv_item["scheme"] not in schemes:
+                continue
+            if tags and not (conv_item["tags"] & set(tags)):
+                continue
+            if classes and not (conv_item["classes"] & set(classes)):
+                continue
+            ret.append(conv_item)
+        return ret
+
+    def build_commands(self, items=None, ext_args=None, output_dir=None):
+        """ 生成转换命令，items 为空时使用所有启用的转换项，ext_args 会追加到每个命令的最后
+            output_dir 不为空时替换命令里的输出目录(-o)，key 仍然按原来的输出目录计算
+            每个命令是 {"args", "item", "type", "key"}
+        """
+        if items is None:
+            items = self.items
+
+        # ++++++++++++++++++++++++++++++++++++++++++ 全局命令和配置 ++++++++++++++++++++++++++++++++++++++++++
+        global_cmd_args_map = self.options["args"].copy()
+        if not self.options["data_version"] is None:
+            global_cmd_args_map["-a"] = '"' + str(self.options["data_version"]) + '"'
+
+        global_cmd_args_prefix_array = []
+        global_cmd_args_suffix_array = []
+
+        if len(self.options["ext_args_l1"]) > 0:
+            global_cmd_args_prefix_array.extend(self.options["ext_args_l1"])
+
+        # ++++++++++++++++++++++++++++++++++++++++++ 命令行参数 ++++++++++++++++++++++++++++++++++++++++++
+        if ext_args:
+            global_cmd_args_suffix_array.extend(ext_args)
+
+        # 每个输出的命令前缀只生成一次，转换项的命令后缀也只生成一次，命令就是两者的拼接
+        output_matrix = self.options["output_matrix"]["outputs"]
+        if not output_matrix:
+            output_matrix = [{}]
+        output_index = OutputMatrixIndex(output_matrix)
+        output_prefixes = []
+        key_prefixes = []
+        for item_output in output_matrix:
+            item_cmd_args_array = []
+            item_cmd_args_array.extend(global_cmd_args_prefix_array)
+            item_cmd_args_array.extend(self.options["protocol_files"]["inputs"])
+            item_cmd_args_array.extend(self.options["data_source_dir"]["inputs"])
+
+            # merge global options
+            item_cmd_args_map = global_cmd_args_map.copy()
+            if "type" in item_output and item_output["type"]:
+                item_cmd_args_map["-t"] = item_output["type"]
+            if "rename" in item_output and item_output["rename"]:
+                item_cmd_args_map["-n"] = '"{0}"'.format(item_output["rename"])
+
+            key_cmd_args_array = list(item_cmd_args_array)
+            for key in item_cmd_args_map:
+                key_cmd_args_array.append(key)
+                key_cmd_args_array.append(item_cmd_args_map[key])
+            key_prefixes.append(key_cmd_args_array)
+            if output_dir is None:
+                output_prefixes.append(key_cmd_args_array)
+                continue
+
+            item_cmd_args_map["-o"] = '"{0}"'.format(output_dir)
+            for key in item_cmd_args_map:
+                item_cmd_args_array.append(key)
+                item_cmd_args_array.append(item_cmd_args_map[key])
+            output_prefixes.append(item_cmd_args_array)
+
+        cmd_list = []
+        for conv_item in items:
+            if not conv_item["enable"]:
+                continue
+
+            output_indexes = output_index.match(conv_item["tags"], conv_item["classes"])
+            if not output_indexes:
+                continue
+
+            item_cmd_args_suffix = []
+            # add item options
+            if conv_item["options"]:
+                item_cmd_args_suffix.extend(conv_item["options"])
+
+            # add item scheme
+            if conv_item["file"] and conv_item["scheme"]:
+                item_cmd_args_suffix.append("-s")
+                item_cmd_args_suffix.append('"{:s}"'.format(conv_item["file"]))
+                item_cmd_args_suffix.append("-m")
+                item_cmd_args_suffix.append('"{:s}"'.format(conv_item["scheme"]))
+            else:
+                for key in conv_item["scheme_data"]:
+                    for opt_val in conv_item["scheme_data"][key]:
+                        item_cmd_args_suffix.append("-m")
+                        item_cmd_args_suffix.append('"{:s}={:s}"'.format(key, opt_val))
+
+            item_cmd_args_suffix.extend(global_cmd_args_suffix_array)
+            for output_idx in output_indexes:
+                item_cmd_args_array = output_prefixes[output_idx] + item_cmd_args_suffix
+                if output_dir is None:
+                    item_cmd_key = command_key(item_cmd_args_array)
+                else:
+                    item_cmd_key = command_key(key_prefixes[output_idx] + item_cmd_args_suffix)
+                cmd_list.append(
+                    {
+                        "args": item_cmd_args_array,
+                        "item": conv_item,
+                        "type": output_matrix[output_idx].get("type"),
+                        "key": item_cmd_key,
+                    }
+                )
+        return cmd_list
+
+
+# ==================================================================================
+# 转换计划缓存: 把解析完的全局配置和转换项保存下来，所有xml文件都没有变化时直接读取缓存，跳过xml解析
+# 文件检查和增量转表一样先比较 mtime+size，不一致时再比较内容hash
+
+
+def encode_rule_sets(rule):
+    ret = dict(rule)
+    for key in ["tags", "classes"]:
+        if key in ret:
+            ret[key] = sorted(ret[key])
+    return ret
+
+
+def decode_rule_sets(rule):
+    ret = dict(rule)
+    for key in ["tags", "classes"]:
+        if key in ret:
+            ret[key] = set(ret[key])
+    return ret
+
+
+def compile_plan(plan):
+    options = {}
+    for key in PLAN_OPTION_KEYS:
+        options[key] = plan.options[key]
+    options["output_matrix"] = dict(plan.options["output_matrix"])
+    options["output_matrix"]["outputs"] = [encode_rule_sets(x) for x in plan.options["output_matrix"]["outputs"]]
+    # 命中缓存时也要再次输出解析过程中的警告
+    return {
+        "options": options,
+        "items": [encode_rule_sets(x) for x in plan.items],
+        "include_cycles": plan.include_cycles,
+        "warnings": plan.warnings,
+    }
+
+
+def restore_plan(plan, data):
+    for key in PLAN_OPTION_KEYS:
+        plan.options[key] = data["options"][key]
+    plan.options["output_matrix"]["outputs"] = [decode_rule_sets(x) for x in plan.options["output_matrix"]["outputs"]]
+    plan.items = [decode_rule_sets(x) for x in data["items"]]
+    plan.include_cycles = data["include_cycles"]
+    plan.warnings = data["warnings"]
+
+
+class PlanCache:
+    def __init__(self, file_path, key_values):
+        self.file_path = file_path
+        self.key = hash_text_list(key_values)
+
+    def load(self):
+        """ 返回 (计划, xml文件列表)，缓存不存在或者xml文件有变化时返回 (None, None) """
+        if not os.path.exists(self.file_path):
+            return None, None
+        try:
+            with open(self.file_path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (ValueError, EnvironmentError):
+            return None, None
+
+        if not isinstance(data, dict) or data.get("version") != PLAN_CACHE_VERSION or data.get("key") != self.key:
+            return None, None
+
+        rehashed = False
+        for file_state in data["files"]:
+            try:
+                st = os.stat(file_state["path"])
+            except EnvironmentError:
+                return None, None
+            # 和git的racy检查一样，写缓存时刚修改过的文件不能只信任mtime
+            if (
+                file_state["mtime"] == st.st_mtime
+                and file_state["size"] == st.st_size
+                and st.st_mtime < data["timestamp"]
+            ):
+                continue
+            try:
+                if hash_file_content(file_state["path"]) != file_state["hash"]:
+                    return None, None
+            except EnvironmentError:
+                return None, None
+            rehashed = True
+
+        xml_files = [x["path"] for x in data["files"]]
+        # 只是修改时间变了，刷新一下缓存，下次只需要比较 mtime+size
+        if rehashed:
+            self.save(data["plan"], xml_files)
+        return data["plan"], xml_files
+
+    def save(self, plan, xml_files):
+        files = []
+        for file_path in xml_files:
+            try:
+                st = os.stat(file_path)
+                content_hash = hash_file_content(file_path)
+            except EnvironmentError:
+                return False
+            files.append({"path": file_path, "mtime": st.st_mtime, "size": st.st_size, "hash": content_hash})
+        data = {
+            "version": PLAN_CACHE_VERSION,
+            "key": self.key,
+            "timestamp": time.time(),
+            "files": files,
+            "plan": plan,
+        }
+        # 不能排序key，全局参数和scheme的顺序会影响生成的命令
+        try:
+            atomic_write_text(self.file_path, json.dumps(data, separators=(",", ":")))
+        except EnvironmentError:
+            return False
+        return True
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import threading
+from multiprocessing import cpu_count
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+# ==================================================================================
+# 机器资源探测: CPU核数、可用内存(支持cgroup限制)、java堆大小和每个JVM绑定的CPU
+
+JVM_DEFAULT_HEAP_MB = 1024
+JVM_NON_HEAP_OVERHEAD_MB = 256
+MEMORY_RESERVED_MB = 512
+# 自动设置的java堆大小范围，按 JVM_HEAP_ALIGN_MB 对齐
+JVM_MIN_AUTO_HEAP_MB = 256
+JVM_MAX_AUTO_HEAP_MB = 4096
+JVM_HEAP_ALIGN_MB = 64
+
+# 绑定CPU时按每个JVM分到的CPU数设置的java参数，java参数里已经有的不会覆盖
+JVM_CPU_OPTION_NAMES = ["ActiveProcessorCount", "ParallelGCThreads", "CICompilerCount"]
+# 分层编译至少需要两个编译线程
+JVM_MIN_COMPILER_COUNT = 2
+
+java_heap_option_re = re.compile("^-?Xmx=?(\\d+)([kKmMgGtT]?)$")
+
+
+def read_text_file(file_path):
+    try:
+        with open(file_path, "r") as f:
+            return f.read().strip()
+    except EnvironmentError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """ cgroup的CPU配额，没有限制时返回None """
+    cpu_max = read_text_file("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        values = cpu_max.split()
+        if len(values) == 2 and values[0] != "max" and int(values[1]) > 0:
+            return float(values[0]) / float(values[1])
+        return None
+
+    quota = read_text_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_text_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period:
+        try:
+            if int(quota) > 0 and int(period) > 0:
+                return float(quota) / float(period)
+        except ValueError:
+            pass
+    return None
+
+
+def available_cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        ret = len(os.sched_getaffinity(0))
+    else:
+        ret = cpu_count()
+
+    cgroup_limit = cgroup_cpu_limit()
+    if cgroup_limit is not None:
+        ret = min(ret, max(1, int(cgroup_limit + 0.5)))
+    return max(1, ret)
+
+
+def meminfo_available_mb():
+    meminfo = read_text_file("/proc/meminfo")
+    if not meminfo:
+        return None
+    values = {}
+    for line in meminfo.splitlines():
+        key_value = line.split(":", 1)
+        if len(key_value) != 2:
+            continue
+        number = key_value[1].strip().split()
+        if number:
+            try:
+                values[key_value[0].strip()] = int(number[0])
+            except ValueError:
+                pass
+    if "MemAvailable" in values:
+        return values["MemAvailable"] // 1024
+    if "MemFree" in values:
+        return (values["MemFree"] + values.get("Cached", 0) + values.get("Buffers", 0)) // 1024
+    return None
+
+
+def cgroup_memory_available_mb():
+    """ cgroup的内存限制减去已用内存，没有限制时返回None """
+    for limit_path, usage_path in [
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+    ]:
+        limit = read_text_file(limit_path)
+        if not limit or limit == "max":
+            continue
+        try:
+            limit = int(limit)
+            usage = int(read_text_file(usage_path) or 0)
+        except ValueError:
+            continue
+        # cgroup v1 没有限制时是一个接近 2^63 的数
+        if limit >= (1 << 60):
+            continue
+        return max(0, limit - usage) // (1024 * 1024)
+    return None
+
+
+def available_memory_mb():
+    ret = meminfo_available_mb()
+    cgroup_available = cgroup_memory_available_mb()
+    if cgroup_available is not None and (ret is None or cgroup_available < ret):
+        ret = cgroup_available
+    return ret
+
+
+def children_peak_rss_bytes():
+    """ 已经退出并回收的子进程(JVM)里最大的常驻内存，不支持时返回None """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if peak_rss <= 0:
+        return None
+    # macOS下单位是字节，其他平台是KB
+    if "darwin" == sys.platform:
+        return peak_rss
+    return peak_rss * 1024
+
+
+def parse_java_heap_mb(java_options):
+    """ 从java参数中找最后一个 -Xmx(也支持 -j Xmx=2048m 的写法)，单位MB，没有时返回None """
+    ret = None
+    for java_option in java_options:
+        mat = java_heap_option_re.match(java_option.strip())
+        if not mat:
+            continue
+        value = int(mat.group(1))
+        unit = mat.group(2).lower()
+        if unit == "k":
+            ret = value // 1024
+        elif unit == "m":
+            ret = value
+        elif unit == "g":
+            ret = value * 1024
+        elif unit == "t":
+            ret = value * 1024 * 1024
+        else:
+            ret = value // (1024 * 1024)
+    return ret
+
+
+def jvm_footprint_mb(heap_mb):
+    if heap_mb is None:
+        heap_mb = JVM_DEFAULT_HEAP_MB
+    return heap_mb + JVM_NON_HEAP_OVERHEAD_MB
+
+
+def insert_java_option(java_options, java_option):
+    """ 插入到 -jar 前面，-jar 后面的参数会传给xresloader """
+    if "-jar" in java_options:
+        jar_idx = java_options.index("-jar")
+        return java_options[0:jar_idx] + [java_option] + java_options[jar_idx:]
+    return java_options + [java_option]
+
+
+# ========================================= 内存限制 =========================================
+def plan_jvm_memory(java_options, parallelism, memory_mb, jvms_per_worker=1):
+    """ 根据可用内存确定java堆大小和最多能同时运行的JVM数量
+        java参数里没有 -Xmx 时按并发数平分可用内存，返回 {"parallelism", "heap_option", "footprint_mb", "budget_mb", "reasons"}
+        jvms_per_worker 是每个worker同时存在的JVM数量，预先启动JVM时是2
+    """
+    reasons = []
+    budget_mb = max(0, memory_mb - MEMORY_RESERVED_MB)
+    heap_mb = parse_java_heap_mb(java_options)
+    heap_option = None
+    if heap_mb is None:
+        heap_mb = budget_mb // max(1, parallelism * jvms_per_worker) - JVM_NON_HEAP_OVERHEAD_MB
+        heap_mb = min(JVM_MAX_AUTO_HEAP_MB, max(JVM_MIN_AUTO_HEAP_MB, heap_mb // JVM_HEAP_ALIGN_MB * JVM_HEAP_ALIGN_MB))
+        heap_option = "-Xmx{0}m".format(heap_mb)
+        reasons.append("heap: auto {0}MB".format(heap_mb))
+    else:
+        reasons.append("heap: {0}MB".format(heap_mb))
+
+    footprint_mb = jvm_footprint_mb(heap_mb)
+    max_jvms = budget_mb // footprint_mb
+    reasons.append(
+        "memory: {0}MB - {1}MB reserved, {2}MB per JVM -> {3} JVM(s)".format(
+            memory_mb, MEMORY_RESERVED_MB, footprint_mb, max_jvms
+        )
+    )
+    if max_jvms < 1:
+        reasons.append("not enough memory for one JVM, run one anyway")
+    max_parallelism = max(1, max_jvms // jvms_per_worker)
+    if parallelism > max_parallelism:
+        reasons.append("parallelism: {0} -> {1}".format(parallelism, max_parallelism))
+        parallelism = max_parallelism
+    return {
+        "parallelism": parallelism,
+        "heap_option": heap_option,
+        "footprint_mb": footprint_mb,
+        "budget_mb": budget_mb,
+        "reasons": reasons,
+    }
+
+
+class MemoryBudget:
+    """ 启动JVM前申请内存，超出预算时排队等待其他JVM退出。没有JVM在运行时总是允许启动，避免单个JVM超出预算时死锁 """
+
+    def __init__(self, budget_mb):
+        self.budget_mb = budget_mb
+        self.used_mb = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, size_mb):
+        self.cond.acquire()
+        try:
+            while self.used_mb > 0 and self.used_mb + size_mb > self.budget_mb:
+                self.cond.wait()
+            self.used_mb = self.used_mb + size_mb
+        finally:
+            self.cond.release()
+
+    def release(self, size_mb):
+        self.cond.acquire()
+        try:
+            self.used_mb = self.used_mb - size_mb
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+
+# ========================================= CPU绑定 =========================================
+def cpu_topology_key(cpu):
+    """ 按 (物理CPU, 核心) 排序，同一个核心上的超线程和同一个物理CPU上的核心分到同一个JVM """
+    topology_dir = "/sys/devices/system/cpu/cpu{0}/topology".format(cpu)
+    package_id = read_text_file(os.path.join(topology_dir, "physical_package_id"))
+    core_id = read_text_file(os.path.join(topology_dir, "core_id"))
+    try:
+        return (int(package_id), int(core_id), cpu)
+    except (TypeError, ValueError):
+        return (0, cpu, cpu)
+
+
+def plan_cpu_pinning(parallelism):
+    """ 把当前进程可用的CPU分成 parallelism 份互不重叠的集合，返回 {"cpu_sets", "active_processors", "reasons"}
+        不支持 sched_setaffinity 时 cpu_sets 为空。JVM比CPU多时多个JVM共用一个CPU
+        active_processors 是每个JVM分到的CPU数，有cgroup配额时按配额平分
+    """
+    if not hasattr(os, "sched_setaffinity") or not hasattr(os, "sched_getaffinity"):
+        return {"cpu_sets": [], "active_processors": None, "reasons": ["sched_setaffinity is not available, disabled"]}
+
+    parallelism = max(1, parallelism)
+    cpus = sorted(os.sched_getaffinity(0), key=cpu_topology_key)
+    cpu_num = len(cpus)
+    reasons = []
+    if parallelism >= cpu_num:
+        cpu_sets = [[cpus[i % cpu_num]] for i in range(0, parallelism)]
+    else:
+        cpu_sets = [cpus[i * cpu_num // parallelism : (i + 1) * cpu_num // parallelism] for i in range(0, parallelism)]
+    active_processors = max(1, cpu_num // parallelism)
+    reasons.append("cpu: {0} -> {1} JVM(s) x {2}".format(cpu_num, parallelism, active_processors))
+
+    cgroup_limit = cgroup_cpu_limit()
+    if cgroup_limit is not None and cgroup_limit < cpu_num:
+        quota_processors = max(1, int(cgroup_limit / parallelism + 0.5))
+        if quota_processors < active_processors:
+            active_processors = quota_processors
+            reasons.append("cgroup quota: {0:.1f} -> {1} per JVM".format(cgroup_limit, active_processors))
+    return {"cpu_sets": cpu_sets, "active_processors": active_processors, "reasons": reasons}
+
+
+def cpu_pinning_java_options(java_options, active_processors):
+    """ 按每个JVM分到的CPU数设置GC和JIT线程数，返回新的java参数 """
+    values = {
+        "ActiveProcessorCount": active_processors,
+        "ParallelGCThreads": active_processors,
+        "CICompilerCount": max(JVM_MIN_COMPILER_COUNT, active_processors // 2),
+    }
+    for name in JVM_CPU_OPTION_NAMES:
+        prefix = "-XX:{0}=".format(name)
+        if [x for x in java_options if x.strip().startswith(prefix)]:
+            continue
+        java_options = insert_java_option(java_options, "{0}{1}".format(prefix, values[name]))
+    return java_options
+
+
+def pin_cpu_func(cpu_set):
+    """ 用作 Popen 的 preexec_fn ，在子进程里exec之前绑定CPU，JVM启动的所有线程都会继承 """
+    if not cpu_set:
+        return None
+
+    def preexec_func():
+        # cpuset在运行过程中变化时不绑定，不影响JVM启动
+        try:
+            os.sched_setaffinity(0, cpu_set)
+        except EnvironmentError:
+            pass
+
+    return preexec_func
+
+
+def jvm_preexec_func(cpu_set=None):
+    """ 本地JVM的 preexec_fn ，JVM放到单独的进程组里，终端的Ctrl-C不会直接发给JVM，统一由执行器取消并结束JVM
+        否则JVM可能在执行器知道转换被取消之前就退出了，里面的命令会被当成失败
+    """
+    pin_func = pin_cpu_func(cpu_set)
+    if not hasattr(os, "setpgid"):
+        return pin_func
+
+    def preexec_func():
+        os.setpgid(0, 0)
+        if pin_func is not None:
+            pin_func()
+
+    return preexec_func
+
+
+# ========================================= 自动并发数 =========================================
+def throughput_by_parallelism(run_records, max_runs=20):
+    samples = {}
+    for record in run_records[-max_runs:]:
+        wall_time = record.get("wall_time", 0.0)
+        commands = record.get("commands", 0)
+        parallelism = record.get("parallelism")
+        if not parallelism or wall_time <= 0 or commands <= 0 or record.get("failed", 0) > 0:
+            continue
+        if record.get("cancelled"):
+            continue
+        samples.setdefault(parallelism, []).append(commands / wall_time)
+
+    ret = {}
+    for parallelism in samples:
+        ret[parallelism] = sum(samples[parallelism]) / len(samples[parallelism])
+    return ret
+
+
+def auto_parallelism(java_options, job_count, run_records):
+    """ 返回 (并发数, 决策说明) """
+    reasons = []
+    cpu_num = available_cpu_count()
+    # 每个JVM还有GC和JIT线程，按两个核一个JVM计算
+    limit = max(1, cpu_num // 2)
+    reasons.append("cpu: {0} -> {1}".format(cpu_num, limit))
+
+    memory_mb = available_memory_mb()
+    if memory_mb is not None:
+        footprint_mb = jvm_footprint_mb(parse_java_heap_mb(java_options))
+        memory_limit = max(1, (memory_mb - MEMORY_RESERVED_MB) // footprint_mb)
+        limit = min(limit, memory_limit)
+        reasons.append("memory: {0}MB / {1}MB per JVM -> {2}".format(memory_mb, footprint_mb, memory_limit))
+
+    if job_count > 0 and job_count < limit:
+        limit = job_count
+        reasons.append("jobs: {0}".format(job_count))
+
+    # 根据历史吞吐量爬山: 只试过一个并发数时再试一半，否则用吞吐量最高的，最高的在边界上时继续往上试
+    throughput = throughput_by_parallelism(run_records)
+    tried = [x for x in throughput if x <= limit]
+    ret = limit
+    if tried:
+        best = max(tried, key=lambda x: throughput[x])
+        if len(tried) == 1 and best > 1:
+            ret = max(1, best // 2)
+        elif best == max(tried) and best < limit:
+            ret = min(limit, best * 2)
+        else:
+            ret = best
+        reasons.append(
+            "history: {0}".format(
+                ", ".join(["{0}={1:.2f}cmd/s".format(x, throughput[x]) for x in sorted(tried)])
+            )
+        )
+
+    return ret, reasons
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from xresconv_incremental import atomic_write_text
+
+# ==================================================================================
+# 转换结果归属
+# xresloader 的返回码是这个JVM里失败的命令数量，一个批次的结果是 {"cmds": [...], "failed": 失败数量}
+# failed 为0时整批都成功，等于命令数时整批都失败，否则需要把批次拆小放到新的JVM里重试才能知道是哪个命令失败
+# cancelled 为True的批次是取消转换时被结束的JVM，failed 只包含确定失败的数量，其他命令的结果未知
+
+
+def split_failed_batch(cmds, chunk_count):
+    """ 把失败的批次拆成最多 chunk_count 份，每份在一个新的JVM里重试 """
+    chunk_count = max(1, min(chunk_count, len(cmds)))
+    chunks = []
+    start = 0
+    for idx in range(0, chunk_count):
+        end = start + (len(cmds) - start) // (chunk_count - idx)
+        if end > start:
+            chunks.append(cmds[start:end])
+        start = end
+    return chunks
+
+
+def is_batch_attributed(batch):
+    return batch["failed"] <= 0 or batch["failed"] >= len(batch["cmds"])
+
+
+def failed_batches(batch_results):
+    return [x for x in batch_results if x["failed"] > 0]
+
+
+def failed_job_count(batch_results):
+    ret = 0
+    for batch in failed_batches(batch_results):
+        ret = ret + min(batch["failed"], max(1, len(batch["cmds"])))
+    return ret
+
+
+def failure_records(batch_results):
+    ret = []
+    for batch in failed_batches(batch_results):
+        for cmd in batch["cmds"]:
+            ret.append(
+                {
+                    "key": cmd["key"],
+                    "name": cmd["item"]["name"] or cmd["item"]["file"] or None,
+                    "type": cmd["type"],
+                    "command": " ".join(cmd["args"]),
+                    "attributed": is_batch_attributed(batch),
+                    "batch_size": len(batch["cmds"]),
+                    "batch_failed": batch["failed"],
+                }
+            )
+    return ret
+
+
+def write_failure_list(file_path, run_id, command_count, batch_results):
+    data = {
+        "run": run_id,
+        "commands": command_count,
+        "failed": failed_job_count(batch_results),
+        "failures": failure_records(batch_results),
+    }
+    atomic_write_text(file_path, json.dumps(data, indent=2, sort_keys=True))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import heapq
+
+# ==================================================================================
+# 按预估耗时排序转换命令(LPT, 最长任务优先)，减少并行转表时最后只剩一个JVM在跑大表的情况
+# 有历史记录时使用上次的耗时，没有时按数据源文件大小估算
+
+
+def item_input_size(input_files):
+    total_size = 0
+    for input_file in input_files:
+        try:
+            total_size = total_size + os.path.getsize(input_file)
+        except EnvironmentError:
+            pass
+    return total_size
+
+
+def estimate_command_costs(cmd_list, durations, input_size_func):
+    """ 给每个命令设置 cmd["cost"]，单位是秒(没有任何历史记录时退化为文件大小) """
+    item_sizes = {}
+    known_duration = 0.0
+    known_size = 0
+    known_count = 0
+    for cmd in cmd_list:
+        item_key = id(cmd["item"])
+        if item_key not in item_sizes:
+            item_sizes[item_key] = input_size_func(cmd["item"])
+        if cmd["key"] in durations:
+            known_duration = known_duration + durations[cmd["key"]]
+            known_size = known_size + item_sizes[item_key]
+            known_count = known_count + 1
+
+    # 用有记录的命令换算出 耗时/字节，用于估算没有记录的命令
+    seconds_per_byte = None
+    if known_count > 0 and known_size > 0:
+        seconds_per_byte = known_duration / known_size
+    if known_count > 0:
+        default_cost = known_duration / known_count
+    elif item_sizes:
+        default_cost = float(sum(item_sizes.values())) / len(item_sizes)
+    else:
+        default_cost = 1.0
+
+    for cmd in cmd_list:
+        size = item_sizes[id(cmd["item"])]
+        if cmd["key"] in durations:
+            cmd["cost"] = durations[cmd["key"]]
+        elif known_count > 0 and seconds_per_byte is not None and size > 0:
+            cmd["cost"] = size * seconds_per_byte
+        elif known_count == 0 and size > 0:
+            cmd["cost"] = float(size)
+        else:
+            cmd["cost"] = default_cost
+
+
+def group_commands(cmd_list, group_key_func):
+    """ 分组后按原顺序返回 [{"key", "cost", "cmds"}]，同一组的命令会在同一个JVM里连续执行 """
+    groups = []
+    group_index = {}
+    for cmd in cmd_list:
+        group_key = group_key_func(cmd)
+        if group_key not in group_index:
+            group_index[group_key] = len(groups)
+            groups.append({"key": group_key, "cost": 0.0, "cmds": []})
+        group = groups[group_index[group_key]]
+        group["cost"] = group["cost"] + cmd.get("cost", 1.0)
+        group["cmds"].append(cmd)
+    return groups
+
+
+def split_large_groups(groups, max_cost):
+    """ 超过 max_cost 的组拆开，避免一个特别大的组让其他JVM空等 """
+    ret = []
+    for group in groups:
+        if group["cost"] <= max_cost or len(group["cmds"]) <= 1:
+            ret.append(group)
+            continue
+        piece = {"key": group["key"], "cost": 0.0, "cmds": []}
+        for cmd in group["cmds"]:
+            cmd_cost = cmd.get("cost", 1.0)
+            if piece["cmds"] and piece["cost"] + cmd_cost > max_cost:
+                ret.append(piece)
+                piece = {"key": group["key"], "cost": 0.0, "cmds": []}
+            piece["cost"] = piece["cost"] + cmd_cost
+            piece["cmds"].append(cmd)
+        if piece["cmds"]:
+            ret.append(piece)
+    return ret
+
+
+def assign_by_cost(groups, worker_count):
+    """ LPT: 从耗时最大的组开始，每次分配给当前总耗时最小的worker，返回每个worker的组队列 """
+    worker_count = max(1, worker_count)
+    queues = [[] for _ in range(0, worker_count)]
+    loads = [(0.0, idx) for idx in range(0, worker_count)]
+    for group in sorted(groups, key=lambda x: x["cost"], reverse=True):
+        load, idx = heapq.heappop(loads)
+        queues[idx].append(group)
+        heapq.heappush(loads, (load + group["cost"], idx))
+    return queues
+
+
+def split_session_durations(cmds, batch_sizes, drain_times, exit_time, duration):
+    """ 返回每个命令的 [(耗时, 是否是估算值)]
+        按完成情况分发时，JVM读走下一批命令的时间就是上一批命令执行完的时间，最后一批到JVM退出为止
+        只有一个命令的批次(或者整个JVM只执行了一个命令)的耗时是准确的，其他情况按预估耗时的比例分摊
+    """
+    if batch_sizes and len(drain_times) == len(batch_sizes):
+        ret = []
+        offset = 0
+        for i, batch_size in enumerate(batch_sizes):
+            if i + 1 < len(drain_times):
+                batch_duration = max(0.0, drain_times[i + 1] - drain_times[i])
+            else:
+                batch_duration = max(0.0, exit_time - drain_times[i])
+            if batch_size == 1:
+                ret.append((batch_duration, False))
+            else:
+                batch_cmds = cmds[offset : offset + batch_size]
+                ret.extend([(x, True) for x in split_duration_by_cost(batch_cmds, batch_duration)])
+            offset = offset + batch_size
+        return ret
+    if len(cmds) == 1:
+        return [(duration, False)]
+    return [(x, True) for x in split_duration_by_cost(cmds, duration)]
+
+
+def split_duration_by_cost(cmds, duration):
+    """ xresloader 只能统计整个JVM的耗时，按预估耗时的比例分摊到每个命令上 """
+    total_cost = 0.0
+    for cmd in cmds:
+        total_cost = total_cost + cmd.get("cost", 0.0)
+    ret = []
+    for cmd in cmds:
+        if total_cost > 0:
+            ret.append(duration * cmd.get("cost", 0.0) / total_cost)
+        else:
+            ret.append(duration / len(cmds))
+    return ret
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+
+from xresconv_incremental import atomic_write_text
+
+# ==================================================================================
+# 转换过程的时间线: 导出 Chrome trace event 格式的json，可以用 chrome://tracing 或 Perfetto 打开
+# 主线程一个轨道(加载转换列表、生成命令、分发和等待所有JVM结束)
+# 每个worker两个轨道: JVM轨道(启动、写入每个批次、等待退出、转发剩余输出)和命令轨道
+# xresloader 只返回失败数量，命令轨道上的耗时是按预估耗时比例分摊的，只有一个JVM只执行一个命令时才是准确的
+
+TRACE_PID = 1
+TRACE_TID_MAIN = 0
+
+
+def worker_jvm_tid(worker_idx):
+    return 1 + worker_idx * 2
+
+
+def worker_command_tid(worker_idx):
+    return 2 + worker_idx * 2
+
+
+class TraceRecorder:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.start_time = time.time()
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.set_thread_name(TRACE_TID_MAIN, "xresconv-cli")
+
+    def to_us(self, timepoint):
+        return int((timepoint - self.start_time) * 1000000)
+
+    def set_thread_name(self, tid, name):
+        self.lock.acquire()
+        try:
+            if tid in self.thread_names:
+                return
+            self.thread_names[tid] = name
+            self.events.append({"name": "thread_name", "ph": "M", "pid": TRACE_PID, "tid": tid, "args": {"name": name}})
+            self.events.append(
+                {"name": "thread_sort_index", "ph": "M", "pid": TRACE_PID, "tid": tid, "args": {"sort_index": tid}}
+            )
+        finally:
+            self.lock.release()
+
+    def register_worker(self, worker_idx, name=None):
+        if not name:
+            name = "worker {0}".format(worker_idx)
+        self.set_thread_name(worker_jvm_tid(worker_idx), "{0} JVM".format(name))
+        self.set_thread_name(worker_command_tid(worker_idx), "{0} commands".format(name))
+
+    def add_span(self, name, category, tid, start_time, end_time, args=None):
+        """ start_time 和 end_time 都是 time.time() 的返回值 """
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "pid": TRACE_PID,
+            "tid": tid,
+            "ts": self.to_us(start_time),
+            "dur": max(0, self.to_us(end_time) - self.to_us(start_time)),
+        }
+        if args:
+            event["args"] = args
+        self.lock.acquire()
+        self.events.append(event)
+        self.lock.release()
+
+    def save(self):
+        self.lock.acquire()
+        try:
+            content = json.dumps(
+                {
+                    "traceEvents": self.events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"start_time": self.start_time, "pid": os.getpid()},
+                }
+            )
+        finally:
+            self.lock.release()
+        atomic_write_text(self.file_path, content)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# ==================================================================================
+# 文件变化监听: Linux下使用inotify监听文件所在的目录，其他平台或inotify不可用时轮询文件的mtime和大小
+# 编辑器保存文件时经常是写临时文件再改名，所以监听目录而不是文件本身
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0x00080000
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+def normalize_watch_path(file_path):
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+class InotifyWatcher:
+    name = "inotify"
+
+    def __init__(self, dirs):
+        if not sys.platform.startswith("linux"):
+            raise EnvironmentError(errno.ENOSYS, "inotify is only available on linux")
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise EnvironmentError(err, os.strerror(err))
+        self.watch_dirs = {}
+        fs_encoding = sys.getfilesystemencoding()
+        for watch_dir in dirs:
+            if not os.path.isdir(watch_dir):
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, watch_dir.encode(fs_encoding), IN_WATCH_MASK | IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                self.close()
+                raise EnvironmentError(err, os.strerror(err))
+            self.watch_dirs[wd] = watch_dir
+        self.overflow = False
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def poll(self, timeout):
+        """ 返回超时时间内变化的文件路径集合 """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        ret = set()
+        offset = 0
+        while offset + INOTIFY_EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset = offset + INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset = offset + name_len
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if wd in self.watch_dirs and name:
+                file_name = name.decode(sys.getfilesystemencoding())
+                ret.add(normalize_watch_path(os.path.join(self.watch_dirs[wd], file_name)))
+        return ret
+
+
+class PollingWatcher:
+    name = "polling"
+
+    def __init__(self, files, interval):
+        self.files = list(files)
+        self.interval = interval
+        self.overflow = False
+        self.snapshot = self._snapshot()
+
+    def close(self):
+        pass
+
+    def _snapshot(self):
+        ret = {}
+        for file_path in self.files:
+            try:
+                st = os.stat(file_path)
+                ret[file_path] = (st.st_mtime, st.st_size)
+            except EnvironmentError:
+                ret[file_path] = None
+        return ret
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._snapshot()
+        ret = set([x for x in snapshot if snapshot[x] != self.snapshot.get(x)])
+        self.snapshot = snapshot
+        return ret
+
+
+class FileWatcher:
+    def __init__(self, files, poll_interval=1.0):
+        self.files = set([normalize_watch_path(x) for x in files])
+        try:
+            self.backend = InotifyWatcher(set([os.path.dirname(x) for x in self.files]))
+        except (EnvironmentError, AttributeError):
+            self.backend = PollingWatcher(self.files, poll_interval)
+
+    def close(self):
+        self.backend.close()
+
+    def wait_changes(self, debounce):
+        """ 阻塞直到有文件变化，然后等到连续 debounce 秒没有新的变化再返回所有变化的文件 """
+        changes = set()
+        while not changes:
+            changes = self.backend.poll(3600) & self.files
+            if self.backend.overflow:
+                self.backend.overflow = False
+                return set(self.files)
+
+        # 编辑器的临时文件、锁文件也会唤醒inotify，只有监听的文件变化时才重新计时
+        deadline = time.time() + debounce
+        while True:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            more_changes = self.backend.poll(timeout) & self.files
+            if self.backend.overflow:
+                self.backend.overflow = False
+                return set(self.files)
+            if more_changes:
+                changes = changes | more_changes
+                deadline = time.time() + debounce
+        return changes